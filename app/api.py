@@ -1,37 +1,96 @@
-from typing import Annotated
+import hashlib
+import json
+from typing import Annotated, Any, Awaitable, Callable, Literal, Optional, cast
+from uuid import UUID
 
-
-from app import config
-from app import db
+from app import config, exceptions
+from app import db, instrumentation
+from app.db import run, sync_bind
+from app.buffer import IngestBuffer
 from app.model import (
+    BulkValuesRequest,
+    BulkValuesResponse,
+    ConflictPolicy,
     CreateMetricRequest,
     EmailAndPassword,
+    IngestResponse,
+    InsertedValuesResponse,
     MetricEntity,
+    MetricOverviewResponse,
     MetricResponse,
+    MetricsQueryRequest,
+    RetentionRequest,
+    RetentionResponse,
+    StatsResponse,
     Tokens,
     UserEntity,
     UserRegisterRequest,
     ValueRequest,
 )
 from app import service
-from fastapi import APIRouter, Body, Depends
+from fastapi import APIRouter, Body, Depends, Header, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlmodel import Session
 
 router = APIRouter(prefix=config.API_PREFIX)
+internal_router = APIRouter(
+    prefix=config.INTERNAL_PREFIX,
+    dependencies=[Depends(service.require_internal_token)],
+)
+
+
+def _json(content: Any) -> bytes:
+    return json.dumps(
+        jsonable_encoder(content),
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode()
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags
+
+
+async def _conditional(
+    request: Request,
+    db: Session,
+    scope: str,
+    key: UUID,
+    render: Callable[[], Awaitable[tuple[Any, dict]]],
+) -> Response:
+    version = await run(db, service.get_version, scope, key)
+    query = sorted(request.query_params.multi_items())
+    variant = hashlib.sha256(f"{request.url.path}?{query}".encode()).hexdigest()[:16]
+    etag = f'"{version}-{variant}"'
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    cache_key = (scope, key, version, variant)
+    cached = service.response_cache.get(cache_key)
+    if cached is None:
+        content, headers = await render()
+        cached = (_json(content), headers)
+        service.response_cache.set(cache_key, cached, len(cached[0]))
+    body, headers = cached
+    return Response(
+        body, media_type="application/json", headers={**headers, "ETag": etag}
+    )
 
 
 @router.post(config.REGISTER_URI)
 async def register(
-    db: Annotated[Session, Depends(db.get_session)], payload: UserRegisterRequest
+    db: Annotated[Session, Depends(db.get_db)], payload: UserRegisterRequest
 ):
-    return service.create_user(db, payload)
+    return await service.create_user(db, payload)
 
 
 @router.post(config.LOGIN_URI)
-async def login(
-    db: Annotated[Session, Depends(db.get_session)], data: EmailAndPassword
-):
-    return service.login(db, data)
+async def login(db: Annotated[Session, Depends(db.get_db)], data: EmailAndPassword):
+    return await service.login(db, data)
 
 
 @router.post(config.REFRESH_TOKEN_URI)
@@ -44,32 +103,237 @@ async def refresh_token(
 @router.post(config.METRICS_URI, response_model=MetricResponse)
 async def create_metric(
     user: Annotated[UserEntity, Depends(service.get_user)],
-    db: Annotated[Session, Depends(db.get_session)],
+    db: Annotated[Session, Depends(db.get_db)],
     payload: CreateMetricRequest,
 ):
-    return service.create_metric(db, user, payload)
+    return await run(db, service.create_metric, user, payload)
 
 
-@router.get(config.METRICS_URI, response_model=list[MetricResponse])
+@router.get(
+    config.METRICS_URI,
+    response_model=list[MetricOverviewResponse] | list[MetricResponse],
+)
 async def get_metrics(
     user: Annotated[UserEntity, Depends(service.get_user)],
-    db: Annotated[Session, Depends(db.get_session)],
+    db: Annotated[Session, Depends(db.get_read_db)],
+    request: Request,
+    overview: bool = False,
+):
+    if overview:
+        # latest values change with every write, so this skips the user etag
+        return await run(db, service.get_metrics_overview, user)
+
+    async def render():
+        metrics = await run(db, service.get_metrics, user)
+        return [
+            MetricResponse.model_validate(metric, from_attributes=True)
+            for metric in metrics
+        ], {}
+
+    return await _conditional(request, db, service.USER_VERSIONS, user.id, render)
+
+
+@router.post(config.METRICS_QUERY_URI)
+async def query_metrics(
+    user: Annotated[UserEntity, Depends(service.get_user)],
+    db: Annotated[Session, Depends(db.get_read_db)],
+    query: MetricsQueryRequest,
 ):
-    return service.get_metrics(db, user)
+    return await run(db, service.query_metrics, user, query)
 
 
-@router.post(config.VALUES_URI)
+@router.post(config.VALUES_URI, response_model=InsertedValuesResponse)
 async def add_values(
-    db: Annotated[Session, Depends(db.get_session)],
+    db: Annotated[Session, Depends(db.get_db)],
     metric: Annotated[MetricEntity, Depends(service.get_metric)],
+    buffer: Annotated[Optional[IngestBuffer], Depends(service.get_ingest_buffer)],
+    response: Response,
     payload: list[ValueRequest] = Body(...),
+    wait: bool = True,
+    on_conflict: ConflictPolicy = config.VALUES_ON_CONFLICT,  # type: ignore
+):
+    if buffer is None:
+        inserted = await run(db, service.add_values, metric, payload, on_conflict)
+    else:
+        inserted = await service.buffer_values(
+            db, buffer, metric, payload, wait, on_conflict
+        )
+        if not wait:
+            response.status_code = 202
+    return InsertedValuesResponse(inserted=inserted)
+
+
+@router.post(config.METRICS_VALUES_URI, response_model=BulkValuesResponse)
+async def add_metrics_values(
+    user: Annotated[UserEntity, Depends(service.get_user)],
+    db: Annotated[Session, Depends(db.get_db)],
+    payload: BulkValuesRequest,
+    on_conflict: ConflictPolicy = config.VALUES_ON_CONFLICT,  # type: ignore
 ):
-    return service.add_values(db, metric, payload)
+    return await run(db, service.add_metrics_values, user, payload, on_conflict)
+
+
+@router.post(config.VALUES_INGEST_URI, response_model=IngestResponse)
+async def ingest_values(
+    db: Annotated[Session, Depends(db.get_db)],
+    metric: Annotated[MetricEntity, Depends(service.get_metric)],
+    request: Request,
+    content_type: Annotated[Optional[str], Header()] = None,
+    on_conflict: ConflictPolicy = config.VALUES_ON_CONFLICT,  # type: ignore
+):
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    accepted, rejected = await service.ingest_values(
+        db, metric, media_type, request.stream(), on_conflict
+    )
+    return IngestResponse(accepted=accepted, rejected=rejected)
 
 
 @router.get(config.VALUES_URI)
 async def get_values(
-    db: Annotated[Session, Depends(db.get_session)],
+    db: Annotated[Session, Depends(db.get_read_db)],
+    metric: Annotated[MetricEntity, Depends(service.get_metric)],
+    request: Request,
+    start: Annotated[Optional[int], Query(alias="from")] = None,
+    end: Annotated[Optional[int], Query(alias="to")] = None,
+    limit: Annotated[Optional[int], Query(ge=1, le=config.VALUES_MAX_LIMIT)] = None,
+    order: Literal["asc", "desc"] = "asc",
+    cursor: Optional[str] = None,
+    bucket: Optional[str] = None,
+    agg: str = "avg",
+    accept: Annotated[Optional[str], Header()] = None,
+):
+    if bucket is not None:
+        if cursor is not None:
+            raise exceptions.BadRequest("cursor is not supported with bucket")
+        bucket_size = service.parse_bucket(bucket)
+        aggregates = service.parse_aggregates(agg)
+    else:
+        media_type = service.stream_media_type(accept)
+        if media_type is not None:
+            return StreamingResponse(
+                service.stream_values(
+                    sync_bind(db), metric, media_type, start, end, limit, order
+                ),
+                media_type=media_type,
+            )
+
+    async def render():
+        if bucket is not None:
+            aggregated = await run(
+                db,
+                service.aggregate_values,
+                metric,
+                bucket_size,
+                aggregates,
+                start,
+                end,
+                limit,
+                order,
+            )
+            return aggregated, {}
+        values, next_cursor = await run(
+            db, service.get_values, metric, start, end, limit, order, cursor
+        )
+        headers = {config.NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+        return values, headers
+
+    return await _conditional(request, db, service.METRIC_VERSIONS, metric.id, render)
+
+
+@router.get(config.METRIC_STATS_URI, response_model=StatsResponse)
+async def get_metric_stats(
+    db: Annotated[Session, Depends(db.get_read_db)],
     metric: Annotated[MetricEntity, Depends(service.get_metric)],
+    request: Request,
+    start: Annotated[Optional[int], Query(alias="from")] = None,
+    end: Annotated[Optional[int], Query(alias="to")] = None,
 ):
-    return service.get_values(db, metric)
+    async def render():
+        return await run(db, service.get_stats, metric, start, end), {}
+
+    return await _conditional(request, db, service.METRIC_VERSIONS, metric.id, render)
+
+
+def _event_stream(metric_ids: list[UUID], limit: Optional[int]) -> StreamingResponse:
+    return StreamingResponse(
+        service.value_events(metric_ids, limit),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get(config.VALUES_EVENTS_URI)
+async def subscribe_values(
+    metric: Annotated[MetricEntity, Depends(service.get_metric)],
+    limit: Annotated[Optional[int], Query(ge=1)] = None,
+):
+    return _event_stream([cast(UUID, metric.id)], limit)
+
+
+@router.get(config.METRICS_EVENTS_URI)
+async def subscribe_metrics_values(
+    user: Annotated[UserEntity, Depends(service.get_user)],
+    db: Annotated[Session, Depends(db.get_read_db)],
+    metric_id: Annotated[
+        list[UUID], Query(min_length=1, max_length=config.METRICS_QUERY_MAX_IDS)
+    ],
+    limit: Annotated[Optional[int], Query(ge=1)] = None,
+):
+    metric_ids = await run(db, service.subscribable_metrics, user, metric_id)
+    return _event_stream(metric_ids, limit)
+
+
+@router.get(config.RETENTION_URI, response_model=RetentionResponse)
+async def get_retention(
+    db: Annotated[Session, Depends(db.get_read_db)],
+    metric: Annotated[MetricEntity, Depends(service.get_metric)],
+):
+    return await run(db, service.get_retention, metric)
+
+
+@router.put(config.RETENTION_URI, response_model=RetentionResponse)
+async def set_retention(
+    db: Annotated[Session, Depends(db.get_db)],
+    metric: Annotated[MetricEntity, Depends(service.get_metric)],
+    payload: RetentionRequest,
+):
+    return await run(db, service.set_retention, metric, payload)
+
+
+def _stats() -> dict:
+    return {
+        "password_pool": service.password_pool.stats(),
+        "ingest_buffer": service.ingest_buffer.stats(),
+        "compaction": service.compactor.stats(),
+        "sealing": service.sealer.stats(),
+        "sketches": service.sketcher.stats(),
+        "subscriptions": service.hub.stats(),
+        "caches": {
+            "tokens": service.token_cache.stats(),
+            "users": service.user_cache.stats(),
+            "metrics": service.metric_cache.stats(),
+            "responses": service.response_cache.stats(),
+        },
+    }
+
+
+@internal_router.get(config.STATS_URI)
+async def get_stats():
+    return _stats()
+
+
+@internal_router.get(config.PROMETHEUS_URI, response_class=PlainTextResponse)
+async def get_prometheus_metrics():
+    return PlainTextResponse(
+        instrumentation.render(_stats()), media_type="text/plain; version=0.0.4"
+    )
+
+
+@internal_router.get(config.COMPACTION_URI)
+async def get_compaction_report(db: Annotated[Session, Depends(db.get_read_db)]):
+    return await run(db, service.compaction_report)
+
+
+@internal_router.get(config.SLOW_QUERIES_URI)
+async def get_slow_queries():
+    return list(instrumentation.slow_queries)
@@ -0,0 +1,45 @@
+import struct
+from decimal import Decimal
+from functools import lru_cache
+from itertools import accumulate, islice
+
+from app.varint import read_varints, write_varint
+
+FORMAT_VERSION = 1
+VALUE_DECIMALS = 1
+VALUE_SCALE = 10**VALUE_DECIMALS
+HEADER = struct.Struct("<BcIq")
+WIDTHS = (("h", 2**15), ("i", 2**31), ("q", 2**63))
+
+
+def encode(points: list[tuple[int, Decimal]]) -> bytes:
+    points = sorted(points)
+    scaled = [int((value * VALUE_SCALE).to_integral_value()) for _, value in points]
+    width = next(
+        code
+        for code, bound in WIDTHS
+        if all(-bound <= number < bound for number in scaled)
+    )
+    first = points[0][0] if points else 0
+    out = bytearray(HEADER.pack(FORMAT_VERSION, width.encode(), len(points), first))
+    previous = first
+    for timestamp, _ in points:
+        write_varint(out, timestamp - previous)
+        previous = timestamp
+    out += struct.pack(f"<{len(scaled)}{width}", *scaled)
+    return bytes(out)
+
+
+@lru_cache(maxsize=2**16)
+def _unscale(number: int) -> Decimal:
+    return Decimal(number).scaleb(-VALUE_DECIMALS)
+
+
+def decode(data: bytes) -> list[tuple[int, Decimal]]:
+    version, width, count, first = HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"unsupported block format {version}")
+    deltas, offset = read_varints(data, HEADER.size, count)
+    scaled = struct.unpack_from(f"<{count}{width.decode()}", data, offset)
+    timestamps = accumulate(deltas, initial=first)
+    return list(zip(islice(timestamps, 1, None), map(_unscale, scaled)))
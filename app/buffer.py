@@ -0,0 +1,151 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+from sqlmodel import Session
+
+from app import exceptions, instrumentation
+
+logger = logging.getLogger("app.buffer")
+
+Entry = tuple[float, list[dict], str, Future]
+
+
+class IngestBuffer:
+    def __init__(
+        self,
+        name: str,
+        bind,
+        write: Callable[[Session, list[dict], str], int],
+        max_rows: int,
+        batch_rows: int,
+        flush_ms: float,
+    ):
+        self.name = name
+        self.bind = bind
+        self.write = write
+        self.max_rows = max_rows
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_ms / 1000
+        self.depth = 0
+        self.peak_depth = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.failed_flushes = 0
+        self.last_flush_rows = 0
+        self.last_flush_ms = 0.0
+        self._pending: deque[Entry] = deque()
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closing = False
+
+    def submit(self, rows: list[dict], on_conflict: str = "reject") -> Future:
+        future: Future = Future()
+        if not rows:
+            future.set_result(0)
+            return future
+        with self._condition:
+            if self._closing:
+                raise exceptions.ServiceUnavailable(f"{self.name} buffer is closed")
+            if self.depth and self.depth + len(rows) > self.max_rows:
+                self.rejected += 1
+                raise exceptions.ServiceUnavailable(f"{self.name} buffer is full")
+            self._pending.append((time.monotonic(), rows, on_conflict, future))
+            self.depth += len(rows)
+            self.submitted += len(rows)
+            self.peak_depth = max(self.peak_depth, self.depth)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=self.name, daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def _take(self) -> Optional[list[Entry]]:
+        with self._condition:
+            while not self._pending:
+                if self._closing:
+                    return None
+                self._condition.wait()
+            deadline = self._pending[0][0] + self.flush_seconds
+            while self.depth < self.batch_rows and not self._closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = [self._pending.popleft()]
+            size = len(batch[0][1])
+            while self._pending and size + len(self._pending[0][1]) <= self.batch_rows:
+                batch.append(self._pending.popleft())
+                size += len(batch[-1][1])
+            self.depth -= size
+            return batch
+
+    def _run(self):
+        while (batch := self._take()) is not None:
+            self._flush(batch)
+
+    def _commit(self, batch: list[Entry]) -> list[int]:
+        with Session(self.bind) as db:
+            written = [
+                self.write(db, rows, on_conflict) for _, rows, on_conflict, _ in batch
+            ]
+            db.commit()
+        return written
+
+    def _flush(self, batch: list[Entry]):
+        size = sum(len(rows) for _, rows, _, _ in batch)
+        started = time.perf_counter()
+        try:
+            results: list = self._commit(batch)
+        except exceptions.Conflict:
+            # one rejected submission must not fail the rest of the group
+            results = []
+            for entry in batch:
+                try:
+                    results.extend(self._commit([entry]))
+                except Exception as e:
+                    results.append(e)
+        except Exception as e:
+            logger.exception("%s flush of %d rows failed", self.name, size)
+            results = [e] * len(batch)
+        elapsed = time.perf_counter() - started
+        self.flushes += 1
+        self.failed_flushes += any(isinstance(r, Exception) for r in results)
+        self.flushed_rows += sum(r for r in results if isinstance(r, int))
+        self.last_flush_rows = size
+        self.last_flush_ms = round(elapsed * 1000, 3)
+        instrumentation.ingest_flush_rows.observe(size)
+        instrumentation.ingest_flush_duration.observe(elapsed)
+        for (_, _, _, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def close(self, timeout: Optional[float] = None):
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "capacity": self.max_rows,
+            "peak_depth": self.peak_depth,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_rows": self.last_flush_rows,
+            "last_flush_ms": self.last_flush_ms,
+        }
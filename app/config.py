@@ -1,4 +1,7 @@
+import os
+
 AUTH_HEADER = "Token"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
 
 JWT_ALGORITHM = "HS256"
 JWT_ACCESS_EXPIRES_MINUTES = 15
@@ -11,4 +14,75 @@ LOGIN_URI = "/auth/login"
 REGISTER_URI = "/auth/register"
 REFRESH_TOKEN_URI = "/auth/refresh"
 METRICS_URI = "/metrics"
+METRICS_QUERY_URI = "/metrics/query"
+METRICS_VALUES_URI = "/metrics/values"
 VALUES_URI = "/metrics/{metric_id}/values"
+VALUES_INGEST_URI = "/metrics/{metric_id}/values/ingest"
+RETENTION_URI = "/metrics/{metric_id}/retention"
+METRIC_STATS_URI = "/metrics/{metric_id}/stats"
+VALUES_EVENTS_URI = "/metrics/{metric_id}/values/events"
+METRICS_EVENTS_URI = "/metrics/events"
+
+INTERNAL_PREFIX = "/internal"
+STATS_URI = "/stats"
+PROMETHEUS_URI = "/metrics"
+SLOW_QUERIES_URI = "/slow-queries"
+COMPACTION_URI = "/compaction"
+
+VALUES_MAX_LIMIT = 10000
+METRICS_QUERY_MAX_IDS = 100
+BULK_VALUES_MAX_METRICS = 1000
+VALUES_INSERT_CHUNK_SIZE = 1000
+VALUES_STREAM_BATCH_SIZE = 1000
+VALUES_INGEST_BATCH_SIZE = 5000
+ROLLUP_RESOLUTIONS = (3600, 86400)
+VALUES_ON_CONFLICT = os.getenv("VALUES_ON_CONFLICT", "reject")
+VALUES_STORAGE = os.getenv("VALUES_STORAGE", "rows")
+VALUES_KEY = os.getenv("VALUES_KEY", "uuid")
+VALUE_BLOCK_SPAN_SECONDS = 86400
+SKETCH_COMPRESSION = 100
+
+AUTH_CACHE_TTL_SECONDS = int(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", "67108864"))
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(
+    os.getenv("RESPONSE_CACHE_MAX_ENTRY_BYTES", "4194304")
+)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "100"))
+
+INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN")
+
+INGEST_BUFFER_ENABLED = os.getenv("INGEST_BUFFER", "0") == "1"
+INGEST_BUFFER_MAX_ROWS = int(os.getenv("INGEST_BUFFER_MAX_ROWS", "100000"))
+INGEST_BUFFER_BATCH_ROWS = int(os.getenv("INGEST_BUFFER_BATCH_ROWS", "5000"))
+INGEST_BUFFER_FLUSH_MS = float(os.getenv("INGEST_BUFFER_FLUSH_MS", "50"))
+
+SUBSCRIPTION_MAX_EVENTS = int(os.getenv("SUBSCRIPTION_MAX_EVENTS", "1000"))
+SUBSCRIPTION_HEARTBEAT_SECONDS = float(
+    os.getenv("SUBSCRIPTION_HEARTBEAT_SECONDS", "15")
+)
+SUBSCRIPTION_BROKER_DIR = os.getenv("SUBSCRIPTION_BROKER_DIR")
+
+RETENTION_RAW_DAYS = int(os.getenv("RETENTION_RAW_DAYS", "0")) or None
+RETENTION_HOURLY_DAYS = int(os.getenv("RETENTION_HOURLY_DAYS", "0")) or None
+# every worker runs the backfill at startup; prefer running
+# `python -m app.manage rebuild-rollups` once after upgrading
+ROLLUP_BACKFILL = os.getenv("ROLLUP_BACKFILL", "0") == "1"
+COMPACTION_ENABLED = os.getenv("COMPACTION", "0") == "1"
+COMPACTION_INTERVAL_SECONDS = float(os.getenv("COMPACTION_INTERVAL_SECONDS", "3600"))
+COMPACTION_CHUNK_ROWS = int(os.getenv("COMPACTION_CHUNK_ROWS", "5000"))
+
+SKETCH_REFRESH_INTERVAL_SECONDS = float(
+    os.getenv("SKETCH_REFRESH_INTERVAL_SECONDS", "60")
+)
+SKETCH_REFRESH_BATCH_DAYS = int(os.getenv("SKETCH_REFRESH_BATCH_DAYS", "1000"))
+
+BLOCK_SEAL_INTERVAL_SECONDS = float(os.getenv("BLOCK_SEAL_INTERVAL_SECONDS", "300"))
+BLOCK_SEAL_GRACE_SECONDS = int(os.getenv("BLOCK_SEAL_GRACE_SECONDS", "3600"))
+
+PASSWORD_POOL_KIND = os.getenv("PASSWORD_POOL_KIND", "thread")
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", os.cpu_count() or 1))
+PASSWORD_POOL_QUEUE_SIZE = int(os.getenv("PASSWORD_POOL_QUEUE_SIZE", "32"))
@@ -1,11 +1,143 @@
+import logging
 import os
+from functools import partial
+from typing import Any, Callable, TypeVar
 
+from app import config
 from app.model import *  # noqa
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Integer, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 DB_DSN = os.getenv("DB_DSN", "sqlite:///db.sqlite3")
+DB_READ_DSN = os.getenv("DB_READ_DSN")
+DB_PROFILE = os.getenv("DB_PROFILE", "default")
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1"
+ASYNC_DRIVERS = {"aiosqlite": "pysqlite", "asyncpg": "psycopg2"}
+LEGACY_VALUES_INDEX = "ix_values_metric_id_timestamp"
 
-engine = create_engine(DB_DSN, echo=True)
+ENGINE_PROFILES: dict[str, dict[str, Any]] = {
+    "default": {},
+    "concurrent": {
+        "sqlite_pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": 268435456,
+            "cache_size": -65536,
+            "temp_store": "MEMORY",
+            "busy_timeout": 5000,
+        },
+        "pool": {
+            "pool_size": 20,
+            "max_overflow": 10,
+            "pool_timeout": 10,
+            "pool_pre_ping": True,
+            "pool_recycle": 1800,
+        },
+        "statement_timeout": 30000,
+    },
+    "durable": {
+        "sqlite_pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "FULL",
+            "cache_size": -16384,
+            "busy_timeout": 10000,
+        },
+        "pool": {"pool_size": 10, "max_overflow": 5, "pool_pre_ping": True},
+        "statement_timeout": 60000,
+    },
+}
+
+T = TypeVar("T")
+
+logger = logging.getLogger("app.db")
+
+
+def sync_dsn(dsn: str) -> str:
+    url = make_url(dsn)
+    driver = ASYNC_DRIVERS.get(url.get_driver_name())
+    if driver is None:
+        return dsn
+    url = url.set(drivername=f"{url.get_backend_name()}+{driver}")
+    return url.render_as_string(hide_password=False)
+
+
+def is_async_dsn(dsn: str) -> bool:
+    return make_url(dsn).get_driver_name() in ASYNC_DRIVERS
+
+
+def _configure_connection(backend: str, profile: dict, read_only: bool, conn, _):
+    statements = []
+    if backend == "sqlite":
+        pragmas = dict(profile.get("sqlite_pragmas", {}))
+        if read_only:
+            pragmas["query_only"] = "ON"
+        statements = [f"PRAGMA {name}={value}" for name, value in pragmas.items()]
+    elif backend == "postgresql":
+        if "statement_timeout" in profile:
+            statements.append(f"SET statement_timeout = {profile['statement_timeout']}")
+        if read_only:
+            statements.append("SET default_transaction_read_only = on")
+    if not statements:
+        return
+    cursor = conn.cursor()
+    for statement in statements:
+        cursor.execute(statement)
+    cursor.close()
+
+
+def make_engine(dsn: str, profile: str = DB_PROFILE, read_only: bool = False):
+    settings = ENGINE_PROFILES[profile]
+    backend = make_url(dsn).get_backend_name()
+    kwargs: dict[str, Any] = {"echo": DB_ECHO}
+    if backend != "sqlite":
+        kwargs.update(settings.get("pool", {}))
+    if is_async_dsn(dsn):
+        engine = create_async_engine(dsn, **kwargs)
+        target = engine.sync_engine
+    else:
+        engine = create_engine(dsn, **kwargs)
+        target = engine
+    configure = partial(_configure_connection, backend, settings, read_only)
+    event.listen(target, "connect", configure)
+    return engine
+
+
+engine = make_engine(sync_dsn(DB_DSN))
+async_engine = make_engine(DB_DSN) if is_async_dsn(DB_DSN) else None
+read_engine = engine
+async_read_engine = async_engine
+if DB_READ_DSN:
+    read_engine = make_engine(sync_dsn(DB_READ_DSN), read_only=True)
+    async_read_engine = None
+    if is_async_dsn(DB_READ_DSN):
+        async_read_engine = make_engine(DB_READ_DSN, read_only=True)
+
+SYNC_ENGINES = {async_engine: engine, async_read_engine: read_engine}
+ENGINES = {engine, read_engine} | {
+    e.sync_engine for e in (async_engine, async_read_engine) if e is not None
+}
+
+
+def values_key(bind) -> str:
+    columns = {column["name"]: column for column in inspect(bind).get_columns("values")}
+    return "integer" if isinstance(columns["id"]["type"], Integer) else "uuid"
+
+
+def drop_legacy_index(bind):
+    # the non-unique index from before series keys is redundant once the
+    # unique one exists, and only slows down writes
+    with bind.begin() as conn:
+        indexes = {index["name"] for index in inspect(conn).get_indexes("values")}
+        if (
+            "ux_values_metric_id_timestamp" in indexes
+            and LEGACY_VALUES_INDEX in indexes
+        ):
+            conn.execute(text(f"DROP INDEX {LEGACY_VALUES_INDEX}"))
 
 
 def get_session():
@@ -13,4 +145,57 @@ def get_session():
         yield session
 
 
+async def get_async_session():
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+
+def get_read_session():
+    with Session(read_engine) as session:
+        yield session
+
+
+async def get_async_read_session():
+    async with AsyncSession(async_read_engine, expire_on_commit=False) as session:
+        yield session
+
+
+get_db = get_session if async_engine is None else get_async_session
+get_read_db: Callable = get_db
+if DB_READ_DSN:
+    get_read_db = (
+        get_read_session if async_read_engine is None else get_async_read_session
+    )
+
+
+async def run(db: Session | AsyncSession, fn: Callable[..., T], *args: Any) -> T:
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args)
+    return await run_in_threadpool(fn, db, *args)
+
+
+def sync_bind(db: Session | AsyncSession):
+    if isinstance(db, AsyncSession):
+        return SYNC_ENGINES.get(db.bind, engine)
+    return db.get_bind()
+
+
 SQLModel.metadata.create_all(engine)
+for table in SQLModel.metadata.sorted_tables:
+    for index in table.indexes:
+        try:
+            index.create(engine, checkfirst=True)
+        except IntegrityError:
+            logger.warning(
+                "cannot create %s over existing duplicates; "
+                "run `python -m app.manage dedup-values`",
+                index.name,
+            )
+drop_legacy_index(engine)
+if values_key(engine) != config.VALUES_KEY:
+    logger.warning(
+        "values table has %s keys but VALUES_KEY=%s; "
+        "run `python -m app.manage migrate-value-keys`",
+        values_key(engine),
+        config.VALUES_KEY,
+    )
@@ -16,3 +16,15 @@ class NotFound(Exception):
 
 class InvalidToken(Exception):
     pass
+
+
+class BadRequest(Exception):
+    pass
+
+
+class ServiceUnavailable(Exception):
+    pass
+
+
+class Conflict(Exception):
+    pass
@@ -0,0 +1,212 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+from collections import defaultdict
+from typing import Callable, Iterable, Optional
+from uuid import UUID, uuid4
+
+logger = logging.getLogger("app.hub")
+
+Points = list[tuple[int, str]]
+Event = tuple[UUID, Points]
+
+BROKER_MAX_MESSAGE_BYTES = 65536
+BROKER_CHUNK_POINTS = 1000
+
+
+class Subscription:
+    def __init__(self, hub: "Hub", metric_ids: frozenset[UUID], max_events: int):
+        self.hub = hub
+        self.metric_ids = metric_ids
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue[Event] = asyncio.Queue(max_events)
+        self.dropped = 0
+
+    def offer(self, event: Event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            pass  # the subscriber's loop is already gone
+
+    def _put(self, event: Event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # a slow consumer loses events instead of holding up ingestion
+            self.dropped += len(event[1])
+            self.hub.dropped += len(event[1])
+
+    async def get(self) -> Event:
+        return await self.queue.get()
+
+    def take_dropped(self) -> int:
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class LocalBroker:
+    # each worker binds a datagram socket in a shared directory and forwards
+    # the points it publishes to every other socket found there
+    def __init__(self, directory: str, deliver: Callable[[dict[UUID, Points]], None]):
+        self.directory = directory
+        self.deliver = deliver
+        self.path = os.path.join(directory, f"{os.getpid()}-{uuid4().hex[:8]}.sock")
+        self.sent = 0
+        self.received = 0
+        self.failed = 0
+        self._socket: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(self.path)
+        self._thread = threading.Thread(target=self._run, name="broker", daemon=True)
+        self._thread.start()
+
+    def _messages(self, events: dict[UUID, Points]) -> Iterable[bytes]:
+        for metric_id, points in events.items():
+            for offset in range(0, len(points), BROKER_CHUNK_POINTS):
+                chunk = points[offset : offset + BROKER_CHUNK_POINTS]
+                yield json.dumps([str(metric_id), chunk]).encode()
+
+    def send(self, events: dict[UUID, Points]):
+        if self._socket is None:
+            return
+        peers = [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(".sock")
+        ]
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            sender.setblocking(False)
+            for message in self._messages(events):
+                for peer in peers:
+                    if peer == self.path:
+                        continue
+                    try:
+                        sender.sendto(message, peer)
+                        self.sent += 1
+                    except ConnectionRefusedError:
+                        # nobody is bound to it any more: a worker that died
+                        _unlink(peer)
+                    except OSError:
+                        self.failed += 1
+
+    def _run(self):
+        receiver = self._socket
+        assert receiver is not None
+        while True:
+            try:
+                message = receiver.recv(BROKER_MAX_MESSAGE_BYTES)
+            except OSError:
+                return
+            if not message:
+                return
+            try:
+                metric_id, points = json.loads(message)
+                self.deliver({UUID(metric_id): [tuple(point) for point in points]})
+                self.received += 1
+            except Exception:
+                logger.exception("dropping malformed broker message")
+
+    def close(self):
+        if self._socket is not None:
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._socket.close()
+            self._socket = None
+            _unlink(self.path)
+        if self._thread is not None:
+            self._thread.join(1)
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "received": self.received, "failed": self.failed}
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class Hub:
+    def __init__(self, name: str, max_events: int, broker_dir: Optional[str] = None):
+        self.name = name
+        self.max_events = max_events
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.broker = LocalBroker(broker_dir, self._deliver) if broker_dir else None
+        self._subscriptions: dict[UUID, set[Subscription]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return bool(self._subscriptions) or self.broker is not None
+
+    def start(self):
+        if self.broker is not None:
+            self.broker.start()
+
+    def subscribe(self, metric_ids: Iterable[UUID]) -> Subscription:
+        subscription = Subscription(self, frozenset(metric_ids), self.max_events)
+        with self._lock:
+            for metric_id in subscription.metric_ids:
+                self._subscriptions[metric_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            for metric_id in subscription.metric_ids:
+                subscribers = self._subscriptions.get(metric_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscriptions[metric_id]
+
+    def publish(self, rows: Iterable[dict]):
+        events: dict[UUID, Points] = defaultdict(list)
+        for row in rows:
+            events[row["metric_id"]].append((row["timestamp"], str(row["value"])))
+        for points in events.values():
+            points.sort()
+            self.published += len(points)
+        self._deliver(events)
+        if self.broker is not None:
+            self.broker.send(events)
+
+    def _deliver(self, events: dict[UUID, Points]):
+        with self._lock:
+            targets = [
+                (subscription, (metric_id, points))
+                for metric_id, points in events.items()
+                for subscription in self._subscriptions.get(metric_id, ())
+            ]
+        for subscription, event in targets:
+            subscription.offer(event)
+        self.delivered += len(targets)
+
+    def close(self):
+        if self.broker is not None:
+            self.broker.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            subscriptions = set().union(*self._subscriptions.values())
+        stats = {
+            "subscribers": len(subscriptions),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+        if self.broker is not None:
+            stats["broker"] = self.broker.stats()
+        return stats
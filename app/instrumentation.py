@@ -0,0 +1,246 @@
+import bisect
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+from app import config
+
+logger = logging.getLogger("app.slow_query")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+ROW_BUCKETS = (1, 10, 100, 1_000, 5_000, 10_000, 50_000, 100_000)
+UNMATCHED_ROUTE = "unmatched"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple, labels: tuple):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labels = labels
+        self.series: dict[tuple, list] = defaultdict(
+            lambda: [[0] * (len(buckets) + 1), 0.0]
+        )
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series[labels]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(c), s) for labels, (c, s) in self.series.items()}
+        for labels, (counts, total) in sorted(series.items()):
+            base = _labels(zip(self.labels, labels))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                bucket = _labels((*zip(self.labels, labels), ("le", bound)))
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            lines.append(f"{self.name}_sum{base} {total}")
+            lines.append(f"{self.name}_count{base} {cumulative}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def add(self, amount: int):
+        with self._lock:
+            self.value += amount
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {self.value}",
+        ]
+
+
+class RequestStats:
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    @property
+    def route(self) -> str:
+        route = self.scope.get("route")
+        return getattr(route, "path", UNMATCHED_ROUTE)
+
+
+request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling HTTP requests.",
+    LATENCY_BUCKETS,
+    ("method", "route", "status"),
+)
+request_size = Histogram(
+    "http_request_size_bytes", "HTTP request body size.", SIZE_BUCKETS, ("route",)
+)
+response_size = Histogram(
+    "http_response_size_bytes", "HTTP response body size.", SIZE_BUCKETS, ("route",)
+)
+requests_in_flight = Gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled."
+)
+query_duration = Histogram(
+    "db_query_duration_seconds",
+    "Time spent executing SQL statements.",
+    LATENCY_BUCKETS,
+    ("route",),
+)
+queries_per_request = Histogram(
+    "db_queries_per_request",
+    "SQL statements executed per HTTP request.",
+    COUNT_BUCKETS,
+    ("route",),
+)
+ingest_flush_rows = Histogram(
+    "ingest_flush_rows", "Rows written per ingest buffer flush.", ROW_BUCKETS, ()
+)
+ingest_flush_duration = Histogram(
+    "ingest_flush_duration_seconds",
+    "Time spent writing and committing an ingest buffer flush.",
+    LATENCY_BUCKETS,
+    (),
+)
+METRICS = (
+    request_duration,
+    request_size,
+    response_size,
+    requests_in_flight,
+    query_duration,
+    queries_per_request,
+    ingest_flush_rows,
+    ingest_flush_duration,
+)
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar(
+    "current_request", default=None
+)
+slow_queries: deque = deque(maxlen=config.SLOW_QUERY_LOG_SIZE)
+
+
+class InstrumentationMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats(scope)
+        token = current_request.set(stats)
+        received = sent = 0
+        status = "500"
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal sent, status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        requests_in_flight.add(1)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            elapsed = time.perf_counter() - started
+            requests_in_flight.add(-1)
+            current_request.reset(token)
+            route = stats.route
+            request_duration.observe(elapsed, scope["method"], route, status)
+            request_size.observe(received, route)
+            response_size.observe(sent, route)
+            queries_per_request.observe(stats.queries, route)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    stats = current_request.get()
+    route = stats.route if stats is not None else UNMATCHED_ROUTE
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += elapsed
+    query_duration.observe(elapsed, route)
+    if elapsed * 1000 >= config.SLOW_QUERY_MS:
+        slow_queries.append(
+            {
+                "route": route,
+                "statement": statement,
+                "duration_ms": round(elapsed * 1000, 3),
+                "at": time.time(),
+            }
+        )
+        logger.warning(
+            "slow query (%.1fms) on %s: %s", elapsed * 1000, route, statement
+        )
+
+
+def _handle_error(context):
+    if context.connection is not None:
+        started = context.connection.info.get("query_started")
+        if started:
+            started.pop()
+
+
+def instrument_engine(engine):
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+def render(stats: dict) -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend(_render_stats("app", stats))
+    return "\n".join(lines) + "\n"
+
+
+def _render_stats(prefix: str, stats: dict) -> list[str]:
+    lines = []
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            lines.extend(_render_stats(name, value))
+        elif isinstance(value, (int, float)):
+            lines.append(f"{name} {value}")
+    return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs) -> str:
+    rendered = ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+    return f"{{{rendered}}}" if rendered else ""
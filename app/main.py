@@ -1,10 +1,40 @@
-from app import exceptions
+from contextlib import asynccontextmanager
+
+from app import config, db, exceptions, service
+from app.api import internal_router
 from app.api import router as api_router
+from app.instrumentation import InstrumentationMiddleware, instrument_engine
 from fastapi import FastAPI, Response
+from fastapi.concurrency import run_in_threadpool
 from httpx import Request
 
-app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if config.ROLLUP_BACKFILL:
+        await run_in_threadpool(service.run_backfill)
+    if config.COMPACTION_ENABLED:
+        service.compactor.start()
+    if config.VALUES_STORAGE == "blocks":
+        service.sealer.start()
+    service.sketcher.start()
+    service.hub.start()
+    yield
+    service.hub.close()
+    service.compactor.close()
+    service.sealer.close()
+    service.sketcher.close()
+    service.ingest_buffer.close()
+    service.password_pool.shutdown()
+
+
+app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None, lifespan=lifespan)
 app.include_router(api_router)
+app.include_router(internal_router)
+app.add_middleware(InstrumentationMiddleware)
+
+for engine in db.ENGINES:
+    instrument_engine(engine)
 
 
 @app.exception_handler(exceptions.EmailAlreadyExist)
@@ -25,3 +55,18 @@ async def _(request: Request, exc: exceptions.NotFound):
 @app.exception_handler(exceptions.InvalidToken)
 async def _(request: Request, exc: exceptions.InvalidToken):
     return Response(str(exc), status_code=403)
+
+
+@app.exception_handler(exceptions.BadRequest)
+async def _(request: Request, exc: exceptions.BadRequest):
+    return Response(str(exc), status_code=400)
+
+
+@app.exception_handler(exceptions.Conflict)
+async def _(request: Request, exc: exceptions.Conflict):
+    return Response(str(exc), status_code=409)
+
+
+@app.exception_handler(exceptions.ServiceUnavailable)
+async def _(request: Request, exc: exceptions.ServiceUnavailable):
+    return Response(str(exc), status_code=503, headers={"Retry-After": "1"})
@@ -0,0 +1,155 @@
+import argparse
+import json
+from uuid import UUID
+
+from sqlalchemy import delete, func, inspect, literal_column, text
+from sqlmodel import Session, select
+
+from app import config, service
+from app.db import LEGACY_VALUES_INDEX, drop_legacy_index, engine, values_key
+from app.model import MetricEntity, ValueEntity
+
+
+def rebuild_rollups(args: argparse.Namespace):
+    with Session(engine) as db:
+        metric_ids = args.metric or db.exec(select(MetricEntity.id)).all()
+        for metric_id in metric_ids:
+            service.rebuild_rollups(db, metric_id)
+            db.commit()
+    print(f"rebuilt rollups for {len(metric_ids)} metrics")
+
+
+def _newest_first(dialect: str) -> tuple:
+    # integer keys and sqlite rowids grow with every insert; postgres orders
+    # by the age of the writing transaction, then by position within it
+    if dialect == "postgresql" and config.VALUES_KEY != "integer":
+        return (func.age(literal_column("xmin")), literal_column("ctid").desc())
+    if dialect == "postgresql":
+        return (ValueEntity.id.desc(),)  # type: ignore
+    return (literal_column("rowid").desc(),)
+
+
+def dedup_values(args: argparse.Namespace):
+    ranked = select(
+        ValueEntity.id,
+        ValueEntity.metric_id,
+        func.row_number()
+        .over(
+            partition_by=(ValueEntity.metric_id, ValueEntity.timestamp),
+            order_by=_newest_first(engine.dialect.name),
+        )
+        .label("rn"),
+    ).subquery()
+    duplicates = select(ranked.c.id).where(ranked.c.rn > 1)
+    with Session(engine) as db:
+        metric_ids = db.exec(
+            select(ranked.c.metric_id).where(ranked.c.rn > 1).distinct()
+        ).all()
+        result = db.exec(delete(ValueEntity).where(ValueEntity.id.in_(duplicates)))  # type: ignore
+        for metric_id in metric_ids:
+            service.rebuild_rollups(db, metric_id)
+        db.commit()
+    for index in ValueEntity.__table__.indexes:  # type: ignore
+        index.create(engine, checkfirst=True)
+    drop_legacy_index(engine)
+    print(f"removed {result.rowcount} duplicate values from {len(metric_ids)} metrics")
+
+
+LEGACY_VALUES = "values_uuid"
+
+
+def migrate_value_keys(args: argparse.Namespace):
+    if config.VALUES_KEY != "integer":
+        raise SystemExit("set VALUES_KEY=integer to migrate values to integer keys")
+    table = ValueEntity.__table__  # type: ignore
+    with engine.begin() as conn:
+        if not inspect(conn).has_table(LEGACY_VALUES):
+            if values_key(conn) == "integer":
+                print("values already use integer keys")
+                return
+            indexes = {index["name"] for index in inspect(conn).get_indexes("values")}
+            if "ux_values_metric_id_timestamp" not in indexes:
+                raise SystemExit("run dedup-values before migrating value keys")
+            conn.execute(text(f'ALTER TABLE "values" RENAME TO {LEGACY_VALUES}'))
+            if conn.dialect.name == "postgresql":
+                conn.execute(
+                    text(f"ALTER INDEX values_pkey RENAME TO {LEGACY_VALUES}_pkey")
+                )
+            for name in ("ux_values_metric_id_timestamp", LEGACY_VALUES_INDEX):
+                conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+            table.create(conn)
+    # copying in key order lays the new rows out by metric and timestamp
+    with engine.begin() as conn:
+        copied = conn.execute(
+            text(
+                'INSERT INTO "values" (metric_id, timestamp, value) '
+                f"SELECT metric_id, timestamp, value FROM {LEGACY_VALUES} "
+                "ORDER BY metric_id, timestamp"
+            )
+        ).rowcount
+        conn.execute(text(f"DROP TABLE {LEGACY_VALUES}"))
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            conn.execute(text('CLUSTER "values" USING ux_values_metric_id_timestamp'))
+            conn.execute(text('ANALYZE "values"'))
+    print(f"migrated {copied} values to integer keys")
+
+
+def compact(args: argparse.Namespace):
+    with Session(engine) as db:
+        if args.dry_run:
+            report = service.compaction_report(db, metric_ids=args.metric)
+            print(json.dumps(report, indent=2, default=str))
+            return
+        result = service.compact(db, metric_ids=args.metric)
+    print(
+        f"compacted {result['metrics']} metrics: removed {result['values']} "
+        f"values and {result['rollups']} hourly rollups"
+    )
+
+
+def seal_blocks(args: argparse.Namespace):
+    with Session(engine) as db:
+        result = service.seal_blocks(db, metric_ids=args.metric)
+    print(
+        f"sealed {result['values']} values into {result['blocks']} blocks "
+        f"for {result['metrics']} metrics"
+    )
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m app.manage")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild = commands.add_parser(
+        "rebuild-rollups", help="recompute rollups from raw values"
+    )
+    rebuild.add_argument("--metric", action="append", type=UUID)
+    rebuild.set_defaults(handler=rebuild_rollups)
+    dedup = commands.add_parser(
+        "dedup-values",
+        help="keep the most recently written value per metric and timestamp, "
+        "then add the unique index",
+    )
+    dedup.set_defaults(handler=dedup_values)
+    migrate = commands.add_parser(
+        "migrate-value-keys",
+        help="rewrite values with integer keys ordered by metric and timestamp",
+    )
+    migrate.set_defaults(handler=migrate_value_keys)
+    compaction = commands.add_parser(
+        "compact", help="apply retention policies to old values and rollups"
+    )
+    compaction.add_argument("--metric", action="append", type=UUID)
+    compaction.add_argument("--dry-run", action="store_true")
+    compaction.set_defaults(handler=compact)
+    sealing = commands.add_parser(
+        "seal-blocks", help="move staged values into compressed blocks"
+    )
+    sealing.add_argument("--metric", action="append", type=UUID)
+    sealing.set_defaults(handler=seal_blocks)
+    args = parser.parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,23 @@
 from datetime import datetime, timezone
 from decimal import Decimal
-from typing import Optional
+from typing import Literal, Optional
 from uuid import UUID, uuid4
 
-from pydantic import BaseModel, EmailStr
-from sqlalchemy import Column, String
+from pydantic import BaseModel, ConfigDict, EmailStr, model_validator
+from pydantic import Field as PydanticField
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Identity,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+)
 from sqlmodel import Field, Relationship, SQLModel
 
+from app import config
+
 
 class UserEntity(SQLModel, table=True):
     __tablename__ = "users"  # type: ignore
@@ -30,7 +41,24 @@ class MetricEntity(SQLModel, table=True):
 
 class ValueEntity(SQLModel, table=True):
     __tablename__ = "values"  # type: ignore
-    id: UUID | None = Field(primary_key=True, default_factory=uuid4)
+    __table_args__ = (
+        Index("ux_values_metric_id_timestamp", "metric_id", "timestamp", unique=True),
+    )
+    if config.VALUES_KEY == "integer":
+        # INTEGER PRIMARY KEY makes sqlite use the rowid, so inserts append;
+        # postgres gets a BIGINT identity column
+        id: Optional[int] = Field(
+            default=None,
+            sa_column=Column(
+                BigInteger().with_variant(Integer, "sqlite"),
+                Identity(),
+                primary_key=True,
+            ),
+        )
+    else:
+        id: UUID | None = Field(
+            primary_key=True, default_factory=uuid4, sa_column_kwargs={"default": uuid4}
+        )
     timestamp: int = Field(
         default_factory=lambda: int(datetime.now(timezone.utc).timestamp())
     )
@@ -41,11 +69,158 @@ class ValueEntity(SQLModel, table=True):
     metric: MetricEntity = Relationship(back_populates="values")
 
 
+class RollupEntity(SQLModel, table=True):
+    __tablename__ = "rollups"  # type: ignore
+    metric_id: UUID = Field(
+        primary_key=True, foreign_key="metrics.id", ondelete="CASCADE"
+    )
+    resolution: int = Field(primary_key=True)
+    bucket: int = Field(primary_key=True)
+    count: int
+    sum: Decimal = Field(max_digits=20, decimal_places=1)
+    min: Decimal = Field(max_digits=4, decimal_places=1)
+    max: Decimal = Field(max_digits=4, decimal_places=1)
+    first_timestamp: int
+    first_value: Decimal = Field(max_digits=4, decimal_places=1)
+    last_timestamp: int
+    last_value: Decimal = Field(max_digits=4, decimal_places=1)
+
+
+class BlockEntity(SQLModel, table=True):
+    __tablename__ = "blocks"  # type: ignore
+    metric_id: UUID = Field(
+        primary_key=True, foreign_key="metrics.id", ondelete="CASCADE"
+    )
+    start: int = Field(primary_key=True)
+    count: int
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+
+
+class SketchEntity(SQLModel, table=True):
+    __tablename__ = "sketches"  # type: ignore
+    metric_id: UUID = Field(
+        primary_key=True, foreign_key="metrics.id", ondelete="CASCADE"
+    )
+    resolution: int = Field(primary_key=True)
+    bucket: int = Field(primary_key=True)
+    count: int = 0
+    mean: float = 0
+    m2: float = 0
+    digest: bytes = Field(default=b"", sa_column=Column(LargeBinary, nullable=False))
+
+
+class RetentionEntity(SQLModel, table=True):
+    __tablename__ = "retention"  # type: ignore
+    metric_id: UUID = Field(
+        primary_key=True, foreign_key="metrics.id", ondelete="CASCADE"
+    )
+    raw_days: Optional[int] = None
+    hourly_days: Optional[int] = None
+    compacted_until: int = 0
+
+
+class VersionEntity(SQLModel, table=True):
+    __tablename__ = "versions"  # type: ignore
+    scope: str = Field(primary_key=True)
+    key: UUID = Field(primary_key=True)
+    version: int = 0
+
+
+ConflictPolicy = Literal["reject", "ignore", "overwrite"]
+
+
 class ValueRequest(BaseModel):
     value: Decimal
     timestamp: Optional[int | str] = None
 
 
+class MetricsQueryRequest(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+    metric_ids: list[UUID] = PydanticField(
+        min_length=1, max_length=config.METRICS_QUERY_MAX_IDS
+    )
+    start: Optional[int] = PydanticField(default=None, alias="from")
+    end: Optional[int] = PydanticField(default=None, alias="to")
+    limit: Optional[int] = PydanticField(default=None, ge=1, le=config.VALUES_MAX_LIMIT)
+    order: Literal["asc", "desc"] = "asc"
+    bucket: Optional[str] = None
+    agg: str = "avg"
+
+
+class InsertedValuesResponse(BaseModel):
+    inserted: int
+
+
+class MetricValuesRequest(BaseModel):
+    id: Optional[UUID] = None
+    name: Optional[str] = None
+    values: list[ValueRequest]
+
+    @model_validator(mode="after")
+    def check_address(self):
+        if (self.id is None) == (self.name is None):
+            raise ValueError("exactly one of id or name is required")
+        return self
+
+
+class BulkValuesRequest(BaseModel):
+    metrics: list[MetricValuesRequest] = PydanticField(
+        min_length=1, max_length=config.BULK_VALUES_MAX_METRICS
+    )
+    partial: bool = False
+
+
+class MetricInserted(BaseModel):
+    id: UUID
+    name: str
+    inserted: int
+
+
+class MetricRejected(BaseModel):
+    id: Optional[UUID] = None
+    name: Optional[str] = None
+    detail: str
+
+
+class BulkValuesResponse(BaseModel):
+    inserted: int
+    metrics: list[MetricInserted]
+    rejected: list[MetricRejected]
+
+
+class StatsResponse(BaseModel):
+    count: int
+    mean: Optional[float]
+    stddev: Optional[float]
+    min: Optional[float]
+    max: Optional[float]
+    p50: Optional[float]
+    p95: Optional[float]
+    p99: Optional[float]
+
+
+class RetentionRequest(BaseModel):
+    raw_days: Optional[int] = PydanticField(default=None, ge=1)
+    hourly_days: Optional[int] = PydanticField(default=None, ge=1)
+
+    @model_validator(mode="after")
+    def check_order(self):
+        if self.raw_days and self.hourly_days and self.hourly_days < self.raw_days:
+            raise ValueError("hourly_days must not be shorter than raw_days")
+        return self
+
+
+class RetentionResponse(BaseModel):
+    raw_days: Optional[int] = None
+    hourly_days: Optional[int] = None
+    compacted_until: int = 0
+
+
+class IngestResponse(BaseModel):
+    accepted: int
+    rejected: int
+
+
 class EmailAndPassword(BaseModel):
     email: EmailStr
     password: str
@@ -68,6 +243,12 @@ class MetricResponse(BaseModel):
     name: str
 
 
+class MetricOverviewResponse(MetricResponse):
+    count: int
+    last_timestamp: Optional[int]
+    last_value: Optional[Decimal]
+
+
 class AccessToken(BaseModel):
     access_token: Optional[str] = None
 
@@ -1,32 +1,134 @@
+import asyncio
+import base64
+import csv
+import heapq
+import io
+import json
 import string
 import secrets
+import time
+from collections import defaultdict
 from datetime import datetime, timedelta, timezone
 from decimal import Decimal
-from typing import Annotated, Optional, Sequence, cast
-from uuid import UUID
-from dateutil import parser
+from functools import lru_cache
+from itertools import groupby, islice
+from typing import (
+    Annotated,
+    AsyncIterator,
+    Iterable,
+    Iterator,
+    Optional,
+    Sequence,
+    TypeVar,
+    cast,
+)
+from uuid import UUID, uuid5
 from jose import jwt
-from fastapi.security import OAuth2PasswordBearer
+from fastapi.security import (
+    HTTPAuthorizationCredentials,
+    HTTPBearer,
+    OAuth2PasswordBearer,
+)
 
-from app import config, exceptions
-from app.db import get_session
+from app import blocks, config, exceptions
+from app.buffer import IngestBuffer
+from app.cache import SizedLRUCache, TTLCache
+from app.hub import Hub
+from app.sketch import Summary, TDigest
+from app.db import engine, get_db, run
+from app.timestamps import TimestampParser
+from app.workers import PeriodicTask, WorkerPool
 from app.model import (
+    BlockEntity,
+    BulkValuesRequest,
+    BulkValuesResponse,
     CreateMetricRequest,
     EmailAndPassword,
     MetricEntity,
+    MetricInserted,
+    MetricOverviewResponse,
+    MetricRejected,
+    MetricsQueryRequest,
+    RetentionEntity,
+    RetentionRequest,
+    RetentionResponse,
+    RollupEntity,
+    SketchEntity,
+    StatsResponse,
     Tokens,
     UserEntity,
     UserRegisterRequest,
     ValueEntity,
     ValueRequest,
+    VersionEntity,
 )
 from fastapi import Depends
 from passlib.context import CryptContext
-from sqlmodel import Session, select
+from sqlalchemy import (
+    Float,
+    bindparam,
+    case,
+    delete,
+    event,
+    exists,
+    func,
+    insert,
+    literal,
+    text,
+    update,
+)
+from sqlalchemy import cast as sql_cast
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.engine.interfaces import BindTyping
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, and_, or_, select, tuple_
+
+
+E = TypeVar("E", UserEntity, MetricEntity)
 
+BUCKET_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+AGGREGATES = ("count", "sum", "avg", "min", "max", "first", "last")
+STREAM_MEDIA_TYPES = ("application/x-ndjson", "text/csv")
+USER_VERSIONS = "user"
+METRIC_VERSIONS = "metric"
+PUBLISHED_ROWS = "published_rows"
+LIFETIME_SKETCH = (0, 0)
 
 crypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{config.API_PREFIX}{config.LOGIN_URI}")
+internal_scheme = HTTPBearer(auto_error=False)
+token_cache = TTLCache(config.AUTH_CACHE_MAX_ENTRIES, config.AUTH_CACHE_TTL_SECONDS)
+user_cache = TTLCache(config.AUTH_CACHE_MAX_ENTRIES, config.AUTH_CACHE_TTL_SECONDS)
+metric_cache = TTLCache(config.AUTH_CACHE_MAX_ENTRIES, config.AUTH_CACHE_TTL_SECONDS)
+response_cache = SizedLRUCache(
+    config.RESPONSE_CACHE_MAX_BYTES, config.RESPONSE_CACHE_MAX_ENTRY_BYTES
+)
+ingest_buffer = IngestBuffer(
+    "ingest",
+    engine,
+    lambda db, rows, on_conflict: insert_values(db, rows, on_conflict),
+    config.INGEST_BUFFER_MAX_ROWS,
+    config.INGEST_BUFFER_BATCH_ROWS,
+    config.INGEST_BUFFER_FLUSH_MS,
+)
+hub = Hub("values", config.SUBSCRIPTION_MAX_EVENTS, config.SUBSCRIPTION_BROKER_DIR)
+compactor = PeriodicTask(
+    "compaction", config.COMPACTION_INTERVAL_SECONDS, lambda: run_compaction()
+)
+sealer = PeriodicTask(
+    "sealing", config.BLOCK_SEAL_INTERVAL_SECONDS, lambda: run_sealing()
+)
+sketcher = PeriodicTask(
+    "sketches", config.SKETCH_REFRESH_INTERVAL_SECONDS, lambda: run_sketch_refresh()
+)
+password_pool = WorkerPool(
+    "password",
+    config.PASSWORD_POOL_KIND,
+    config.PASSWORD_POOL_WORKERS,
+    config.PASSWORD_POOL_QUEUE_SIZE,
+)
 
 
 def hash_password(plaintext: str) -> str:
@@ -58,10 +160,19 @@ def create_refresh_token(user_id: UUID) -> str:
 
 
 def decode_token(token: str) -> dict:
+    data = token_cache.get(token)
+    if data is not None:
+        return data
     try:
-        return jwt.decode(token, config.SECRET_KEY, algorithms=[config.JWT_ALGORITHM])
+        data = jwt.decode(token, config.SECRET_KEY, algorithms=[config.JWT_ALGORITHM])
     except Exception:
         raise exceptions.InvalidToken
+    token_cache.set(token, data, ttl=_remaining(data))
+    return data
+
+
+def _remaining(claims: dict) -> float:
+    return claims.get("exp", 0) - time.time()
 
 
 def verify_token(token, token_type) -> UUID:
@@ -75,72 +186,150 @@ def verify_token(token, token_type) -> UUID:
     return UUID(user_id)
 
 
-def get_user(
-    db: Annotated[Session, Depends(get_session)],
+def _get_user(db: Session, user_id: UUID) -> Optional[UserEntity]:
+    stmt = select(UserEntity).where(UserEntity.id == user_id)
+    return db.exec(stmt).one_or_none()
+
+
+def _get_metric(db: Session, user_id: UUID, metric_id: UUID) -> Optional[MetricEntity]:
+    stmt = (
+        select(MetricEntity)
+        .where(MetricEntity.user_id == user_id)
+        .where(MetricEntity.id == metric_id)
+    )
+    return db.exec(stmt).one_or_none()
+
+
+def _detached(entity: E) -> E:
+    return type(entity)(**entity.model_dump())
+
+
+def require_internal_token(
+    credentials: Annotated[
+        Optional[HTTPAuthorizationCredentials], Depends(internal_scheme)
+    ],
+):
+    # internal endpoints do not exist unless an operator token is configured
+    if config.INTERNAL_TOKEN is None:
+        raise exceptions.NotFound()
+    if credentials is None or not secrets.compare_digest(
+        credentials.credentials, config.INTERNAL_TOKEN
+    ):
+        raise exceptions.Unauthorized()
+
+
+async def get_user(
+    db: Annotated[Session, Depends(get_db)],
     token: Annotated[str, Depends(oauth2_scheme)],
 ) -> Optional[UserEntity]:
     user_id = verify_token(token, "access")
-    stmt = select(UserEntity).where(UserEntity.id == user_id)
-    user = db.exec(stmt).one_or_none()
-    if not user:
-        raise exceptions.Unauthorized()
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await run(db, _get_user, user_id)
+        if not user:
+            raise exceptions.Unauthorized()
+        user = _detached(user)
+        user_cache.set(user_id, user, ttl=_remaining(decode_token(token)))
     return user
 
 
-def get_metric(
+async def get_metric(
     user: Annotated[UserEntity, Depends(get_user)],
-    db: Annotated[Session, Depends(get_session)],
+    db: Annotated[Session, Depends(get_db)],
+    token: Annotated[str, Depends(oauth2_scheme)],
     metric_id: UUID,
 ) -> Optional[MetricEntity]:
-    stmt = (
-        select(MetricEntity)
-        .where(MetricEntity.user == user)
-        .where(MetricEntity.id == metric_id)
-    )
-    metric = db.exec(stmt).one_or_none()
-    if not metric:
-        raise exceptions.NotFound("metric not found")
+    key = (user.id, metric_id)
+    metric = metric_cache.get(key)
+    if metric is None:
+        metric = await run(db, _get_metric, user.id, metric_id)
+        if not metric:
+            raise exceptions.NotFound("metric not found")
+        metric = _detached(metric)
+        metric_cache.set(key, metric, ttl=_remaining(decode_token(token)))
     return metric
 
 
-def login(db: Session, request: EmailAndPassword) -> Tokens:
-    stmt = select(UserEntity).where(UserEntity.email == request.email)
-    user = db.exec(stmt).one_or_none()
-    if not user or not verify_password(request.password, user.password):
-        raise exceptions.Unauthorized()
-    return Tokens(
-        access_token=create_access_token(cast(UUID, user.id)),
-        refresh_token=create_refresh_token(cast(UUID, user.id)),
-    )
+@event.listens_for(UserEntity, "after_delete")
+def _forget_user(mapper, connection, user: UserEntity):
+    user_cache.pop(user.id)
 
 
-def create_user(db: Session, payload: UserRegisterRequest):
-    stmt = select(UserEntity).where(UserEntity.email == payload.email)
-    user = db.exec(stmt).one_or_none()
-    if user:
-        raise exceptions.EmailAlreadyExist
-    user = UserEntity(email=payload.email, password=hash_password(payload.password))
+@event.listens_for(MetricEntity, "after_insert")
+@event.listens_for(MetricEntity, "after_delete")
+def _forget_metric(mapper, connection, metric: MetricEntity):
+    metric_cache.pop((metric.user_id, metric.id))
+    bump_versions(connection, USER_VERSIONS, [metric.user_id])
+
+
+def _get_user_by_email(db: Session, email: str) -> Optional[UserEntity]:
+    stmt = select(UserEntity).where(UserEntity.email == email)
+    return db.exec(stmt).one_or_none()
+
+
+def _create_user(db: Session, email: str, password: str) -> UserEntity:
+    user = UserEntity(email=email, password=password)
     db.add(user)
     db.commit()
     db.refresh(user)
+    return user
+
+
+def _tokens(user_id: UUID) -> Tokens:
     return Tokens(
-        access_token=create_access_token(cast(UUID, user.id)),
-        refresh_token=create_refresh_token(cast(UUID, user.id)),
+        access_token=create_access_token(user_id),
+        refresh_token=create_refresh_token(user_id),
     )
 
 
+async def login(db: Session, request: EmailAndPassword) -> Tokens:
+    user = await run(db, _get_user_by_email, request.email)
+    if not user or not await password_pool.run(
+        verify_password, request.password, user.password
+    ):
+        raise exceptions.Unauthorized()
+    return _tokens(cast(UUID, user.id))
+
+
+async def create_user(db: Session, payload: UserRegisterRequest) -> Tokens:
+    if await run(db, _get_user_by_email, payload.email):
+        raise exceptions.EmailAlreadyExist
+    password = await password_pool.run(hash_password, payload.password)
+    user = await run(db, _create_user, payload.email, password)
+    return _tokens(cast(UUID, user.id))
+
+
 def refresh_token(token: str) -> Tokens:
     user_id = verify_token(token, "refresh")
-    return Tokens(
-        access_token=create_access_token(user_id),
-        refresh_token=create_refresh_token(user_id),
+    return _tokens(user_id)
+
+
+def _dialect_insert(dialect: str):
+    return postgresql.insert if dialect == "postgresql" else sqlite.insert
+
+
+def get_version(db: Session, scope: str, key: UUID) -> int:
+    stmt = select(VersionEntity.version).where(
+        VersionEntity.scope == scope, VersionEntity.key == key
     )
+    return db.exec(stmt).first() or 0
+
+
+def bump_versions(connection: Connection, scope: str, keys: Iterable[UUID]):
+    stmt = _dialect_insert(connection.dialect.name)(VersionEntity)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[VersionEntity.scope, VersionEntity.key],
+        set_={"version": VersionEntity.version + 1},
+    )
+    params = [{"scope": scope, "key": key, "version": 1} for key in sorted(set(keys))]
+    if params:
+        connection.execute(stmt, params)
 
 
 def create_metric(
     db: Session, user: UserEntity, payload: CreateMetricRequest
 ) -> MetricEntity:
-    metric = MetricEntity(user=user, name=payload.name)
+    metric = MetricEntity(user_id=user.id, name=payload.name)
     db.add(metric)
     db.commit()
     db.refresh(metric)
@@ -148,27 +337,1739 @@ def create_metric(
 
 
 def get_metrics(db: Session, user: UserEntity) -> Sequence[MetricEntity]:
-    stmt = select(MetricEntity).where(MetricEntity.user == user)
+    stmt = select(MetricEntity).where(MetricEntity.user_id == user.id)
     return db.exec(stmt).all()
 
 
-def _create_value_entity(
-    metric: MetricEntity, value: Decimal, timestamp: Optional[int | str] = None
-) -> ValueEntity:
+def get_metrics_overview(db: Session, user: UserEntity) -> list[MetricOverviewResponse]:
+    # point counts come from the daily rollups instead of counting values
+    count = (
+        select(func.coalesce(func.sum(RollupEntity.count), 0))
+        .where(
+            RollupEntity.metric_id == MetricEntity.id,
+            RollupEntity.resolution == max(config.ROLLUP_RESOLUTIONS),
+        )
+        .scalar_subquery()
+    )
+    stmt = select(MetricEntity.id, MetricEntity.name, count).where(
+        MetricEntity.user_id == user.id
+    )
+    if _use_blocks():
+        overview = []
+        for metric_id, name, count in db.exec(stmt):
+            last = next(iter(_merged_points(db, metric_id, None, None, True, 1)), None)
+            overview.append(
+                MetricOverviewResponse(
+                    id=metric_id,
+                    name=name,
+                    count=count,
+                    last_timestamp=None if last is None else last[0],
+                    last_value=None if last is None else last[1],
+                )
+            )
+        return overview
+    latest = (
+        select(ValueEntity)
+        .where(ValueEntity.metric_id == MetricEntity.id)
+        .order_by(ValueEntity.timestamp.desc())  # type: ignore
+        .limit(1)
+    )
+    stmt = stmt.add_columns(
+        latest.with_only_columns(ValueEntity.timestamp).scalar_subquery(),
+        latest.with_only_columns(ValueEntity.value).scalar_subquery(),
+    )
+    return [
+        MetricOverviewResponse(
+            id=metric_id,
+            name=name,
+            count=count,
+            last_timestamp=timestamp,
+            last_value=value,
+        )
+        for metric_id, name, count, timestamp, value in db.exec(stmt)
+    ]
+
+
+def _owned_metrics(
+    db: Session, user_id: UUID, metric_ids: Sequence[UUID]
+) -> list[MetricEntity]:
+    stmt = select(MetricEntity).where(
+        MetricEntity.user_id == user_id,
+        MetricEntity.id.in_(metric_ids),  # type: ignore
+    )
+    metrics = {metric.id: metric for metric in db.exec(stmt)}
+    if len(metrics) < len(metric_ids):
+        raise exceptions.NotFound("metric not found")
+    return [metrics[metric_id] for metric_id in metric_ids]
+
+
+def _parse_timestamp(
+    timestamp: Optional[int | str], now: int, parse: TimestampParser
+) -> int:
     if timestamp is None:
-        timestamp = int(datetime.now(timezone.utc).timestamp())
-    elif isinstance(timestamp, str):
-        timestamp = int(parser.parse(timestamp, dayfirst=True).timestamp())
-    return ValueEntity(metric=metric, value=value, timestamp=timestamp)
+        return now
+    return parse(timestamp)
+
+
+def _value_rows(metric_id: UUID, payload: list[ValueRequest]) -> list[dict]:
+    now = int(datetime.now(timezone.utc).timestamp())
+    parse = TimestampParser()
+    try:
+        return [
+            {
+                "metric_id": metric_id,
+                "value": entry.value,
+                "timestamp": _parse_timestamp(entry.timestamp, now, parse),
+            }
+            for entry in payload
+        ]
+    except (ValueError, OverflowError):
+        raise exceptions.BadRequest("invalid timestamp")
+
+
+def _merge_rollup(rollup: dict, other: dict):
+    rollup["count"] += other["count"]
+    rollup["sum"] += other["sum"]
+    rollup["min"] = min(rollup["min"], other["min"])
+    rollup["max"] = max(rollup["max"], other["max"])
+    if other["first_timestamp"] < rollup["first_timestamp"]:
+        rollup["first_timestamp"] = other["first_timestamp"]
+        rollup["first_value"] = other["first_value"]
+    if other["last_timestamp"] >= rollup["last_timestamp"]:
+        rollup["last_timestamp"] = other["last_timestamp"]
+        rollup["last_value"] = other["last_value"]
+
+
+def _rollup_rows(rows: list[dict]) -> list[dict]:
+    finest, *coarser = sorted(config.ROLLUP_RESOLUTIONS)
+    points: dict[tuple, list] = defaultdict(list)
+    for row in rows:
+        timestamp = row["timestamp"]
+        key = (row["metric_id"], finest, timestamp - timestamp % finest)
+        points[key].append((timestamp, row["value"]))
+    rollups = {}
+    for key, group in points.items():
+        values = [
+            value if isinstance(value, Decimal) else Decimal(str(value))
+            for _, value in group
+        ]
+        first = min(range(len(group)), key=lambda i: group[i][0])
+        last = max(reversed(range(len(group))), key=lambda i: group[i][0])
+        rollups[key] = {
+            "metric_id": key[0],
+            "resolution": key[1],
+            "bucket": key[2],
+            "count": len(values),
+            "sum": sum(values),
+            "min": min(values),
+            "max": max(values),
+            "first_timestamp": group[first][0],
+            "first_value": values[first],
+            "last_timestamp": group[last][0],
+            "last_value": values[last],
+        }
+    for resolution in coarser:
+        for rollup in [r for r in rollups.values() if r["resolution"] == finest]:
+            bucket = rollup["bucket"] - rollup["bucket"] % resolution
+            key = (rollup["metric_id"], resolution, bucket)
+            if key in rollups:
+                _merge_rollup(rollups[key], rollup)
+            else:
+                rollups[key] = {**rollup, "resolution": resolution, "bucket": bucket}
+    # a stable key order keeps concurrent upserts from deadlocking on postgres
+    return [rollups[key] for key in sorted(rollups)]
+
+
+@lru_cache
+def _rollup_upsert(dialect: str):
+    stmt = _dialect_insert(dialect)(RollupEntity)
+    old = RollupEntity.__table__.c  # type: ignore
+    new = stmt.excluded
+    earlier = new["first_timestamp"] < old["first_timestamp"]
+    later = new["last_timestamp"] >= old["last_timestamp"]
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[old["metric_id"], old["resolution"], old["bucket"]],
+        set_={
+            "count": old["count"] + new["count"],
+            "sum": old["sum"] + new["sum"],
+            "min": case((new["min"] < old["min"], new["min"]), else_=old["min"]),
+            "max": case((new["max"] > old["max"], new["max"]), else_=old["max"]),
+            "first_timestamp": case(
+                (earlier, new["first_timestamp"]), else_=old["first_timestamp"]
+            ),
+            "first_value": case(
+                (earlier, new["first_value"]), else_=old["first_value"]
+            ),
+            "last_timestamp": case(
+                (later, new["last_timestamp"]), else_=old["last_timestamp"]
+            ),
+            "last_value": case((later, new["last_value"]), else_=old["last_value"]),
+        },
+    )
+    # dialect inserts never hit sqlalchemy's statement cache, and compiling
+    # this one cost more than running it, so it is compiled once to text
+    named = (postgresql if dialect == "postgresql" else sqlite).dialect(
+        paramstyle="named"
+    )
+    # the executing driver renders its own casts for the typed parameters
+    named.bind_typing = BindTyping.NONE
+    return text(str(stmt.compile(dialect=named))).bindparams(
+        *(bindparam(column.name, type_=column.type) for column in old)
+    )
+
+
+def _upsert_rollups(db: Session, rows: list[dict]):
+    rollups = _rollup_rows(rows)
+    upsert = _rollup_upsert(db.get_bind().dialect.name)
+    size = config.VALUES_INSERT_CHUNK_SIZE
+    for offset in range(0, len(rollups), size):
+        db.exec(upsert, params=rollups[offset : offset + size])  # type: ignore
+
+
+def _summary(count: int, mean: float, m2: float, digest: bytes) -> Summary:
+    digest = TDigest.from_bytes(digest, config.SKETCH_COMPRESSION)
+    return Summary(digest, count, mean, m2)
+
+
+def _sketch_row(key: tuple, summary: Summary) -> dict:
+    return {
+        "metric_id": key[0],
+        "resolution": key[1],
+        "bucket": key[2],
+        "count": summary.count,
+        "mean": summary.mean,
+        "m2": summary.m2,
+        "digest": summary.digest.to_bytes(),
+    }
+
+
+def _sketch_summaries(rows: Iterable[dict]) -> dict[tuple, Summary]:
+    groups: dict[tuple, list[float]] = defaultdict(list)
+    for row in rows:
+        metric_id, timestamp = row["metric_id"], row["timestamp"]
+        value = float(row["value"])
+        for resolution in config.ROLLUP_RESOLUTIONS:
+            groups[(metric_id, resolution, timestamp - timestamp % resolution)].append(
+                value
+            )
+    return {
+        key: Summary.of(values, config.SKETCH_COMPRESSION)
+        for key, values in sorted(groups.items())
+    }
+
+
+def _rebuild_sketches(
+    db: Session,
+    metric_id: UUID,
+    start: Optional[int],
+    end: Optional[int],
+    lifetime: bool = True,
+):
+    coarsest = max(config.ROLLUP_RESOLUTIONS)
+    stale = delete(SketchEntity).where(
+        SketchEntity.metric_id == metric_id,  # type: ignore
+        SketchEntity.resolution > 0,  # type: ignore
+    )
+    if start is not None:
+        start -= start % coarsest
+        stale = stale.where(SketchEntity.bucket >= start)  # type: ignore
+    if end is not None:
+        end += -end % coarsest
+        stale = stale.where(SketchEntity.bucket < end)  # type: ignore
+    db.exec(stale)  # type: ignore
+    rows = (
+        {"metric_id": metric_id, "timestamp": timestamp, "value": value}
+        for timestamp, value, _ in _merged_points(db, metric_id, start, end)
+    )
+    for _, group in groupby(rows, key=lambda row: row["timestamp"] // coarsest):
+        sketches = _sketch_summaries(group)
+        db.exec(
+            insert(SketchEntity),  # type: ignore
+            params=[_sketch_row(key, summary) for key, summary in sketches.items()],
+        )
+    if lifetime:
+        _rebuild_lifetime_sketch(db, metric_id)
+
+
+def _rebuild_lifetime_sketch(db: Session, metric_id: UUID):
+    # the all-time sketch is rebuilt as the merge of the daily ones
+    coarsest = max(config.ROLLUP_RESOLUTIONS)
+    summary = Summary(TDigest(config.SKETCH_COMPRESSION))
+    stmt = select(
+        SketchEntity.count, SketchEntity.mean, SketchEntity.m2, SketchEntity.digest
+    ).where(SketchEntity.metric_id == metric_id, SketchEntity.resolution == coarsest)
+    for stored in db.exec(stmt):
+        summary.merge(_summary(*stored))
+    row = _sketch_row((metric_id, *LIFETIME_SKETCH), summary)
+    stmt = _dialect_insert(db.get_bind().dialect.name)(SketchEntity).values(**row)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(SketchEntity.__table__.primary_key),  # type: ignore
+        set_={name: stmt.excluded[name] for name in ("count", "mean", "m2", "digest")},
+    )
+    db.exec(stmt)  # type: ignore
+
+
+def _stale_sketches(metric_ids: Optional[Sequence[UUID]] = None):
+    # sketches are not touched by writes; a day whose sketch count differs
+    # from its rollup count has changed since the sketch was built
+    coarsest = max(config.ROLLUP_RESOLUTIONS)
+    stmt = (
+        select(RollupEntity.metric_id, RollupEntity.bucket)
+        .outerjoin(
+            SketchEntity,
+            and_(
+                SketchEntity.metric_id == RollupEntity.metric_id,
+                SketchEntity.resolution == RollupEntity.resolution,
+                SketchEntity.bucket == RollupEntity.bucket,
+            ),
+        )
+        .outerjoin(RetentionEntity, RetentionEntity.metric_id == RollupEntity.metric_id)
+        .where(
+            RollupEntity.resolution == coarsest,
+            # compacted days have no raw values left to build a sketch from
+            RollupEntity.bucket >= func.coalesce(RetentionEntity.compacted_until, 0),
+            or_(
+                SketchEntity.count.is_(None),  # type: ignore
+                SketchEntity.count != RollupEntity.count,
+            ),
+        )
+        .order_by(RollupEntity.metric_id, RollupEntity.bucket)
+    )
+    if metric_ids is not None:
+        stmt = stmt.where(RollupEntity.metric_id.in_(metric_ids))  # type: ignore
+    return stmt
+
+
+def refresh_sketches(db: Session, limit: Optional[int] = None) -> dict:
+    coarsest = max(config.ROLLUP_RESOLUTIONS)
+    limit = limit or config.SKETCH_REFRESH_BATCH_DAYS
+    stale = db.exec(_stale_sketches().limit(limit)).all()
+    for metric_id, days in groupby(stale, key=lambda row: row[0]):
+        for _, day in days:
+            # hold the day's rollup so writers queue up behind the rebuild
+            stmt = (
+                select(RollupEntity.count)
+                .where(
+                    RollupEntity.metric_id == metric_id,
+                    RollupEntity.resolution == coarsest,
+                    RollupEntity.bucket == day,
+                )
+                .with_for_update()
+            )
+            db.exec(stmt).first()
+            _rebuild_sketches(db, metric_id, day, day + coarsest, lifetime=False)
+        _rebuild_lifetime_sketch(db, metric_id)
+        db.commit()
+    return {"metrics": len({metric_id for metric_id, _ in stale}), "days": len(stale)}
+
+
+def run_sketch_refresh() -> dict:
+    with Session(engine) as db:
+        return refresh_sketches(db)
+
+
+def _compacted_until(db: Session, metric_ids: Iterable[UUID]) -> dict[UUID, int]:
+    stmt = select(RetentionEntity.metric_id, RetentionEntity.compacted_until).where(
+        RetentionEntity.metric_id.in_(list(metric_ids)),  # type: ignore
+        RetentionEntity.compacted_until > 0,
+    )
+    return {metric_id: until for metric_id, until in db.exec(stmt)}
+
+
+def _unique_rows(rows: list[dict], keep_last: bool) -> list[dict]:
+    unique: dict[tuple, dict] = {}
+    for row in rows:
+        key = (row["metric_id"], row["timestamp"])
+        if keep_last or key not in unique:
+            unique[key] = row
+    return list(unique.values())
+
+
+def _values_insert(dialect: str, on_conflict: str):
+    if on_conflict == "reject":
+        return insert(ValueEntity)
+    stmt = _dialect_insert(dialect)(ValueEntity)
+    keys = [ValueEntity.metric_id, ValueEntity.timestamp]
+    if on_conflict == "ignore":
+        return stmt.on_conflict_do_nothing(index_elements=keys).returning(
+            ValueEntity.metric_id, ValueEntity.timestamp, ValueEntity.value
+        )
+    return stmt.on_conflict_do_update(
+        index_elements=keys, set_={"value": stmt.excluded.value}
+    )
+
+
+def _spans(rows: list[dict]) -> dict[UUID, tuple[int, int]]:
+    spans: dict[UUID, tuple[int, int]] = {}
+    for row in rows:
+        start, end = spans.get(row["metric_id"], (row["timestamp"], row["timestamp"]))
+        spans[row["metric_id"]] = (
+            min(start, row["timestamp"]),
+            max(end, row["timestamp"]),
+        )
+    return spans
+
+
+def _sealed_conflicts(db: Session, rows: list[dict]) -> set[tuple[UUID, int]]:
+    span = config.VALUE_BLOCK_SPAN_SECONDS
+    wanted = {(row["metric_id"], row["timestamp"]) for row in rows}
+    keys = list({(metric_id, ts - ts % span) for metric_id, ts in wanted})
+    columns = (BlockEntity.metric_id, BlockEntity.start)
+    size = config.VALUES_INSERT_CHUNK_SIZE
+    conflicts = set()
+    for offset in range(0, len(keys), size):
+        stmt = select(BlockEntity.metric_id, BlockEntity.data).where(
+            tuple_(*columns).in_(keys[offset : offset + size])
+        )
+        for metric_id, data in db.exec(stmt):
+            points = ((metric_id, timestamp) for timestamp, _ in blocks.decode(data))
+            conflicts.update(point for point in points if point in wanted)
+    return conflicts
+
+
+def _write_values(db: Session, rows: list[dict], on_conflict: str) -> list[dict]:
+    dialect = db.get_bind().dialect.name
+    if on_conflict != "reject":
+        rows = _unique_rows(rows, keep_last=on_conflict == "overwrite")
+    compacted = _compacted_until(db, {row["metric_id"] for row in rows})
+    if compacted:
+        # compacted days keep only rollups and sketches, which cannot tell a
+        # repeated point from a new one, so writes behind the horizon stop here
+        live = [
+            row
+            for row in rows
+            if row["timestamp"] >= compacted.get(row["metric_id"], 0)
+        ]
+        if len(live) < len(rows) and on_conflict != "ignore":
+            raise exceptions.Conflict("values before the compaction horizon are final")
+        rows = live
+    if _use_blocks() and on_conflict != "overwrite":
+        # the unique index only covers staged values, so sealed ones are
+        # checked here; an overwrite is staged and wins over the sealed point
+        sealed = _sealed_conflicts(db, rows)
+        if sealed and on_conflict == "reject":
+            raise exceptions.Conflict("a value already exists at this timestamp")
+        rows = [
+            row for row in rows if (row["metric_id"], row["timestamp"]) not in sealed
+        ]
+    stmt = _values_insert(dialect, on_conflict)
+    size = config.VALUES_INSERT_CHUNK_SIZE
+    written = []
+    try:
+        for offset in range(0, len(rows), size):
+            chunk = rows[offset : offset + size]
+            result = db.exec(stmt, params=chunk)  # type: ignore
+            if on_conflict == "ignore":
+                written.extend(dict(row._mapping) for row in result)
+            else:
+                written.extend(chunk)
+    except IntegrityError:
+        db.rollback()
+        raise exceptions.Conflict("a value already exists at this timestamp")
+    if on_conflict == "overwrite":
+        # replaced values can shrink min/max, so touched buckets are recomputed
+        for metric_id, (start, end) in _spans(written).items():
+            rebuild_rollups(db, metric_id, start, end + 1)
+    else:
+        _upsert_rollups(db, written)
+        bump_versions(
+            db.connection(), METRIC_VERSIONS, (row["metric_id"] for row in written)
+        )
+    if hub.active:
+        db.info.setdefault(PUBLISHED_ROWS, []).extend(written)
+    return written
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_values(session: Session):
+    rows = session.info.pop(PUBLISHED_ROWS, None)
+    if rows:
+        # subscribers see values at the precision they were stored with
+        quantum = Decimal(1).scaleb(-blocks.VALUE_DECIMALS)
+        hub.publish(
+            {**row, "value": Decimal(row["value"]).quantize(quantum)} for row in rows
+        )
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_values(session: Session):
+    session.info.pop(PUBLISHED_ROWS, None)
+
+
+def insert_values(db: Session, rows: list[dict], on_conflict: str = "reject") -> int:
+    return len(_write_values(db, rows, on_conflict))
+
+
+def _bucketed_values(bucket: int, first: bool, last: bool) -> list:
+    bucket_start = ValueEntity.timestamp - ValueEntity.timestamp % bucket
+    columns = [
+        ValueEntity.metric_id.label("metric_id"),  # type: ignore
+        bucket_start.label("bucket"),
+        ValueEntity.timestamp.label("timestamp"),  # type: ignore
+        ValueEntity.value.label("value"),  # type: ignore
+    ]
+    if first:
+        rank = func.row_number().over(
+            partition_by=(ValueEntity.metric_id, bucket_start),
+            order_by=(ValueEntity.timestamp, ValueEntity.id),
+        )
+        columns.append(rank.label("first_rank"))
+    if last:
+        rank = func.row_number().over(
+            partition_by=(ValueEntity.metric_id, bucket_start),
+            order_by=(ValueEntity.timestamp.desc(), ValueEntity.id.desc()),
+        )
+        columns.append(rank.label("last_rank"))
+    return columns
+
+
+def _use_blocks() -> bool:
+    return config.VALUES_STORAGE == "blocks"
+
+
+def _sealed_points(
+    db: Session,
+    metric_id: UUID,
+    start: Optional[int],
+    end: Optional[int],
+    descending: bool,
+) -> Iterator[tuple[int, Decimal]]:
+    stmt = select(BlockEntity.data).where(BlockEntity.metric_id == metric_id)
+    if start is not None:
+        stmt = stmt.where(BlockEntity.start > start - config.VALUE_BLOCK_SPAN_SECONDS)
+    if end is not None:
+        stmt = stmt.where(BlockEntity.start < end)
+    if descending:
+        stmt = stmt.order_by(BlockEntity.start.desc())  # type: ignore
+    else:
+        stmt = stmt.order_by(BlockEntity.start)
+    for data in db.exec(stmt).all():
+        points = blocks.decode(data)
+        if descending:
+            points.reverse()
+        for timestamp, value in points:
+            if (start is None or timestamp >= start) and (
+                end is None or timestamp < end
+            ):
+                yield timestamp, value
 
 
-def add_values(db: Session, metric: MetricEntity, payload: list[ValueRequest]):
-    for entry in payload:
-        stat = _create_value_entity(metric, entry.value, timestamp=entry.timestamp)
-        db.add(stat)
+def _merged_points(
+    db: Session,
+    metric_id: UUID,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    descending: bool = False,
+    limit: Optional[int] = None,
+) -> Iterator[tuple[int, Decimal, Optional[UUID | int]]]:
+    stmt = _in_range(
+        select(ValueEntity.timestamp, ValueEntity.value, ValueEntity.id),
+        [metric_id],
+        start,
+        end,
+    )
+    if descending:
+        stmt = stmt.order_by(ValueEntity.timestamp.desc())  # type: ignore
+    else:
+        stmt = stmt.order_by(ValueEntity.timestamp)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    staged = db.exec(stmt).all()
+    sealed = _sealed_points(db, metric_id, start, end, descending)
+    if not staged:
+        for timestamp, value in sealed:
+            yield timestamp, value, None
+        return
+    # staged points sort ahead of sealed ones at the same timestamp and win
+    staged_rank, sealed_rank = (1, 0) if descending else (0, 1)
+    previous = None
+    for timestamp, _, value, value_id in heapq.merge(
+        (
+            (timestamp, staged_rank, value, value_id)
+            for timestamp, value, value_id in staged
+        ),
+        ((timestamp, sealed_rank, value, None) for timestamp, value in sealed),
+        key=lambda point: point[:2],
+        reverse=descending,
+    ):
+        if timestamp != previous:
+            yield timestamp, value, value_id
+        previous = timestamp
+
+
+def _sealed_id(metric_id: UUID, timestamp: int) -> Optional[UUID]:
+    # sealed points have no row; uuid keys get a stable one from the timestamp
+    if config.VALUES_KEY == "integer":
+        return None
+    return uuid5(metric_id, str(timestamp))
+
+
+def _point_values(metric_id: UUID, points) -> list[ValueEntity]:
+    return [
+        ValueEntity.model_construct(
+            id=value_id or _sealed_id(metric_id, timestamp),
+            timestamp=timestamp,
+            value=value,
+            metric_id=metric_id,
+        )
+        for timestamp, value, value_id in points
+    ]
+
+
+def _rebuild_rollups_from_points(
+    db: Session, metric_id: UUID, start: Optional[int], end: Optional[int]
+):
+    coarsest = max(config.ROLLUP_RESOLUTIONS)
+    stale = delete(RollupEntity).where(RollupEntity.metric_id == metric_id)  # type: ignore
+    if start is not None:
+        start -= start % coarsest
+        stale = stale.where(RollupEntity.bucket >= start)  # type: ignore
+    if end is not None:
+        end += -end % coarsest
+        stale = stale.where(RollupEntity.bucket < end)  # type: ignore
+    db.exec(stale)  # type: ignore
+    rows = (
+        {"metric_id": metric_id, "timestamp": timestamp, "value": value}
+        for timestamp, value, _ in _merged_points(db, metric_id, start, end)
+    )
+    for _, group in groupby(rows, key=lambda row: row["timestamp"] // coarsest):
+        db.exec(insert(RollupEntity), params=_rollup_rows(list(group)))  # type: ignore
+    bump_versions(db.connection(), METRIC_VERSIONS, [metric_id])
+
+
+def rebuild_rollups(
+    db: Session,
+    metric_id: UUID,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> None:
+    compacted = _compacted_until(db, [metric_id]).get(metric_id)
+    if compacted is not None:
+        # raw values behind the compaction horizon are gone
+        start = compacted if start is None else max(start, compacted)
+    _rebuild_sketches(db, metric_id, start, end)
+    if _use_blocks():
+        _rebuild_rollups_from_points(db, metric_id, start, end)
+        return
+    for resolution in config.ROLLUP_RESOLUTIONS:
+        stale = delete(RollupEntity).where(
+            RollupEntity.metric_id == metric_id,  # type: ignore
+            RollupEntity.resolution == resolution,  # type: ignore
+        )
+        rows = select(*_bucketed_values(resolution, first=True, last=True)).where(
+            ValueEntity.metric_id == metric_id
+        )
+        if start is not None:
+            low = start - start % resolution
+            stale = stale.where(RollupEntity.bucket >= low)  # type: ignore
+            rows = rows.where(ValueEntity.timestamp >= low)
+        if end is not None:
+            high = end - end % resolution + (resolution if end % resolution else 0)
+            stale = stale.where(RollupEntity.bucket < high)  # type: ignore
+            rows = rows.where(ValueEntity.timestamp < high)
+        db.exec(stale)  # type: ignore
+        rows = rows.subquery()
+        stmt = select(
+            rows.c.metric_id,
+            literal(resolution),
+            rows.c.bucket,
+            func.count(),
+            func.sum(rows.c.value),
+            func.min(rows.c.value),
+            func.max(rows.c.value),
+            func.min(rows.c.timestamp),
+            func.max(case((rows.c.first_rank == 1, rows.c.value))),
+            func.max(rows.c.timestamp),
+            func.max(case((rows.c.last_rank == 1, rows.c.value))),
+        ).group_by(rows.c.metric_id, rows.c.bucket)
+        columns = [
+            "metric_id",
+            "resolution",
+            "bucket",
+            "count",
+            "sum",
+            "min",
+            "max",
+            "first_timestamp",
+            "first_value",
+            "last_timestamp",
+            "last_value",
+        ]
+        db.exec(insert(RollupEntity).from_select(columns, stmt))  # type: ignore
+    bump_versions(db.connection(), METRIC_VERSIONS, [metric_id])
+
+
+def backfill_rollups(db: Session) -> int:
+    # metrics written before rollups existed have nothing to aggregate from,
+    # so they are rebuilt once from their raw values; the sketcher follows
+    has_data = or_(
+        exists().where(ValueEntity.metric_id == MetricEntity.id),
+        exists().where(BlockEntity.metric_id == MetricEntity.id),
+    )
+    has_rollups = exists().where(RollupEntity.metric_id == MetricEntity.id)
+    stmt = select(MetricEntity.id).where(has_data, ~has_rollups)
+    metric_ids = db.exec(stmt).all()
+    for metric_id in metric_ids:
+        try:
+            rebuild_rollups(db, cast(UUID, metric_id))
+            db.commit()
+        except IntegrityError:
+            # another worker backfilled it first
+            db.rollback()
+    return len(metric_ids)
+
+
+def run_backfill() -> int:
+    with Session(engine) as db:
+        return backfill_rollups(db)
+
+
+def _retention_cutoff(days: Optional[int], now: int) -> Optional[int]:
+    if days is None:
+        return None
+    cutoff = now - days * BUCKET_UNITS["d"]
+    # whole coarsest buckets keep every rollup level rebuildable from raw values
+    return cutoff - cutoff % max(config.ROLLUP_RESOLUTIONS)
+
+
+def get_retention(db: Session, metric: MetricEntity) -> RetentionResponse:
+    stmt = select(
+        RetentionEntity.raw_days,
+        RetentionEntity.hourly_days,
+        RetentionEntity.compacted_until,
+    ).where(RetentionEntity.metric_id == metric.id)
+    row = db.exec(stmt).first()
+    if row is None:
+        return RetentionResponse()
+    return RetentionResponse(**row._mapping)
+
+
+def set_retention(
+    db: Session, metric: MetricEntity, payload: RetentionRequest
+) -> RetentionResponse:
+    stmt = _dialect_insert(db.get_bind().dialect.name)(RetentionEntity).values(
+        metric_id=metric.id, raw_days=payload.raw_days, hourly_days=payload.hourly_days
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[RetentionEntity.metric_id],
+        set_={
+            "raw_days": stmt.excluded.raw_days,
+            "hourly_days": stmt.excluded.hourly_days,
+        },
+    )
+    db.exec(stmt)  # type: ignore
     db.commit()
+    return get_retention(db, metric)
 
 
-def get_values(db: Session, metric: MetricEntity):
-    stmt = select(ValueEntity).where(ValueEntity.metric == metric)
-    return db.exec(stmt).all()
+def _retention_plans(
+    db: Session, now: int, metric_ids: Optional[Sequence[UUID]] = None
+) -> list[tuple[UUID, Optional[int], Optional[int], int]]:
+    stmt = select(
+        MetricEntity.id,
+        RetentionEntity.raw_days,
+        RetentionEntity.hourly_days,
+        RetentionEntity.compacted_until,
+    ).outerjoin(RetentionEntity, RetentionEntity.metric_id == MetricEntity.id)
+    if metric_ids:
+        stmt = stmt.where(MetricEntity.id.in_(metric_ids))  # type: ignore
+    if config.RETENTION_RAW_DAYS is None and config.RETENTION_HOURLY_DAYS is None:
+        stmt = stmt.where(
+            or_(
+                RetentionEntity.raw_days.is_not(None),  # type: ignore
+                RetentionEntity.hourly_days.is_not(None),  # type: ignore
+            )
+        )
+    plans = []
+    for metric_id, raw_days, hourly_days, compacted_until in db.exec(
+        stmt.order_by(MetricEntity.id)
+    ):
+        raw = _retention_cutoff(raw_days or config.RETENTION_RAW_DAYS, now)
+        hourly = _retention_cutoff(hourly_days or config.RETENTION_HOURLY_DAYS, now)
+        if raw is not None or hourly is not None:
+            plans.append((metric_id, raw, hourly, compacted_until or 0))
+    return plans
+
+
+def _row_bytes(db: Session, table: str) -> Optional[float]:
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        stmt = text(
+            "SELECT pg_total_relation_size(oid) / greatest(reltuples, 1) "
+            "FROM pg_class WHERE relname = :table"
+        )
+    elif dialect == "sqlite":
+        stmt = text(
+            "SELECT sum(pgsize) * 1.0 / max("
+            f'(SELECT count(*) FROM "{table}"), 1) FROM dbstat WHERE name IN '
+            "(SELECT name FROM sqlite_master WHERE tbl_name = :table)"
+        )
+    else:
+        return None
+    try:
+        return db.exec(stmt, params={"table": table}).scalar()  # type: ignore
+    except OperationalError:
+        db.rollback()
+        return None
+
+
+def compaction_report(
+    db: Session, now: Optional[int] = None, metric_ids: Optional[Sequence[UUID]] = None
+) -> dict:
+    now = int(time.time()) if now is None else now
+    finest = min(config.ROLLUP_RESOLUTIONS)
+    metrics = []
+    for metric_id, raw, hourly, compacted_until in _retention_plans(
+        db, now, metric_ids
+    ):
+        values = sealed = sealed_bytes = rollups = 0
+        if raw is not None:
+            stmt = select(func.count()).where(
+                ValueEntity.metric_id == metric_id, ValueEntity.timestamp < raw
+            )
+            values = db.exec(stmt).one()
+            stmt = select(
+                func.coalesce(func.sum(BlockEntity.count), 0),
+                func.coalesce(func.sum(func.length(BlockEntity.data)), 0),
+            ).where(BlockEntity.metric_id == metric_id, BlockEntity.start < raw)
+            sealed, sealed_bytes = db.exec(stmt).one()
+        horizon = max(compacted_until, raw or 0)
+        if hourly is not None and horizon:
+            stmt = select(func.count()).where(
+                RollupEntity.metric_id == metric_id,
+                RollupEntity.resolution == finest,
+                RollupEntity.bucket < min(hourly, horizon),
+            )
+            rollups = db.exec(stmt).one()
+        if values or sealed or rollups:
+            metrics.append(
+                {
+                    "metric_id": metric_id,
+                    "raw_before": raw,
+                    "hourly_before": hourly,
+                    "values": values,
+                    "sealed": sealed,
+                    "sealed_bytes": sealed_bytes,
+                    "rollups": rollups,
+                }
+            )
+    values = sum(metric["values"] for metric in metrics)
+    sealed = sum(metric["sealed"] for metric in metrics)
+    rollups = sum(metric["rollups"] for metric in metrics)
+    value_bytes = _row_bytes(db, ValueEntity.__tablename__) if values else 0  # type: ignore
+    rollup_bytes = _row_bytes(db, RollupEntity.__tablename__) if rollups else 0  # type: ignore
+    estimated = None
+    if value_bytes is not None and rollup_bytes is not None:
+        estimated = int(values * value_bytes + rollups * rollup_bytes)
+        estimated += sum(metric["sealed_bytes"] for metric in metrics)
+    return {
+        "values": values,
+        "sealed": sealed,
+        "rollups": rollups,
+        "estimated_bytes": estimated,
+        "metrics": metrics,
+    }
+
+
+def _delete_in_chunks(
+    db: Session, metric_id: UUID, key, conditions: list, chunk_rows: int
+) -> int:
+    deleted = 0
+    while True:
+        keys = select(key).where(*conditions).limit(chunk_rows)
+        stmt = delete(key.class_).where(*conditions, key.in_(keys))
+        count = db.exec(stmt).rowcount  # type: ignore
+        bump_versions(db.connection(), METRIC_VERSIONS, [metric_id])
+        db.commit()
+        deleted += count
+        if count < chunk_rows:
+            return deleted
+
+
+def _set_compacted_until(db: Session, metric_id: UUID, compacted_until: int):
+    stmt = _dialect_insert(db.get_bind().dialect.name)(RetentionEntity)
+    stmt = stmt.values(metric_id=metric_id, compacted_until=compacted_until)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[RetentionEntity.metric_id],
+        set_={"compacted_until": stmt.excluded.compacted_until},
+    )
+    db.exec(stmt)  # type: ignore
+
+
+def compact_metric(
+    db: Session,
+    metric_id: UUID,
+    raw_cutoff: Optional[int],
+    hourly_cutoff: Optional[int],
+    compacted_until: int,
+    chunk_rows: Optional[int] = None,
+) -> dict:
+    chunk_rows = chunk_rows or config.COMPACTION_CHUNK_ROWS
+    step = max(config.ROLLUP_RESOLUTIONS)
+    values = rollups = 0
+    if raw_cutoff is not None:
+        oldest = select(func.min(ValueEntity.timestamp)).where(
+            ValueEntity.metric_id == metric_id, ValueEntity.timestamp < raw_cutoff
+        )
+        oldest_block = select(func.min(BlockEntity.start)).where(
+            BlockEntity.metric_id == metric_id, BlockEntity.start < raw_cutoff
+        )
+        while True:
+            firsts = [db.exec(oldest).one(), db.exec(oldest_block).one()]
+            if firsts == [None, None]:
+                break
+            first = min(first for first in firsts if first is not None)
+            day = first - first % step
+            if day >= compacted_until:
+                # the watermark moves with the rebuild, so a crash while
+                # deleting never rebuilds this day from half its values
+                rebuild_rollups(db, metric_id, day, day + step)
+                compacted_until = day + step
+                _set_compacted_until(db, metric_id, compacted_until)
+                db.commit()
+            values += _delete_in_chunks(
+                db,
+                metric_id,
+                ValueEntity.id,
+                [
+                    ValueEntity.metric_id == metric_id,
+                    ValueEntity.timestamp >= day,
+                    ValueEntity.timestamp < day + step,
+                ],
+                chunk_rows,
+            )
+            sealed = [
+                BlockEntity.metric_id == metric_id,
+                BlockEntity.start >= day,
+                BlockEntity.start < day + step,
+            ]
+            stmt = select(func.coalesce(func.sum(BlockEntity.count), 0))
+            values += db.exec(stmt.where(*sealed)).one()
+            _delete_in_chunks(db, metric_id, BlockEntity.start, sealed, chunk_rows)
+        if raw_cutoff > compacted_until:
+            compacted_until = raw_cutoff
+            _set_compacted_until(db, metric_id, compacted_until)
+            db.commit()
+    # hourly rollups are only pruned where raw values cannot rebuild them
+    if hourly_cutoff is not None and compacted_until:
+        rollups = _delete_in_chunks(
+            db,
+            metric_id,
+            RollupEntity.bucket,
+            [
+                RollupEntity.metric_id == metric_id,
+                RollupEntity.resolution == min(config.ROLLUP_RESOLUTIONS),
+                RollupEntity.bucket < min(hourly_cutoff, compacted_until),
+            ],
+            chunk_rows,
+        )
+    return {"values": values, "rollups": rollups}
+
+
+def compact(
+    db: Session,
+    now: Optional[int] = None,
+    metric_ids: Optional[Sequence[UUID]] = None,
+    chunk_rows: Optional[int] = None,
+) -> dict:
+    now = int(time.time()) if now is None else now
+    totals = {"metrics": 0, "values": 0, "rollups": 0}
+    for plan in _retention_plans(db, now, metric_ids):
+        result = compact_metric(db, *plan, chunk_rows=chunk_rows)
+        if result["values"] or result["rollups"]:
+            totals["metrics"] += 1
+            totals["values"] += result["values"]
+            totals["rollups"] += result["rollups"]
+    return totals
+
+
+def run_compaction() -> dict:
+    with Session(engine) as db:
+        return compact(db)
+
+
+def seal_span(db: Session, metric_id: UUID, start: int) -> int:
+    end = start + config.VALUE_BLOCK_SPAN_SECONDS
+    block = {"metric_id": metric_id, "start": start}
+    # claim the block row first so concurrent sealers queue up behind it
+    stmt = _dialect_insert(db.get_bind().dialect.name)(BlockEntity).values(
+        **block, count=0, data=blocks.encode([])
+    )
+    db.exec(stmt.on_conflict_do_nothing())  # type: ignore
+    stmt = select(BlockEntity.data).filter_by(**block).with_for_update()
+    points = dict(blocks.decode(db.exec(stmt).one()))
+    sealed = len(points)
+    stmt = (
+        delete(ValueEntity)
+        .where(
+            ValueEntity.metric_id == metric_id,  # type: ignore
+            ValueEntity.timestamp >= start,  # type: ignore
+            ValueEntity.timestamp < end,  # type: ignore
+        )
+        .returning(ValueEntity.timestamp, ValueEntity.value)
+    )
+    staged = db.exec(stmt).all()  # type: ignore
+    if not staged:
+        db.rollback()
+        return 0
+    points.update(staged)
+    stmt = (
+        update(BlockEntity)
+        .filter_by(**block)
+        .values(count=len(points), data=blocks.encode(list(points.items())))
+    )
+    db.exec(stmt)  # type: ignore
+    if sealed + len(staged) > len(points):
+        # re-sent sealed points were counted twice by the incremental rollups
+        rebuild_rollups(db, metric_id, start, end)
+    bump_versions(db.connection(), METRIC_VERSIONS, [metric_id])
+    db.commit()
+    return len(staged)
+
+
+def seal_blocks(
+    db: Session, now: Optional[int] = None, metric_ids: Optional[Sequence[UUID]] = None
+) -> dict:
+    now = int(time.time()) if now is None else now
+    horizon = now - config.BLOCK_SEAL_GRACE_SECONDS
+    horizon -= horizon % config.VALUE_BLOCK_SPAN_SECONDS
+    stmt = select(ValueEntity.metric_id).where(ValueEntity.timestamp < horizon)
+    if metric_ids:
+        stmt = stmt.where(ValueEntity.metric_id.in_(metric_ids))  # type: ignore
+    totals = {"metrics": 0, "blocks": 0, "values": 0}
+    for metric_id in db.exec(stmt.distinct()).all():
+        oldest = select(func.min(ValueEntity.timestamp)).where(
+            ValueEntity.metric_id == metric_id, ValueEntity.timestamp < horizon
+        )
+        totals["metrics"] += 1
+        while (first := db.exec(oldest).one()) is not None:
+            start = first - first % config.VALUE_BLOCK_SPAN_SECONDS
+            totals["values"] += seal_span(db, cast(UUID, metric_id), start)
+            totals["blocks"] += 1
+    return totals
+
+
+def run_sealing() -> dict:
+    with Session(engine) as db:
+        return seal_blocks(db)
+
+
+def _insert_and_commit(db: Session, rows: list[dict], on_conflict: str) -> int:
+    inserted = insert_values(db, rows, on_conflict)
+    db.commit()
+    return inserted
+
+
+def add_values(
+    db: Session,
+    metric: MetricEntity,
+    payload: list[ValueRequest],
+    on_conflict: str = "reject",
+) -> int:
+    rows = _value_rows(cast(UUID, metric.id), payload)
+    return _insert_and_commit(db, rows, on_conflict)
+
+
+def get_ingest_buffer() -> Optional[IngestBuffer]:
+    return ingest_buffer if config.INGEST_BUFFER_ENABLED else None
+
+
+async def buffer_values(
+    db: Session,
+    buffer: IngestBuffer,
+    metric: MetricEntity,
+    payload: list[ValueRequest],
+    wait: bool,
+    on_conflict: str = "reject",
+) -> int:
+    rows = _value_rows(cast(UUID, metric.id), payload)
+    # hand the request's connection back so waiting callers cannot starve flushes;
+    # closing rolls it back, so do it before the flush can start
+    await run(db, Session.close)
+    future = buffer.submit(rows, on_conflict)
+    if wait:
+        return await asyncio.wrap_future(future)
+    return len(rows)
+
+
+def _resolve_metrics(
+    db: Session, user_id: UUID, payload: BulkValuesRequest
+) -> list[MetricEntity | MetricRejected]:
+    ids = {entry.id for entry in payload.metrics if entry.id is not None}
+    names = {entry.name for entry in payload.metrics if entry.id is None}
+    stmt = select(MetricEntity).where(
+        MetricEntity.user_id == user_id,
+        or_(MetricEntity.id.in_(ids), MetricEntity.name.in_(names)),  # type: ignore
+    )
+    by_id: dict[UUID, MetricEntity] = {}
+    by_name: dict[str, list[MetricEntity]] = defaultdict(list)
+    for metric in db.exec(stmt):
+        by_id[cast(UUID, metric.id)] = metric
+        by_name[metric.name].append(metric)
+    resolved: list[MetricEntity | MetricRejected] = []
+    for entry in payload.metrics:
+        if entry.id is not None:
+            matches = [by_id[entry.id]] if entry.id in by_id else []
+        else:
+            matches = by_name.get(cast(str, entry.name), [])
+        if len(matches) == 1:
+            resolved.append(matches[0])
+            continue
+        detail = "metric not found" if not matches else "ambiguous metric name"
+        resolved.append(MetricRejected(id=entry.id, name=entry.name, detail=detail))
+    return resolved
+
+
+def add_metrics_values(
+    db: Session,
+    user: UserEntity,
+    payload: BulkValuesRequest,
+    on_conflict: str = "reject",
+) -> BulkValuesResponse:
+    resolved = _resolve_metrics(db, cast(UUID, user.id), payload)
+    rejected = [entry for entry in resolved if isinstance(entry, MetricRejected)]
+    if rejected and not payload.partial:
+        details = ", ".join(
+            f"{entry.id or entry.name}: {entry.detail}" for entry in rejected
+        )
+        if all(entry.detail == "metric not found" for entry in rejected):
+            raise exceptions.NotFound(details)
+        raise exceptions.BadRequest(details)
+    rows = []
+    inserted: dict[UUID, MetricInserted] = {}
+    for entry, metric in zip(payload.metrics, resolved):
+        if isinstance(metric, MetricRejected):
+            continue
+        metric_id = cast(UUID, metric.id)
+        rows.extend(_value_rows(metric_id, entry.values))
+        inserted.setdefault(
+            metric_id, MetricInserted(id=metric_id, name=metric.name, inserted=0)
+        )
+    written = _write_values(db, rows, on_conflict)
+    db.commit()
+    for row in written:
+        inserted[row["metric_id"]].inserted += 1
+    return BulkValuesResponse(
+        inserted=len(written), metrics=list(inserted.values()), rejected=rejected
+    )
+
+
+def parse_value_line(
+    line: bytes, media_type: str, now: int, parse: TimestampParser
+) -> dict:
+    if media_type == "text/csv":
+        timestamp, value = next(csv.reader([line.decode()]))
+        entry = ValueRequest(value=Decimal(value), timestamp=timestamp or None)
+    else:
+        entry = ValueRequest.model_validate_json(line)
+    timestamp = _parse_timestamp(entry.timestamp, now, parse)
+    return {"value": entry.value, "timestamp": timestamp}
+
+
+async def ingest_values(
+    db: Session,
+    metric: MetricEntity,
+    media_type: str,
+    chunks: AsyncIterator[bytes],
+    on_conflict: str = "reject",
+) -> tuple[int, int]:
+    if media_type not in STREAM_MEDIA_TYPES:
+        raise exceptions.BadRequest("unsupported content type")
+    accepted = rejected = 0
+    batch: list[dict] = []
+    pending = b""
+    first_line = True
+    parse = TimestampParser()
+
+    async def flush():
+        nonlocal accepted, rejected
+        # batches are committed as the stream arrives, so under reject a
+        # conflicting line is counted as rejected instead of failing the request
+        # after earlier batches were kept
+        if on_conflict == "reject":
+            inserted = await run(db, _insert_and_commit, list(batch), "ignore")
+            accepted -= len(batch) - inserted
+            rejected += len(batch) - inserted
+        else:
+            await run(db, _insert_and_commit, list(batch), on_conflict)
+        batch.clear()
+
+    async def lines():
+        nonlocal pending
+        async for chunk in chunks:
+            *complete, pending = (pending + chunk).split(b"\n")
+            for line in complete:
+                yield line
+        yield pending
+
+    async for line in lines():
+        line = line.strip()
+        if not line:
+            continue
+        if first_line and media_type == "text/csv" and line.startswith(b"timestamp"):
+            first_line = False
+            continue
+        first_line = False
+        now = int(datetime.now(timezone.utc).timestamp())
+        try:
+            row = parse_value_line(line, media_type, now, parse)
+        except Exception:
+            rejected += 1
+            continue
+        batch.append({"metric_id": metric.id, **row})
+        accepted += 1
+        if len(batch) >= config.VALUES_INGEST_BATCH_SIZE:
+            await flush()
+    if batch:
+        await flush()
+    return accepted, rejected
+
+
+def _of_metrics(column, metric_ids: Sequence[UUID]):
+    if len(metric_ids) == 1:
+        return column == metric_ids[0]
+    return column.in_(metric_ids)
+
+
+def _in_range(
+    stmt, metric_ids: Sequence[UUID], start: Optional[int], end: Optional[int]
+):
+    stmt = stmt.where(_of_metrics(ValueEntity.metric_id, metric_ids))
+    if start is not None:
+        stmt = stmt.where(ValueEntity.timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(ValueEntity.timestamp < end)
+    return stmt
+
+
+def encode_cursor(timestamp: int, value_id: Optional[UUID | int]) -> str:
+    key = value_id.hex if isinstance(value_id, UUID) else value_id or ""
+    raw = f"{timestamp}:{key}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[int, Optional[UUID | int]]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, value_id = raw.split(":")
+        if not value_id:
+            return int(timestamp), None
+        key = int if config.VALUES_KEY == "integer" else UUID
+        return int(timestamp), key(value_id)
+    except Exception:
+        raise exceptions.BadRequest("invalid cursor")
+
+
+def get_values(
+    db: Session,
+    metric: MetricEntity,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    limit: Optional[int] = None,
+    order: str = "asc",
+    cursor: Optional[str] = None,
+) -> tuple[Sequence[ValueEntity], Optional[str]]:
+    descending = order == "desc"
+    if _use_blocks():
+        metric_id = cast(UUID, metric.id)
+        if cursor is not None:
+            # timestamps are unique per metric, so they alone resume the page
+            timestamp, _ = decode_cursor(cursor)
+            if descending:
+                end = timestamp if end is None else min(end, timestamp)
+            else:
+                start = timestamp + 1 if start is None else max(start, timestamp + 1)
+        fetch = None if limit is None else limit + 1
+        points = _merged_points(db, metric_id, start, end, descending, fetch)
+        values = _point_values(metric_id, islice(points, fetch))
+        return _page(values, limit)
+    stmt = _in_range(select(ValueEntity), [metric.id], start, end)
+    if cursor is not None:
+        timestamp, value_id = decode_cursor(cursor)
+        if descending:
+            after = or_(
+                ValueEntity.timestamp < timestamp,
+                and_(ValueEntity.timestamp == timestamp, ValueEntity.id < value_id),
+            )
+        else:
+            after = or_(
+                ValueEntity.timestamp > timestamp,
+                and_(ValueEntity.timestamp == timestamp, ValueEntity.id > value_id),
+            )
+        stmt = stmt.where(after)
+    if descending:
+        stmt = stmt.order_by(ValueEntity.timestamp.desc(), ValueEntity.id.desc())
+    else:
+        stmt = stmt.order_by(ValueEntity.timestamp, ValueEntity.id)
+    if limit is None:
+        return db.exec(stmt).all(), None
+    return _page(db.exec(stmt.limit(limit + 1)).all(), limit)
+
+
+def _page(
+    values: Sequence[ValueEntity], limit: Optional[int]
+) -> tuple[Sequence[ValueEntity], Optional[str]]:
+    if limit is None or len(values) <= limit:
+        return values, None
+    values = values[:limit]
+    last = values[-1]
+    return values, encode_cursor(last.timestamp, last.id)
+
+
+def get_metrics_values(
+    db: Session,
+    metric_ids: Sequence[UUID],
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    limit: Optional[int] = None,
+    order: str = "asc",
+) -> dict[UUID, list[ValueEntity]]:
+    if _use_blocks():
+        return {
+            metric_id: _point_values(
+                metric_id,
+                islice(
+                    _merged_points(db, metric_id, start, end, order == "desc", limit),
+                    limit,
+                ),
+            )
+            for metric_id in metric_ids
+        }
+    stmt = _in_range(select(ValueEntity), metric_ids, start, end)
+    if order == "desc":
+        ordering = (ValueEntity.timestamp.desc(), ValueEntity.id.desc())
+    else:
+        ordering = (ValueEntity.timestamp, ValueEntity.id)
+    if limit is None:
+        stmt = stmt.order_by(ValueEntity.metric_id, *ordering)
+    else:
+        rank = func.row_number().over(
+            partition_by=ValueEntity.metric_id, order_by=ordering
+        )
+        ranked = stmt.add_columns(rank.label("rank")).subquery()
+        values = aliased(ValueEntity, ranked)
+        stmt = (
+            select(values)
+            .where(ranked.c.rank <= limit)
+            .order_by(ranked.c.metric_id, ranked.c.rank)
+        )
+    grouped: dict[UUID, list[ValueEntity]] = {metric_id: [] for metric_id in metric_ids}
+    for value in db.exec(stmt):  # type: ignore
+        grouped[value.metric_id].append(value)
+    return grouped
+
+
+def stream_media_type(accept: Optional[str]) -> Optional[str]:
+    for media_range in (accept or "").split(","):
+        media_type = media_range.split(";")[0].strip().lower()
+        if media_type in STREAM_MEDIA_TYPES:
+            return media_type
+    return None
+
+
+def _encode_ndjson(rows) -> str:
+    return "".join(
+        json.dumps(
+            {
+                "id": None if row.id is None else str(row.id),
+                "metric_id": str(row.metric_id),
+                "timestamp": row.timestamp,
+                "value": str(row.value),
+            }
+        )
+        + "\n"
+        for row in rows
+    )
+
+
+def _encode_csv(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows((row.timestamp, row.value) for row in rows)
+    return buffer.getvalue()
+
+
+def stream_values(
+    bind,
+    metric: MetricEntity,
+    media_type: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    limit: Optional[int] = None,
+    order: str = "asc",
+) -> Iterator[bytes]:
+    columns = (
+        ValueEntity.id,
+        ValueEntity.metric_id,
+        ValueEntity.timestamp,
+        ValueEntity.value,
+    )
+    stmt = _in_range(select(*columns), [metric.id], start, end)
+    if order == "desc":
+        stmt = stmt.order_by(ValueEntity.timestamp.desc(), ValueEntity.id.desc())
+    else:
+        stmt = stmt.order_by(ValueEntity.timestamp, ValueEntity.id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    encode = _encode_csv if media_type == "text/csv" else _encode_ndjson
+    if media_type == "text/csv":
+        yield b"timestamp,value\r\n"
+    with Session(bind) as db:
+        if _use_blocks():
+            metric_id = cast(UUID, metric.id)
+            points = islice(
+                _merged_points(db, metric_id, start, end, order == "desc", limit),
+                limit,
+            )
+            while chunk := list(islice(points, config.VALUES_STREAM_BATCH_SIZE)):
+                yield encode(_point_values(metric_id, chunk)).encode()
+            return
+        result = db.exec(
+            stmt,  # type: ignore
+            execution_options={"yield_per": config.VALUES_STREAM_BATCH_SIZE},
+        )
+        for rows in result.partitions():
+            yield encode(rows).encode()
+
+
+def subscribable_metrics(
+    db: Session, user: UserEntity, metric_ids: Sequence[UUID]
+) -> list[UUID]:
+    metric_ids = list(dict.fromkeys(metric_ids))
+    _owned_metrics(db, cast(UUID, user.id), metric_ids)
+    return metric_ids
+
+
+def _event(name: str, data: dict) -> bytes:
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+async def value_events(
+    metric_ids: Sequence[UUID], limit: Optional[int] = None
+) -> AsyncIterator[bytes]:
+    subscription = hub.subscribe(metric_ids)
+    try:
+        yield b": subscribed\n\n"
+        sent = 0
+        while limit is None or sent < limit:
+            try:
+                metric_id, points = await asyncio.wait_for(
+                    subscription.get(), config.SUBSCRIPTION_HEARTBEAT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                yield b": heartbeat\n\n"
+                continue
+            dropped = subscription.take_dropped()
+            if dropped:
+                yield _event("dropped", {"values": dropped})
+            values = [{"timestamp": ts, "value": value} for ts, value in points]
+            yield _event("values", {"metric_id": str(metric_id), "values": values})
+            sent += 1
+    finally:
+        hub.unsubscribe(subscription)
+
+
+def _sketch_cover(
+    start: Optional[int], end: Optional[int], resolutions: list[int]
+) -> list[tuple[Optional[int], Optional[int], Optional[int]]]:
+    # whole buckets come from the coarsest sketches, ragged edges from finer
+    # ones and finally from raw points
+    if not resolutions:
+        return [(None, start, end)]
+    resolution, *finer = resolutions
+    low = None if start is None else start + -start % resolution
+    high = None if end is None else end - end % resolution
+    if low is not None and high is not None and low >= high:
+        return _sketch_cover(start, end, finer)
+    pieces: list = [(resolution, low, high)]
+    if start is not None and low is not None and start < low:
+        pieces += _sketch_cover(start, low, finer)
+    if end is not None and high is not None and high < end:
+        pieces += _sketch_cover(high, end, finer)
+    return pieces
+
+
+def get_stats(
+    db: Session,
+    metric: MetricEntity,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> StatsResponse:
+    metric_id = cast(UUID, metric.id)
+    coarsest = max(config.ROLLUP_RESOLUTIONS)
+    stmt = _stale_sketches([metric_id])
+    if start is not None:
+        stmt = stmt.where(RollupEntity.bucket >= start - start % coarsest)
+    if end is not None:
+        stmt = stmt.where(RollupEntity.bucket < end)
+    # days the sketcher has not caught up with yet are read raw
+    stale = [day for _, day in db.exec(stmt)]
+    if start is None and end is None and not stale:
+        resolution, bucket = LIFETIME_SKETCH
+        pieces: list = [(resolution, bucket, bucket + 1)]
+    else:
+        resolutions = sorted(config.ROLLUP_RESOLUTIONS, reverse=True)
+        pieces = _sketch_cover(start, end, resolutions)
+    summary = Summary(TDigest(config.SKETCH_COMPRESSION))
+    raw = []
+    for resolution, low, high in pieces:
+        if resolution is None:
+            raw.append((low, high))
+            continue
+        for day in stale:
+            day_low = day if low is None else max(day, low)
+            day_high = day + coarsest if high is None else min(day + coarsest, high)
+            if day_low < day_high:
+                raw.append((day_low, day_high))
+        stmt = select(
+            SketchEntity.bucket,
+            SketchEntity.count,
+            SketchEntity.mean,
+            SketchEntity.m2,
+            SketchEntity.digest,
+        ).where(
+            SketchEntity.metric_id == metric_id, SketchEntity.resolution == resolution
+        )
+        if low is not None:
+            stmt = stmt.where(SketchEntity.bucket >= low)
+        if high is not None:
+            stmt = stmt.where(SketchEntity.bucket < high)
+        for bucket, *stored in db.exec(stmt):
+            if bucket - bucket % coarsest not in stale:
+                summary.merge(_summary(*stored))
+    for low, high in raw:
+        points = _merged_points(db, metric_id, low, high)
+        values = [float(value) for _, value, _ in points]
+        summary.merge(Summary.of(values, config.SKETCH_COMPRESSION))
+    empty = not summary.count
+    return StatsResponse(
+        count=summary.count,
+        mean=None if empty else summary.mean,
+        stddev=summary.stddev,
+        min=None if empty else summary.digest.min,
+        max=None if empty else summary.digest.max,
+        p50=summary.quantile(0.5),
+        p95=summary.quantile(0.95),
+        p99=summary.quantile(0.99),
+    )
+
+
+def parse_bucket(bucket: str) -> int:
+    try:
+        if bucket[-1:] in BUCKET_UNITS:
+            seconds = int(bucket[:-1]) * BUCKET_UNITS[bucket[-1]]
+        else:
+            seconds = int(bucket)
+    except ValueError:
+        raise exceptions.BadRequest("invalid bucket")
+    if seconds <= 0:
+        raise exceptions.BadRequest("invalid bucket")
+    return seconds
+
+
+def parse_aggregates(agg: str) -> list[str]:
+    aggregates = [name.strip() for name in agg.split(",") if name.strip()]
+    if not aggregates or any(name not in AGGREGATES for name in aggregates):
+        raise exceptions.BadRequest("invalid aggregate")
+    return list(dict.fromkeys(aggregates))
+
+
+def _rollup_resolution(
+    bucket: int, start: Optional[int], end: Optional[int]
+) -> Optional[int]:
+    for resolution in sorted(config.ROLLUP_RESOLUTIONS, reverse=True):
+        bounds = (bound for bound in (start, end) if bound is not None)
+        if bucket % resolution == 0 and all(b % resolution == 0 for b in bounds):
+            return resolution
+    return None
+
+
+def _raw_aggregates(
+    metric_ids: Sequence[UUID],
+    bucket: int,
+    aggregates: list[str],
+    start: Optional[int],
+    end: Optional[int],
+):
+    columns = _bucketed_values(bucket, "first" in aggregates, "last" in aggregates)
+    rows = _in_range(select(*columns), metric_ids, start, end).subquery()
+    return rows, {
+        "count": lambda: func.count(),
+        "sum": lambda: func.sum(rows.c.value),
+        "avg": lambda: func.avg(rows.c.value, type_=Float),
+        "min": lambda: func.min(rows.c.value),
+        "max": lambda: func.max(rows.c.value),
+        "first": lambda: func.max(case((rows.c.first_rank == 1, rows.c.value))),
+        "last": lambda: func.max(case((rows.c.last_rank == 1, rows.c.value))),
+    }
+
+
+def _rollup_aggregates(
+    metric_ids: Sequence[UUID],
+    bucket: int,
+    resolution: int,
+    aggregates: list[str],
+    start: Optional[int],
+    end: Optional[int],
+):
+    bucket_start = RollupEntity.bucket - RollupEntity.bucket % bucket
+    partition = (RollupEntity.metric_id, bucket_start)
+    columns = [
+        RollupEntity.metric_id,
+        bucket_start.label("bucket"),
+        RollupEntity.count,
+        RollupEntity.sum,
+        RollupEntity.min,
+        RollupEntity.max,
+        RollupEntity.first_value,
+        RollupEntity.last_value,
+    ]
+    if "first" in aggregates:
+        rank = func.row_number().over(
+            partition_by=partition, order_by=RollupEntity.first_timestamp
+        )
+        columns.append(rank.label("first_rank"))
+    if "last" in aggregates:
+        rank = func.row_number().over(
+            partition_by=partition, order_by=RollupEntity.last_timestamp.desc()
+        )
+        columns.append(rank.label("last_rank"))
+    stmt = (
+        select(*columns)
+        .where(_of_metrics(RollupEntity.metric_id, metric_ids))
+        .where(RollupEntity.resolution == resolution)
+    )
+    if start is not None:
+        stmt = stmt.where(RollupEntity.bucket >= start)
+    if end is not None:
+        stmt = stmt.where(RollupEntity.bucket < end)
+    rows = stmt.subquery()
+    return rows, {
+        "count": lambda: func.sum(rows.c.count),
+        "sum": lambda: func.sum(rows.c.sum),
+        "avg": lambda: sql_cast(func.sum(rows.c.sum), Float) / func.sum(rows.c.count),
+        "min": lambda: func.min(rows.c.min),
+        "max": lambda: func.max(rows.c.max),
+        "first": lambda: func.max(case((rows.c.first_rank == 1, rows.c.first_value))),
+        "last": lambda: func.max(case((rows.c.last_rank == 1, rows.c.last_value))),
+    }
+
+
+def _aggregate_points(
+    points: Iterable[tuple[int, Decimal, Optional[UUID | int]]],
+    bucket: int,
+    aggregates: list[str],
+    limit: Optional[int],
+    order: str,
+) -> list[dict]:
+    rows = []
+    for bucket_start, group in groupby(
+        points, key=lambda point: point[0] - point[0] % bucket
+    ):
+        values = [value for _, value, _ in group]
+        total = sum(values, Decimal(0))
+        computed = {
+            "count": len(values),
+            "sum": total,
+            "avg": float(total) / len(values),
+            "min": min(values),
+            "max": max(values),
+            "first": values[0],
+            "last": values[-1],
+        }
+        rows.append({"bucket": bucket_start, **{n: computed[n] for n in aggregates}})
+    if order == "desc":
+        rows.reverse()
+    return rows if limit is None else rows[:limit]
+
+
+def aggregate_metrics(
+    db: Session,
+    metric_ids: Sequence[UUID],
+    bucket: int,
+    aggregates: list[str],
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    limit: Optional[int] = None,
+    order: str = "asc",
+) -> dict[UUID, list[dict]]:
+    resolution = _rollup_resolution(bucket, start, end)
+    if resolution is None and _use_blocks():
+        return {
+            metric_id: _aggregate_points(
+                _merged_points(db, metric_id, start, end),
+                bucket,
+                aggregates,
+                limit,
+                order,
+            )
+            for metric_id in metric_ids
+        }
+    if resolution is None:
+        rows, expressions = _raw_aggregates(metric_ids, bucket, aggregates, start, end)
+    else:
+        rows, expressions = _rollup_aggregates(
+            metric_ids, bucket, resolution, aggregates, start, end
+        )
+    ordering = rows.c.bucket.desc() if order == "desc" else rows.c.bucket
+    columns = [expressions[name]().label(name) for name in aggregates]
+    if limit is not None:
+        rank = func.row_number().over(partition_by=rows.c.metric_id, order_by=ordering)
+        columns.append(rank.label("rank"))
+    stmt = select(rows.c.metric_id, rows.c.bucket, *columns).group_by(
+        rows.c.metric_id, rows.c.bucket
+    )
+    if limit is not None:
+        ranked = stmt.subquery()
+        stmt = select(
+            ranked.c.metric_id,
+            ranked.c.bucket,
+            *(ranked.c[name] for name in aggregates),
+        ).where(ranked.c.rank <= limit)
+        ordering = ranked.c.bucket.desc() if order == "desc" else ranked.c.bucket
+    grouped: dict[UUID, list[dict]] = {metric_id: [] for metric_id in metric_ids}
+    for row in db.exec(stmt.order_by(ordering)):  # type: ignore
+        bucketed = dict(row._mapping)
+        grouped[bucketed.pop("metric_id")].append(bucketed)
+    return grouped
+
+
+def aggregate_values(
+    db: Session,
+    metric: MetricEntity,
+    bucket: int,
+    aggregates: list[str],
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    limit: Optional[int] = None,
+    order: str = "asc",
+) -> list[dict]:
+    metric_id = cast(UUID, metric.id)
+    return aggregate_metrics(
+        db, [metric_id], bucket, aggregates, start, end, limit, order
+    )[metric_id]
+
+
+def query_metrics(
+    db: Session, user: UserEntity, query: MetricsQueryRequest
+) -> list[dict]:
+    metric_ids = list(dict.fromkeys(query.metric_ids))
+    metrics = _owned_metrics(db, cast(UUID, user.id), metric_ids)
+    if query.bucket is not None:
+        results = aggregate_metrics(
+            db,
+            metric_ids,
+            parse_bucket(query.bucket),
+            parse_aggregates(query.agg),
+            query.start,
+            query.end,
+            query.limit,
+            query.order,
+        )
+    else:
+        results = get_metrics_values(
+            db, metric_ids, query.start, query.end, query.limit, query.order
+        )
+    return [
+        {"id": metric.id, "name": metric.name, "values": results[metric.id]}
+        for metric in metrics
+    ]
@@ -0,0 +1,153 @@
+import math
+import struct
+from typing import Iterable, Optional
+
+from app.varint import read_varints, write_varint
+
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<BHIdd")
+
+
+class TDigest:
+    # a merging t-digest using the k1 (arcsine) scale function
+    def __init__(self, compression: int):
+        self.compression = compression
+        self.means: list[float] = []
+        self.weights: list[int] = []
+        self.min = math.inf
+        self.max = -math.inf
+
+    @property
+    def count(self) -> int:
+        return sum(self.weights)
+
+    def _k(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(min(max(2 * q - 1, -1), 1))
+
+    def _q(self, k: float) -> float:
+        return (math.sin(min(k * 2 * math.pi / self.compression, math.pi / 2)) + 1) / 2
+
+    def _compress(self, centroids: list[tuple[float, int]]):
+        if not centroids:
+            return
+        centroids.sort()
+        total = sum(weight for _, weight in centroids)
+        means, weights = [], []
+        mean, weight = centroids[0]
+        merged = 0
+        limit = total * self._q(self._k(0) + 1)
+        for next_mean, next_weight in centroids[1:]:
+            if merged + weight + next_weight <= limit:
+                weight += next_weight
+                mean += (next_mean - mean) * next_weight / weight
+                continue
+            means.append(mean)
+            weights.append(weight)
+            merged += weight
+            limit = total * self._q(self._k(merged / total) + 1)
+            mean, weight = next_mean, next_weight
+        means.append(mean)
+        weights.append(weight)
+        self.means, self.weights = means, weights
+
+    def update(self, values: Iterable[float]):
+        values = list(values)
+        if not values:
+            return
+        self.min = min(self.min, *values)
+        self.max = max(self.max, *values)
+        centroids = list(zip(self.means, self.weights))
+        self._compress(centroids + [(value, 1) for value in values])
+
+    def merge(self, other: "TDigest"):
+        if not other.weights:
+            return
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        centroids = list(zip(self.means, self.weights))
+        self._compress(centroids + list(zip(other.means, other.weights)))
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.weights:
+            return None
+        if len(self.weights) == 1:
+            return self.means[0]
+        target = q * self.count
+        first, last = self.weights[0], self.weights[-1]
+        # the tails interpolate out to the exact extremes
+        if target < first / 2:
+            return self.min + (self.means[0] - self.min) * target / (first / 2)
+        if target > self.count - last / 2:
+            tail = (target - (self.count - last / 2)) / (last / 2)
+            return self.means[-1] + (self.max - self.means[-1]) * tail
+        cumulative = first / 2
+        for index in range(len(self.weights) - 1):
+            step = (self.weights[index] + self.weights[index + 1]) / 2
+            if cumulative + step >= target:
+                low, high = self.means[index], self.means[index + 1]
+                return low + (high - low) * (target - cumulative) / step
+            cumulative += step
+        return self.means[-1]
+
+    def to_bytes(self) -> bytes:
+        if not self.weights:
+            return b""
+        count = len(self.means)
+        out = bytearray(
+            HEADER.pack(FORMAT_VERSION, self.compression, count, self.min, self.max)
+        )
+        out += struct.pack(f"<{count}f", *self.means)
+        for weight in self.weights:
+            write_varint(out, weight)
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, compression: int) -> "TDigest":
+        if not data:
+            return cls(compression)
+        version, compression, count, low, high = HEADER.unpack_from(data)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"unsupported digest format {version}")
+        digest = cls(compression)
+        digest.min, digest.max = low, high
+        digest.means = list(struct.unpack_from(f"<{count}f", data, HEADER.size))
+        digest.weights, _ = read_varints(data, HEADER.size + 4 * count, count)
+        return digest
+
+
+class Summary:
+    # count, mean and m2 follow Welford; partial summaries merge with Chan et al.
+    def __init__(self, digest: TDigest, count: int = 0, mean: float = 0.0, m2=0.0):
+        self.digest = digest
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    @classmethod
+    def of(cls, values: list[float], compression: int) -> "Summary":
+        digest = TDigest(compression)
+        if not values:
+            return cls(digest)
+        digest.update(values)
+        mean = math.fsum(values) / len(values)
+        m2 = math.fsum((value - mean) ** 2 for value in values)
+        return cls(digest, len(values), mean, m2)
+
+    def merge(self, other: "Summary"):
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        self.digest.merge(other.digest)
+
+    @property
+    def stddev(self) -> Optional[float]:
+        if not self.count:
+            return None
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def quantile(self, q: float) -> Optional[float]:
+        return self.digest.quantile(q)
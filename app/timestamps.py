@@ -0,0 +1,117 @@
+import re
+from datetime import datetime
+from typing import Callable, Optional
+
+from dateutil import parser
+
+EPOCH = re.compile(r"-?\d+(\.\d*)?")
+COMPACT_DATE = re.compile(r"(\d{4})(\d{2})(\d{2})")
+YEARFIRST = re.compile(
+    r"(\d{4})([/.])(\d{1,2})\2(\d{1,2})"
+    r"(?:[ T](\d{1,2}):(\d{2})(?::(\d{2})(?:\.\d+)?)?)?"
+)
+DAYFIRST = re.compile(
+    r"(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})"
+    r"(?:[ T](\d{1,2}):(\d{2})(?::(\d{2})(?:\.\d+)?)?)?"
+)
+
+
+def parse_epoch(value: str) -> int:
+    if not EPOCH.fullmatch(value):
+        raise ValueError(value)
+    # eight digits that form a valid date are a YYYYMMDD date, not epoch seconds
+    try:
+        parse_compact_date(value)
+    except ValueError:
+        return int(float(value))
+    raise ValueError(value)
+
+
+def parse_compact_date(value: str) -> int:
+    match = COMPACT_DATE.fullmatch(value)
+    if not match:
+        raise ValueError(value)
+    year, month, day = match.groups()
+    return int(datetime(int(year), int(month), int(day)).timestamp())
+
+
+def parse_yearfirst(value: str) -> int:
+    # like ISO dates, these read year-month-day; dateutil with dayfirst=True
+    # swapped month and day whenever a four-digit year came first
+    match = YEARFIRST.fullmatch(value)
+    if not match:
+        raise ValueError(value)
+    year, _, month, day, hour, minute, second = match.groups()
+    return int(
+        datetime(
+            int(year),
+            int(month),
+            int(day),
+            int(hour or 0),
+            int(minute or 0),
+            int(second or 0),
+        ).timestamp()
+    )
+
+
+def parse_iso(value: str) -> int:
+    if len(value) < 10 or value[4] != "-" or not value[:4].isdigit():
+        raise ValueError(value)
+    return int(datetime.fromisoformat(value).timestamp())
+
+
+def parse_dayfirst(value: str) -> int:
+    match = DAYFIRST.fullmatch(value)
+    if not match:
+        raise ValueError(value)
+    day, month, year, hour, minute, second = match.groups()
+    return int(
+        datetime(
+            int(year),
+            int(month),
+            int(day),
+            int(hour or 0),
+            int(minute or 0),
+            int(second or 0),
+        ).timestamp()
+    )
+
+
+def parse_fallback(value: str) -> int:
+    return int(parser.parse(value, dayfirst=True).timestamp())
+
+
+FAST_PARSERS = (
+    parse_epoch,
+    parse_compact_date,
+    parse_iso,
+    parse_yearfirst,
+    parse_dayfirst,
+)
+
+
+class TimestampParser:
+    def __init__(self):
+        self.parse: Optional[Callable[[str], int]] = None
+
+    def __call__(self, value: int | float | str) -> int:
+        if isinstance(value, (int, float)):
+            return int(value)
+        value = value.strip()
+        if self.parse is not None:
+            try:
+                return self.parse(value)
+            except ValueError:
+                pass
+        for parse in FAST_PARSERS:
+            try:
+                timestamp = parse(value)
+            except ValueError:
+                continue
+            self.parse = parse
+            return timestamp
+        return parse_fallback(value)
+
+
+def parse_timestamp(value: int | float | str) -> int:
+    return TimestampParser()(value)
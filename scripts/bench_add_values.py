@@ -0,0 +1,65 @@
+import argparse
+import random
+import time
+
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine, delete
+
+from app import service
+from app.model import MetricEntity, UserEntity, ValueEntity, ValueRequest
+
+
+def make_payload(size):
+    start = int(time.time()) - size
+    return [
+        ValueRequest(value=round(random.uniform(0, 999), 1), timestamp=start + i)
+        for i in range(size)
+    ]
+
+
+def orm_add_values(db, metric, payload):
+    for entry in payload:
+        db.add(ValueEntity(metric=metric, value=entry.value, timestamp=entry.timestamp))
+    db.commit()
+
+
+def bulk_add_values(db, metric, payload):
+    service.add_values(db, metric, payload)
+
+
+def run(name, fn, engine, payload, repeat):
+    timings = []
+    for _ in range(repeat):
+        with Session(engine) as db:
+            user = UserEntity(email=f"{random.random()}@example.com", password="x")
+            metric = MetricEntity(user=user, name="bench")
+            db.add(metric)
+            db.commit()
+            db.refresh(metric)
+            started = time.perf_counter()
+            fn(db, metric, payload)
+            timings.append(time.perf_counter() - started)
+            db.exec(delete(ValueEntity))  # type: ignore
+            db.commit()
+    best = min(timings)
+    print(f"{name:>5}: {best:.3f}s ({len(payload) / best:,.0f} rows/s)")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--dsn", default="sqlite:///:memory:")
+    args = parser.parse_args()
+
+    engine = create_engine(args.dsn, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    payload = make_payload(args.size)
+    orm = run("orm", orm_add_values, engine, payload, args.repeat)
+    bulk = run("bulk", bulk_add_values, engine, payload, args.repeat)
+    print(f"speedup: {orm / bulk:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
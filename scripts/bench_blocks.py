@@ -0,0 +1,130 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import text
+from sqlmodel import Session, SQLModel, create_engine
+
+from app import config, service
+from app.model import MetricEntity, UserEntity
+
+LAYOUTS = ("rows", "blocks")
+TABLES = {"rows": ("values",), "blocks": ("values", "blocks")}
+
+
+def populate(engine, metrics, points, interval):
+    rng = random.Random(0)
+    end = points * interval
+    with Session(engine) as db:
+        user = UserEntity(email="bench@example.com", password="x")
+        metric_ids = []
+        for index in range(metrics):
+            metric = MetricEntity(user=user, name=f"bench-{index}")
+            db.add(metric)
+            db.commit()
+            metric_ids.append(metric.id)
+        for metric_id in metric_ids:
+            rows = [
+                {
+                    "metric_id": metric_id,
+                    "timestamp": ts,
+                    "value": round(rng.uniform(0, 999), 1),
+                }
+                for ts in range(0, end, interval)
+            ]
+            service.insert_values(db, rows)
+            db.commit()
+    return metric_ids, end
+
+
+def storage_bytes(engine, layout):
+    with engine.connect() as conn:
+        conn.execute(text("VACUUM"))
+        names = ", ".join(f"'{table}'" for table in TABLES[layout])
+        return conn.execute(
+            text(
+                "SELECT sum(pgsize) FROM dbstat WHERE name IN "
+                f"(SELECT name FROM sqlite_master WHERE tbl_name IN ({names}))"
+            )
+        ).scalar()
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def scan(engine, metric_ids, end, repeat):
+    with Session(engine) as db:
+        metrics = [db.get(MetricEntity, metric_id) for metric_id in metric_ids]
+
+        def read_all():
+            for metric in metrics:
+                service.get_values(db, metric)
+
+        def read_window():
+            for metric in metrics:
+                service.get_values(db, metric, end // 2, end // 2 + 86400)
+
+        def aggregate():
+            for metric in metrics:
+                service.aggregate_values(db, metric, 3600, ["avg", "max"], start=1)
+
+        return {
+            "full scan": best_of(repeat, read_all),
+            "1 day window": best_of(repeat, read_window),
+            "hourly avg,max": best_of(repeat, aggregate),
+        }
+
+
+def run(layout, args, directory):
+    config.VALUES_STORAGE = layout
+    engine = create_engine(f"sqlite:///{os.path.join(directory, f'{layout}.db')}")
+    SQLModel.metadata.create_all(engine)
+    metric_ids, end = populate(engine, args.metrics, args.points, args.interval)
+    if layout == "blocks":
+        with Session(engine) as db:
+            started = time.perf_counter()
+            horizon = end + config.BLOCK_SEAL_GRACE_SECONDS
+            result = service.seal_blocks(
+                db, now=horizon + config.VALUE_BLOCK_SPAN_SECONDS
+            )
+            elapsed = time.perf_counter() - started
+        print(f"sealed {result['blocks']} blocks in {elapsed:.2f}s")
+    size = storage_bytes(engine, layout)
+    timings = scan(engine, metric_ids, end, args.repeat)
+    engine.dispose()
+    return size, timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--metrics", type=int, default=10)
+    parser.add_argument("--points", type=int, default=100_000)
+    parser.add_argument("--interval", type=int, default=60)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    total = args.metrics * args.points
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for layout in LAYOUTS:
+            results[layout] = run(layout, args, directory)
+    for layout, (size, timings) in results.items():
+        print(f"{layout:>6}: {size / 2**20:8.1f} MiB  {size / total:6.1f} bytes/point")
+        for name, elapsed in timings.items():
+            print(f"        {name:>15}: {elapsed:.3f}s")
+    rows, blocks = results["rows"], results["blocks"]
+    print(f"size: {rows[0] / blocks[0]:.1f}x smaller")
+    for name in rows[1]:
+        print(f"{name}: {rows[1][name] / blocks[1][name]:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
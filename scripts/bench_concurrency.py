@@ -0,0 +1,95 @@
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def drive(app, metric_uri, headers, slow, fast, interval):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+
+        async def timed(uri):
+            started = time.perf_counter()
+            response = await c.get(uri, headers=headers)
+            assert response.status_code == 200, response.text
+            return time.perf_counter() - started
+
+        async def fast_requests():
+            timings = []
+            for _ in range(fast):
+                timings.append(await timed("/api/metrics"))
+                await asyncio.sleep(interval)
+            return timings
+
+        slow_tasks = [asyncio.create_task(timed(metric_uri)) for _ in range(slow)]
+        fast_timings = await fast_requests()
+        slow_timings = await asyncio.gather(*slow_tasks)
+    return fast_timings, slow_timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=("blocking", "threadpool", "async"))
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--slow", type=int, default=4)
+    parser.add_argument("--fast", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.005)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    scheme = "sqlite+aiosqlite" if args.mode == "async" else "sqlite"
+    os.environ["DB_DSN"] = f"{scheme}:///{path}"
+
+    from fastapi.testclient import TestClient
+    from sqlmodel import Session
+
+    from app import api, db, service
+    from app.main import app
+
+    db.engine.echo = False
+    if db.async_engine is not None:
+        db.async_engine.echo = False
+    if args.mode == "blocking":
+
+        async def run_on_loop(session, fn, *fn_args):
+            return fn(session, *fn_args)
+
+        api.run = service.run = run_on_loop
+
+    client = TestClient(app)
+    payload = {"email": "bench@example.com", "password": "bench"}
+    tokens = client.post("/api/auth/register", json=payload).json()
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    metric = client.post("/api/metrics", json={"name": "slow"}, headers=headers)
+    metric_id = metric.json()["id"]
+    with Session(db.engine) as session:
+        rows = [
+            {"metric_id": service.UUID(metric_id), "timestamp": ts, "value": ts % 999}
+            for ts in range(args.rows)
+        ]
+        service.insert_values(session, rows)
+        session.commit()
+
+    metric_uri = f"/api/metrics/{metric_id}/values?bucket=1h&agg=avg,min,max,last"
+    fast, slow = asyncio.run(
+        drive(app, metric_uri, headers, args.slow, args.fast, args.interval)
+    )
+    print(
+        f"{args.mode:>10}: fast p50={percentile(fast, 50) * 1000:.1f}ms "
+        f"p99={percentile(fast, 99) * 1000:.1f}ms "
+        f"max={max(fast) * 1000:.1f}ms | "
+        f"slow mean={statistics.mean(slow):.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, SQLModel, func, select
+
+from app import service
+from app.db import ENGINE_PROFILES, make_engine
+from app.model import MetricEntity, UserEntity, ValueEntity
+
+
+def seed(engine, rows):
+    with Session(engine) as db:
+        user = UserEntity(email="bench@example.com", password="x")
+        metric = MetricEntity(user=user, name="bench")
+        db.add(metric)
+        db.commit()
+        metric_id = metric.id
+        service.insert_values(
+            db,
+            [
+                {"metric_id": metric_id, "timestamp": ts, "value": ts % 999}
+                for ts in range(rows)
+            ],
+        )
+        db.commit()
+    return metric_id
+
+
+def writer(engine, metric_id, batch, deadline, counters):
+    while time.monotonic() < deadline:
+        rows = [
+            {
+                "metric_id": metric_id,
+                "timestamp": random.randrange(10**9),
+                "value": random.randrange(999),
+            }
+            for _ in range(batch)
+        ]
+        try:
+            with Session(engine) as db:
+                service.insert_values(db, rows, on_conflict="ignore")
+                db.commit()
+            counters["writes"] += 1
+        except OperationalError:
+            counters["errors"] += 1
+
+
+def reader(engine, metric_id, deadline, counters):
+    while time.monotonic() < deadline:
+        start = random.randrange(10**9)
+        stmt = (
+            select(func.count(), func.avg(ValueEntity.value))
+            .where(ValueEntity.metric_id == metric_id)
+            .where(ValueEntity.timestamp >= start)
+            .where(ValueEntity.timestamp < start + 10**7)
+        )
+        try:
+            with Session(engine) as db:
+                db.exec(stmt).one()
+            counters["reads"] += 1
+        except OperationalError:
+            counters["errors"] += 1
+
+
+def run_profile(profile, args):
+    path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    engine = make_engine(f"sqlite:///{path}", profile)
+    SQLModel.metadata.create_all(engine)
+    metric_id = seed(engine, args.rows)
+    counters = {"writes": 0, "reads": 0, "errors": 0}
+    deadline = time.monotonic() + args.seconds
+    threads = [
+        threading.Thread(
+            target=writer, args=(engine, metric_id, args.batch, deadline, counters)
+        )
+        for _ in range(args.writers)
+    ] + [
+        threading.Thread(target=reader, args=(engine, metric_id, deadline, counters))
+        for _ in range(args.readers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    print(
+        f"{profile:>10}: {counters['writes'] / args.seconds:>8,.0f} writes/s "
+        f"{counters['reads'] / args.seconds:>8,.0f} reads/s "
+        f"{counters['errors']} errors"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", action="append", choices=list(ENGINE_PROFILES))
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=10)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+    for profile in args.profile or ENGINE_PROFILES:
+        run_profile(profile, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from dateutil import parser
+
+from app.timestamps import TimestampParser
+
+FORMATS = {
+    "dayfirst": "%d/%m/%Y %H:%M:%S",
+    "iso": "%Y-%m-%dT%H:%M:%S+00:00",
+    "epoch": "%s",
+}
+
+
+def make_values(fmt, size):
+    start = datetime(2020, 1, 1)
+    return [(start + timedelta(minutes=i)).strftime(fmt) for i in range(size)]
+
+
+def dateutil_parse(values):
+    return [int(parser.parse(value, dayfirst=True).timestamp()) for value in values]
+
+
+def fast_parse(values):
+    parse = TimestampParser()
+    return [parse(value) for value in values]
+
+
+def best_of(fn, values, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(values)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--size", type=int, default=50_000)
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    for name, fmt in FORMATS.items():
+        values = make_values(fmt, args.size)
+        slow = best_of(dateutil_parse, values, args.repeat) if name != "epoch" else 0
+        fast = best_of(fast_parse, values, args.repeat)
+        line = f"{name:>8}: fast {args.size / fast:>12,.0f}/s"
+        if slow:
+            line += f"  dateutil {args.size / slow:>10,.0f}/s  ({slow / fast:.1f}x)"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+LAYOUTS = ("uuid", "integer")
+
+
+def measure(args):
+    # the values key is fixed when the models are imported, so each layout
+    # runs in its own interpreter with VALUES_KEY already set
+    from sqlmodel import Session, SQLModel, create_engine
+
+    from app import service
+    from app.model import MetricEntity, UserEntity
+
+    path = os.path.join(args.directory, f"{args.layout}.db")
+    engine = create_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(engine)
+    rng = random.Random(0)
+    with Session(engine) as db:
+        user = UserEntity(email="bench@example.com", password="x")
+        metrics = [
+            MetricEntity(user=user, name=f"bench-{i}") for i in range(args.metrics)
+        ]
+        db.add_all(metrics)
+        db.commit()
+        metric_ids = [metric.id for metric in metrics]
+
+        # rows arrive interleaved across metrics, the way live ingest does
+        steps = args.rows // args.metrics
+        per_batch = max(1, args.batch // args.metrics)
+        checkpoint = steps // 10 or steps
+        inserted = 0
+        started = window = time.perf_counter()
+        window_rows = 0
+        for step in range(0, steps, per_batch):
+            rows = [
+                {
+                    "metric_id": metric_id,
+                    "timestamp": ts * args.interval,
+                    "value": round(rng.uniform(0, 999), 1),
+                }
+                for ts in range(step, min(step + per_batch, steps))
+                for metric_id in metric_ids
+            ]
+            service.insert_values(db, rows, "ignore")
+            db.commit()
+            inserted += len(rows)
+            window_rows += len(rows)
+            if (step + per_batch) % checkpoint < per_batch:
+                now = time.perf_counter()
+                rate = window_rows / (now - window)
+                print(f"{args.layout:>7}: {inserted:>12,} rows {rate:>10,.0f} rows/s")
+                window, window_rows = now, 0
+        elapsed = time.perf_counter() - started
+    engine.dispose()
+    summary = {"rows": inserted, "seconds": elapsed, "bytes": os.path.getsize(path)}
+    print(json.dumps(summary), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--metrics", type=int, default=100)
+    parser.add_argument("--batch", type=int, default=10_000)
+    parser.add_argument("--interval", type=int, default=60)
+    parser.add_argument("--layout", choices=LAYOUTS)
+    parser.add_argument("--directory")
+    args = parser.parse_args()
+    if args.layout:
+        return measure(args)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for layout in LAYOUTS:
+            command = [sys.executable, "-m", __spec__.name, *sys.argv[1:]]
+            command += ["--layout", layout]
+            command += ["--directory", directory]
+            env = {**os.environ, "VALUES_KEY": layout}
+            output = subprocess.run(
+                command, env=env, check=True, stdout=subprocess.PIPE, text=True
+            ).stdout
+            *progress, summary = output.rstrip().splitlines()
+            print("\n".join(progress), flush=True)
+            results[layout] = json.loads(summary)
+    for layout, result in results.items():
+        rate = result["rows"] / result["seconds"]
+        size = result["bytes"] / result["rows"]
+        print(
+            f"{layout:>7}: {result['seconds']:8.1f}s {rate:>10,.0f} rows/s "
+            f"{size:6.1f} bytes/row"
+        )
+    uuid, integer = results["uuid"], results["integer"]
+    print(f"integer keys: {uuid['seconds'] / integer['seconds']:.2f}x faster inserts")
+    print(f"integer keys: {uuid['bytes'] / integer['bytes']:.2f}x smaller file")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,199 @@
+import argparse
+import asyncio
 import csv
+import json
+import os
+import random
 import sys
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from itertools import islice
+
 import httpx
-import argparse
-from dateutil import parser
 
+from app.timestamps import TimestampParser
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
 
-def parse_csv(file_path):
+
+def read_batches(file_path, batch_size):
     with open(file_path, newline="") as csvfile:
-        reader = csv.reader(csvfile)
-        entries = []
-        for row in reader:
-            timestamp = int(parser.parse(row[0], dayfirst=True).timestamp())
-            entries.append(
-                {
-                    "timestamp": timestamp,
-                    "value": float(row[1]),
-                }
-            )
-        return entries
-
-
-def import_entries(entries, metric, url, email, password):
-    if "http" not in url:
-        url = f"http://{url}"
-    with httpx.Client() as client:
-        auth_payload = {"email": email, "password": password}
-        response = client.post(f"{url}/api/auth/login", json=auth_payload)
-        assert response.status_code == 200
+        parse = TimestampParser()
+        rows = (row for row in csv.reader(csvfile) if row)
+        index = 0
+        while batch := list(islice(rows, batch_size)):
+            entries = [
+                {"timestamp": parse(row[0]), "value": float(row[1])} for row in batch
+            ]
+            yield index, entries
+            index += 1
+
+
+class Checkpoint:
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.next = 0
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state.get("key") == key:
+                self.next = state["next"]
+                self.done = set(state["done"])
+            else:
+                print(f"ignoring checkpoint {path} from a different import")
+
+    def __contains__(self, index):
+        return index < self.next or index in self.done
+
+    def save(self):
+        state = {"key": self.key, "next": self.next, "done": sorted(self.done)}
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+    def mark(self, index):
+        self.done.add(index)
+        while self.next in self.done:
+            self.done.remove(self.next)
+            self.next += 1
+        self.save()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Auth:
+    def __init__(self, client, email, password):
+        self.client = client
+        self.email = email
+        self.password = password
+        self.tokens = {}
+        self.lock = asyncio.Lock()
+
+    @property
+    def headers(self):
+        return {"Authorization": f"Bearer {self.tokens['access_token']}"}
+
+    async def login(self):
+        payload = {"email": self.email, "password": self.password}
+        response = await self.client.post("/api/auth/login", json=payload)
+        response.raise_for_status()
+        self.tokens = response.json()
+
+    async def refresh(self, stale_token):
+        async with self.lock:
+            if self.tokens.get("access_token") != stale_token:
+                return
+            headers = {"Authorization": f"Bearer {self.tokens['refresh_token']}"}
+            response = await self.client.post("/api/auth/refresh", headers=headers)
+            if response.status_code == 200:
+                self.tokens = response.json()
+            else:
+                await self.login()
+
+
+async def find_metric(client, auth, metric):
+    response = await client.get("/api/metrics", headers=auth.headers)
+    response.raise_for_status()
+    metrics = [m["id"] for m in response.json() if m["name"] == metric]
+    return metrics[0] if metrics else None
+
+
+def retry_after(value, default):
+    # Retry-After is either delay-seconds or an HTTP-date
+    if value is None:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+async def post_batch(client, auth, uri, entries, retries, backoff):
+    for attempt in range(retries + 1):
+        token = auth.tokens["access_token"]
+        delay = backoff * 2**attempt * random.uniform(0.5, 1.5)
+        try:
+            response = await client.post(uri, json=entries, headers=auth.headers)
+        except httpx.TransportError as e:
+            error = str(e) or type(e).__name__
+        else:
+            if response.status_code < 400:
+                return
+            error = f"HTTP {response.status_code}"
+            if response.status_code in (401, 403):
+                await auth.refresh(token)
+                continue
+            if response.status_code not in RETRY_STATUSES:
+                response.raise_for_status()
+            delay = retry_after(response.headers.get("Retry-After"), delay)
+        if attempt < retries:
+            print(f"retrying after {error} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+    raise RuntimeError(f"giving up after {retries} retries: {error}")
+
+
+async def import_csv(args, transport=None):
+    url = args.url if "http" in args.url else f"http://{args.url}"
+    key = f"{os.path.abspath(args.csv)}:{args.metric}:{args.batch_size}"
+    checkpoint = Checkpoint(args.checkpoint or f"{args.csv}.checkpoint", key)
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=url, limits=limits, timeout=args.timeout, transport=transport
+    ) as client:
+        auth = Auth(client, args.email, args.password)
+        await auth.login()
         print("Authenticated")
 
-        headers = {"Token": response.json().get("Token")}
+        metric_id = await find_metric(client, auth, args.metric)
+        if metric_id is None:
+            print(f"unable to find metric {args.metric}")
+            sys.exit(1)
+        uri = f"/api/metrics/{metric_id}/values?on_conflict={args.on_conflict}"
+
+        imported = 0
+        failures = []
+        slots = asyncio.Semaphore(args.concurrency)
+        tasks = set()
 
-        response = client.get(f"{url}/api/metrics", headers=headers)
-        metrics = response.json()
-        metrics = [m["id"] for m in metrics if m["name"] == metric]
-        if not metrics:
-            print(f"unable to find metric {metric}")
-            sys.exit()
-        metric_id = metrics[0]
+        async def send(index, entries):
+            nonlocal imported
+            try:
+                await post_batch(client, auth, uri, entries, args.retries, args.backoff)
+                checkpoint.mark(index)
+                imported += len(entries)
+            except Exception as e:
+                failures.append(e)
+            finally:
+                slots.release()
 
-        response = client.post(
-            f"{url}/api/metrics/{metric_id}/values", json=entries, headers=headers
-        )
-        assert response.status_code == 200
-        print(f"imported {len(entries)} entries")
+        for index, entries in read_batches(args.csv, args.batch_size):
+            if index in checkpoint:
+                continue
+            await slots.acquire()
+            if failures:
+                slots.release()
+                break
+            task = asyncio.create_task(send(index, entries))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        print(f"imported {imported} entries")
+        if failures:
+            print(f"import failed: {failures[0]}; re-run to resume from checkpoint")
+            sys.exit(1)
+        checkpoint.remove()
 
 
 def main():
@@ -53,9 +203,17 @@ def main():
     parser.add_argument("--email", required=True)
     parser.add_argument("--metric", required=True)
     parser.add_argument("--password", required=True)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--backoff", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--checkpoint")
+    parser.add_argument(
+        "--on-conflict", choices=("reject", "ignore", "overwrite"), default="ignore"
+    )
     args = parser.parse_args()
-    entries = parse_csv(args.csv)
-    import_entries(entries, args.metric, args.url, args.email, args.password)
+    asyncio.run(import_csv(args))
 
 
 if __name__ == "__main__":
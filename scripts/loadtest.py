@@ -0,0 +1,297 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import count
+
+import httpx
+
+SCENARIOS = ("login", "create_metric", "add_values", "get_metrics", "get_values")
+TARGETS = ("inprocess", "uvicorn")
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(timings, errors, elapsed):
+    completed = len(timings)
+    return {
+        "requests": completed + errors,
+        "errors": errors,
+        "throughput": round(completed / elapsed, 2),
+        "p50_ms": round(percentile(timings, 50) * 1000, 3) if timings else None,
+        "p99_ms": round(percentile(timings, 99) * 1000, 3) if timings else None,
+    }
+
+
+async def measure(requests, concurrency, call):
+    timings = []
+    errors = 0
+    counter = count()
+
+    async def worker():
+        nonlocal errors
+        while next(counter) < requests:
+            started = time.perf_counter()
+            try:
+                response = await call()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                timings.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(timings, errors, time.perf_counter() - started)
+
+
+class Session:
+    def __init__(self, email, tokens, metric_ids):
+        self.email = email
+        self.headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+        self.metric_ids = metric_ids
+
+
+async def login(client, email, password):
+    payload = {"email": email, "password": password}
+    response = await client.post("/api/auth/login", json=payload)
+    response.raise_for_status()
+    return response.json()
+
+
+async def open_sessions(client, args):
+    from scripts.seed_data import PASSWORD, email
+
+    rng = random.Random(args.seed)
+    sessions = []
+    for index in rng.sample(range(args.users), min(args.sessions, args.users)):
+        tokens = await login(client, email(index), PASSWORD)
+        session = Session(email(index), tokens, [])
+        response = await client.get("/api/metrics", headers=session.headers)
+        response.raise_for_status()
+        session.metric_ids = [metric["id"] for metric in response.json()]
+        sessions.append(session)
+    return sessions
+
+
+def scenarios(client, sessions, args):
+    from scripts.seed_data import PASSWORD
+
+    rng = random.Random(args.seed)
+    names = count()
+    # seeded values end at the current time, so new ones go after them
+    timestamps = count(int(time.time()) + 1)
+
+    def pick():
+        session = rng.choice(sessions)
+        return session, rng.choice(session.metric_ids)
+
+    def login_call():
+        payload = {"email": rng.choice(sessions).email, "password": PASSWORD}
+        return client.post("/api/auth/login", json=payload)
+
+    def create_metric_call():
+        session = rng.choice(sessions)
+        payload = {"name": f"loadtest-{next(names)}"}
+        return client.post("/api/metrics", json=payload, headers=session.headers)
+
+    def add_values_call():
+        session, metric_id = pick()
+        payload = [
+            {"timestamp": next(timestamps), "value": rng.randrange(999)}
+            for _ in range(args.batch)
+        ]
+        # ignore keeps a rerun against the same database from failing on 409s
+        uri = f"/api/metrics/{metric_id}/values?on_conflict=ignore"
+        return client.post(uri, json=payload, headers=session.headers)
+
+    def get_metrics_call():
+        session = rng.choice(sessions)
+        return client.get("/api/metrics", headers=session.headers)
+
+    def get_values_call():
+        session, metric_id = pick()
+        uri = f"/api/metrics/{metric_id}/values?limit={args.limit}"
+        return client.get(uri, headers=session.headers)
+
+    return {
+        "login": login_call,
+        "create_metric": create_metric_call,
+        "add_values": add_values_call,
+        "get_metrics": get_metrics_call,
+        "get_values": get_values_call,
+    }
+
+
+async def run_target(client, args):
+    sessions = await open_sessions(client, args)
+    calls = scenarios(client, sessions, args)
+    results = {}
+    for name in args.scenario or SCENARIOS:
+        requests = args.logins if name == "login" else args.requests
+        results[name] = await measure(requests, args.concurrency, calls[name])
+        print(f"  {name:>14}: {format_result(results[name])}")
+    return results
+
+
+async def run_inprocess(args):
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://loadtest", timeout=args.timeout
+    ) as client:
+        return await run_target(client, args)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(client, server, deadline):
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with code {server.returncode}")
+        try:
+            await client.get("/api/metrics")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("uvicorn did not start in time")
+
+
+async def run_uvicorn(args):
+    port = free_port()
+    command = [sys.executable, "-m", "uvicorn", "app.main:app"]
+    command += ["--port", str(port), "--workers", str(args.workers)]
+    command += ["--log-level", "warning", "--no-access-log"]
+    server = subprocess.Popen(command, env=os.environ.copy())
+    limits = httpx.Limits(max_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=args.timeout
+        ) as client:
+            await wait_ready(client, server, time.monotonic() + args.startup_timeout)
+            return await run_target(client, args)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def format_result(result):
+    return (
+        f"{result['throughput']:>9,.1f} req/s  p50={result['p50_ms']}ms  "
+        f"p99={result['p99_ms']}ms  errors={result['errors']}"
+    )
+
+
+def compare(results, baseline, tolerance, strict=False):
+    regressions = []
+    for target, scenarios_ in results.items():
+        for name, result in scenarios_.items():
+            if result["errors"]:
+                regressions.append(f"{target}.{name}: {result['errors']} errors")
+            base = baseline.get(target, {}).get(name)
+            if base is None and strict:
+                regressions.append(f"{target}.{name}: not in the baseline")
+            if base is None or result["p99_ms"] is None:
+                continue
+            if result["throughput"] < base["throughput"] * (1 - tolerance):
+                regressions.append(
+                    f"{target}.{name}: throughput {result['throughput']} req/s "
+                    f"< baseline {base['throughput']} req/s"
+                )
+            if result["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"{target}.{name}: p99 {result['p99_ms']}ms "
+                    f"> baseline {base['p99_ms']}ms"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dsn", help="use an already seeded database")
+    parser.add_argument("--target", action="append", choices=TARGETS)
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--metrics", type=int, default=1_000)
+    parser.add_argument("--values", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--startup-timeout", type=float, default=30)
+    parser.add_argument("--output", default="loadtest.json")
+    parser.add_argument("--baseline", default="loadtest-baseline.json")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    # in CI a missing baseline fails the run instead of passing unchecked
+    parser.add_argument("--ci", action="store_true", default=bool(os.getenv("CI")))
+    args = parser.parse_args()
+
+    dsn = args.dsn
+    if dsn is None:
+        dsn = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'loadtest.sqlite3')}"
+    os.environ["DB_DSN"] = dsn
+    os.environ.setdefault("DB_PROFILE", "concurrent")
+
+    from app.db import make_engine, sync_dsn
+    from scripts.seed_data import seed
+
+    if args.dsn is None:
+        engine = make_engine(sync_dsn(dsn))
+        seed(engine, args.users, args.metrics, args.values, seed=args.seed)
+        engine.dispose()
+
+    runners = {"inprocess": run_inprocess, "uvicorn": run_uvicorn}
+    results = {}
+    for target in args.target or TARGETS:
+        print(f"{target}:")
+        results[target] = asyncio.run(runners[target](args))
+
+    report = {"config": vars(args), "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"saved baseline {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; run with --save-baseline")
+        if args.ci:
+            sys.exit(1)
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.tolerance, strict=args.ci)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"no regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
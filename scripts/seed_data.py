@@ -0,0 +1,113 @@
+import argparse
+import os
+import random
+import time
+from itertools import islice
+from uuid import UUID
+
+from sqlalchemy import insert
+from sqlmodel import Session, SQLModel
+
+from app import service
+from app.db import make_engine, sync_dsn
+from app.model import MetricEntity, UserEntity
+
+PASSWORD = "loadtest"
+VALUES_INTERVAL = 60
+
+
+def email(index):
+    return f"user{index}@example.com"
+
+
+def metric_name(index):
+    return f"metric-{index}"
+
+
+def make_uuid(rng):
+    return UUID(int=rng.getrandbits(128), version=4)
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def user_rows(rng, users, password_hash):
+    for index in range(users):
+        yield {
+            "id": make_uuid(rng),
+            "token": make_uuid(rng),
+            "email": email(index),
+            "password": password_hash,
+        }
+
+
+def metric_rows(rng, user_ids, metrics):
+    for index in range(metrics):
+        yield {
+            "id": make_uuid(rng),
+            "user_id": user_ids[index % len(user_ids)],
+            "name": metric_name(index),
+        }
+
+
+def value_rows(rng, metric_ids, values, end):
+    per_metric, remainder = divmod(values, len(metric_ids))
+    for index, metric_id in enumerate(metric_ids):
+        count = per_metric + (index < remainder)
+        start = end - count * VALUES_INTERVAL
+        for i in range(count):
+            yield {
+                "metric_id": metric_id,
+                "timestamp": start + i * VALUES_INTERVAL,
+                "value": round(rng.uniform(0, 999), 1),
+            }
+
+
+def seed(engine, users, metrics, values, batch_size=50_000, seed=0, end=None):
+    rng = random.Random(seed)
+    end = end if end is not None else int(time.time())
+    password_hash = service.hash_password(PASSWORD)
+    SQLModel.metadata.create_all(engine)
+    started = time.perf_counter()
+    with Session(engine) as db:
+        user_ids = []
+        for batch in batches(user_rows(rng, users, password_hash), batch_size):
+            db.exec(insert(UserEntity), params=batch)  # type: ignore
+            user_ids.extend(row["id"] for row in batch)
+        metric_ids = []
+        for batch in batches(metric_rows(rng, user_ids, metrics), batch_size):
+            db.exec(insert(MetricEntity), params=batch)  # type: ignore
+            metric_ids.extend(row["id"] for row in batch)
+        db.commit()
+        inserted = 0
+        for batch in batches(value_rows(rng, metric_ids, values, end), batch_size):
+            inserted += service.insert_values(db, batch)
+            db.commit()
+            elapsed = time.perf_counter() - started
+            print(f"{inserted:>12,} values ({inserted / elapsed:,.0f}/s)", end="\r")
+    elapsed = time.perf_counter() - started
+    print(
+        f"seeded {users:,} users, {metrics:,} metrics and {values:,} values "
+        f"in {elapsed:.1f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dsn", default=os.getenv("DB_DSN", "sqlite:///db.sqlite3"))
+    parser.add_argument("--profile", default="concurrent")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--metrics", type=int, default=100_000)
+    parser.add_argument("--values", type=int, default=100_000_000)
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    engine = make_engine(sync_dsn(args.dsn), args.profile)
+    seed(engine, args.users, args.metrics, args.values, args.batch_size, args.seed)
+
+
+if __name__ == "__main__":
+    main()
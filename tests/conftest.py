@@ -1,9 +1,12 @@
 from uuid import UUID
 
 import pytest
+from app import config
 from app.db import get_session
+from app.instrumentation import instrument_engine
 from app.main import app
 from app.model import UserEntity
+from app import service
 from app.service import hash_password
 from fastapi.testclient import TestClient
 from sqlalchemy.pool import StaticPool
@@ -23,6 +26,7 @@ def session():
         poolclass=StaticPool,
     )
     SQLModel.metadata.create_all(_engine)
+    instrument_engine(_engine)
     with Session(_engine) as session:
         app.dependency_overrides[get_session] = lambda: session
         session.exec(text("PRAGMA foreign_keys = ON"))  # type: ignore
@@ -46,3 +50,20 @@ def user(session):
 @pytest.fixture(scope="session")
 def client():
     return TestClient(app)
+
+
+@pytest.fixture
+def internal_headers(monkeypatch):
+    monkeypatch.setattr(config, "INTERNAL_TOKEN", "internal-token")
+    return {"Authorization": "Bearer internal-token"}
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    for cache in (
+        service.token_cache,
+        service.user_cache,
+        service.metric_cache,
+        service.response_cache,
+    ):
+        cache.clear()
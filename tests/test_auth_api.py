@@ -4,7 +4,8 @@ from fastapi.testclient import TestClient
 from sqlmodel import Session, select
 
 
-from app import config
+from app import config, service
+from app.workers import WorkerPool
 from .conftest import TEST_USER_PASSWORD, TEST_USER_EMAIL
 from app.model import UserEntity
 
@@ -75,3 +76,25 @@ def test_refresh_with_access_token(client):
         headers={"Authorization": f"Bearer {tokens['access_token']}"},
     )
     assert response.status_code == 403
+
+
+def test_login_when_password_pool_is_saturated(client: TestClient, monkeypatch):
+    pool = WorkerPool("password", "thread", workers=1, queue_size=0)
+    pool.pending = pool.capacity
+    monkeypatch.setattr(service, "password_pool", pool)
+    payload = {"email": TEST_USER_EMAIL, "password": TEST_USER_PASSWORD}
+    response = client.post(f"{config.API_PREFIX}{config.LOGIN_URI}", json=payload)
+    assert response.status_code == 503
+    assert pool.stats()["rejected"] == 1
+
+
+def test_password_pool_stats(client: TestClient, internal_headers):
+    login_user(client)
+    response = client.get(
+        f"{config.INTERNAL_PREFIX}{config.STATS_URI}", headers=internal_headers
+    )
+    assert response.status_code == 200
+    stats = response.json()["password_pool"]
+    assert stats["submitted"] >= 1
+    assert stats["completed"] == stats["submitted"]
+    assert stats["queued"] == 0
@@ -0,0 +1,37 @@
+from decimal import Decimal
+
+import pytest
+
+from app import blocks
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        ["1.5", "-999.9", "0.0"],
+        ["3276.7", "-3276.8"],
+        ["123456.7", "-0.1"],
+        ["98765432101.2"],
+    ],
+)
+def test_roundtrip(values):
+    points = [(1700000000 + i * 61, Decimal(v)) for i, v in enumerate(values)]
+    assert blocks.decode(blocks.encode(list(reversed(points)))) == points
+
+
+def test_regular_series_is_compact():
+    points = [(1700000000 + i * 60, Decimal(i % 999)) for i in range(1440)]
+    data = blocks.encode(points)
+    assert len(data) <= blocks.HEADER.size + 1440 * 3
+    assert blocks.decode(data) == points
+
+
+def test_empty_block():
+    assert blocks.decode(blocks.encode([])) == []
+
+
+def test_unknown_format_version():
+    data = bytearray(blocks.encode([(1, Decimal(1))]))
+    data[0] = 99
+    with pytest.raises(ValueError):
+        blocks.decode(bytes(data))
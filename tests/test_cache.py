@@ -0,0 +1,36 @@
+import time
+
+from app.cache import SizedLRUCache, TTLCache
+
+
+def test_ttl_cache_expires_and_evicts(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = TTLCache(max_entries=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=1)
+    assert cache.get("a") == 1
+    now[0] += 2
+    assert cache.get("b") is None
+    cache.set("c", 3)
+    cache.set("d", 4)
+    assert cache.get("a") is None
+    assert cache.stats() == {"entries": 2, "hits": 1, "misses": 2}
+
+
+def test_sized_lru_cache_evicts_by_size():
+    cache = SizedLRUCache(max_bytes=10, max_entry_bytes=6)
+    cache.set("a", b"aaaa", 4)
+    cache.set("b", b"bbbb", 4)
+    cache.set("big", b"x" * 7, 7)
+    assert cache.get("a") == b"aaaa"
+    cache.set("c", b"cccc", 4)
+    assert cache.get("b") is None
+    assert cache.get("big") is None
+    assert cache.stats() == {
+        "entries": 2,
+        "bytes": 8,
+        "hits": 1,
+        "misses": 2,
+        "evictions": 1,
+    }
@@ -1,8 +1,168 @@
-from app.db import engine, get_session
-from sqlmodel import Session
+import asyncio
+import os
+import subprocess
+import sys
+from uuid import UUID
+
+import pytest
+from app import config
+from app.db import (
+    engine,
+    get_session,
+    is_async_dsn,
+    make_engine,
+    run,
+    sync_bind,
+    sync_dsn,
+    values_key,
+)
+from app.model import MetricEntity, UserEntity, ValueEntity
+from sqlalchemy import inspect
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import Session, SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 
 def test_get_session_returns_sesssion():
     actual = next(get_session())
     assert isinstance(actual, Session)
     assert actual.get_bind() == engine
+
+
+def test_sync_dsn_maps_async_drivers():
+    assert sync_dsn("sqlite+aiosqlite:///db.sqlite3") == "sqlite+pysqlite:///db.sqlite3"
+    assert (
+        sync_dsn("postgresql+asyncpg://u:p@host/db")
+        == "postgresql+psycopg2://u:p@host/db"
+    )
+    assert sync_dsn("sqlite:///db.sqlite3") == "sqlite:///db.sqlite3"
+    assert is_async_dsn("sqlite+aiosqlite://")
+    assert not is_async_dsn("sqlite://")
+
+
+def test_run_with_sync_session(session):
+    actual = asyncio.run(run(session, lambda db: db.exec(select(1)).one()))
+    assert actual == 1
+
+
+def test_run_with_async_session():
+    async def scenario():
+        async_engine = create_async_engine("sqlite+aiosqlite://")
+        async with AsyncSession(async_engine) as db:
+            actual = await run(db, lambda db: db.exec(select(1)).one())
+            bind = sync_bind(db)
+        await async_engine.dispose()
+        return actual, bind
+
+    actual, bind = asyncio.run(scenario())
+    assert actual == 1
+    assert bind == engine
+
+
+def test_make_engine_applies_sqlite_profile(tmp_path):
+    profile_engine = make_engine(f"sqlite:///{tmp_path}/db.sqlite3", "concurrent")
+    with profile_engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+    profile_engine.dispose()
+
+
+def test_make_engine_read_only(tmp_path):
+    dsn = f"sqlite:///{tmp_path}/db.sqlite3"
+    writer = make_engine(dsn, "concurrent")
+    SQLModel.metadata.create_all(writer)
+    reader = make_engine(dsn, "concurrent", read_only=True)
+    with reader.connect() as conn:
+        assert conn.exec_driver_sql("SELECT count(*) FROM users").scalar() == 0
+        with pytest.raises(OperationalError):
+            conn.exec_driver_sql("DELETE FROM users")
+    writer.dispose()
+    reader.dispose()
+
+
+@pytest.mark.skipif(config.VALUES_KEY != "uuid", reason="needs a uuid-keyed table")
+def test_migrate_value_keys(tmp_path):
+    dsn = f"sqlite:///{tmp_path}/db.sqlite3"
+    uuid_engine = make_engine(dsn)
+    SQLModel.metadata.create_all(uuid_engine)
+    with Session(uuid_engine) as db:
+        metric = MetricEntity(user=UserEntity(email="a@b.c", password="x"), name="m")
+        db.add(metric)
+        db.commit()
+        for ts in (30, 10, 20):
+            db.add(ValueEntity(metric_id=metric.id, timestamp=ts, value=ts))
+        db.commit()
+    assert values_key(uuid_engine) == "uuid"
+
+    env = {**os.environ, "DB_DSN": dsn, "VALUES_KEY": "integer"}
+    command = [sys.executable, "-m", "app.manage", "migrate-value-keys"]
+    result = subprocess.run(command, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert "VALUES_KEY=integer" in result.stderr
+    assert "migrated 3 values" in result.stdout
+    result = subprocess.run(command, env=env, capture_output=True, text=True)
+    assert "already use integer keys" in result.stdout
+
+    assert values_key(uuid_engine) == "integer"
+    with uuid_engine.connect() as conn:
+        rows = conn.exec_driver_sql(
+            'SELECT id, timestamp FROM "values" ORDER BY id'
+        ).all()
+    assert [tuple(row) for row in rows] == [(1, 10), (2, 20), (3, 30)]
+    uuid_engine.dispose()
+
+
+@pytest.mark.skipif(config.VALUES_KEY != "uuid", reason="needs a uuid-keyed table")
+def test_dedup_values_keeps_latest_write(tmp_path):
+    dsn = f"sqlite:///{tmp_path}/db.sqlite3"
+    legacy_engine = make_engine(dsn)
+    SQLModel.metadata.create_all(legacy_engine)
+    with legacy_engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ux_values_metric_id_timestamp")
+        conn.exec_driver_sql(
+            'CREATE INDEX ix_values_metric_id_timestamp ON "values" '
+            "(metric_id, timestamp)"
+        )
+    with Session(legacy_engine) as db:
+        metric = MetricEntity(user=UserEntity(email="a@b.c", password="x"), name="m")
+        db.add(metric)
+        db.commit()
+        # the later write gets the larger key, so lowest-key-wins would fail
+        for key, value in ((UUID(int=2), 1), (UUID(int=1), 2), (UUID(int=3), 3)):
+            db.add(ValueEntity(id=key, metric_id=metric.id, timestamp=10, value=value))
+            db.commit()
+        db.add(ValueEntity(metric_id=metric.id, timestamp=20, value=4))
+        db.commit()
+
+    env = {**os.environ, "DB_DSN": dsn}
+    command = [sys.executable, "-m", "app.manage", "dedup-values"]
+    result = subprocess.run(command, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert "removed 2 duplicate values from 1 metrics" in result.stdout
+
+    with Session(legacy_engine) as db:
+        values = db.exec(select(ValueEntity.timestamp, ValueEntity.value)).all()
+    assert sorted((ts, float(value)) for ts, value in values) == [(10, 3), (20, 4)]
+    indexes = {index["name"] for index in inspect(legacy_engine).get_indexes("values")}
+    assert indexes == {"ux_values_metric_id_timestamp"}
+    legacy_engine.dispose()
+
+
+def test_startup_drops_legacy_values_index(tmp_path):
+    dsn = f"sqlite:///{tmp_path}/db.sqlite3"
+    legacy_engine = make_engine(dsn)
+    SQLModel.metadata.create_all(legacy_engine)
+    with legacy_engine.begin() as conn:
+        conn.exec_driver_sql(
+            'CREATE INDEX ix_values_metric_id_timestamp ON "values" '
+            "(metric_id, timestamp)"
+        )
+    env = {**os.environ, "DB_DSN": dsn}
+    command = [sys.executable, "-c", "import app.db"]
+    result = subprocess.run(command, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    indexes = {index["name"] for index in inspect(legacy_engine).get_indexes("values")}
+    assert indexes == {"ux_values_metric_id_timestamp"}
+    legacy_engine.dispose()
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+from uuid import uuid4
+
+from app.hub import Hub, LocalBroker
+
+
+def test_publish_fans_out_to_matching_subscribers():
+    one, two = uuid4(), uuid4()
+
+    async def scenario():
+        hub = Hub("test", 10)
+        first = hub.subscribe([one])
+        both = hub.subscribe([one, two])
+        hub.publish(
+            [
+                {"metric_id": one, "timestamp": 2, "value": 2},
+                {"metric_id": two, "timestamp": 1, "value": 1},
+                {"metric_id": one, "timestamp": 1, "value": 1},
+            ]
+        )
+        await asyncio.sleep(0)
+        received = (first.queue.qsize(), both.queue.qsize())
+        event = await first.get()
+        hub.unsubscribe(first)
+        hub.unsubscribe(both)
+        return hub, received, event
+
+    hub, received, event = asyncio.run(scenario())
+    assert received == (1, 2)
+    assert event == (one, [(1, "1"), (2, "2")])
+    assert hub.stats() == {
+        "subscribers": 0,
+        "published": 3,
+        "delivered": 3,
+        "dropped": 0,
+    }
+    assert not hub.active
+
+
+def test_slow_subscriber_drops_instead_of_blocking():
+    metric_id = uuid4()
+
+    async def scenario():
+        hub = Hub("test", 2)
+        subscription = hub.subscribe([metric_id])
+        for ts in range(5):
+            hub.publish([{"metric_id": metric_id, "timestamp": ts, "value": ts}])
+        await asyncio.sleep(0)
+        return hub, subscription
+
+    hub, subscription = asyncio.run(scenario())
+    assert subscription.queue.qsize() == 2
+    assert subscription.take_dropped() == 3
+    assert subscription.take_dropped() == 0
+    assert hub.stats()["dropped"] == 3
+
+
+def test_local_broker_forwards_to_other_workers(tmp_path):
+    metric_id = uuid4()
+    received = []
+    delivered = threading.Event()
+
+    def deliver(events):
+        received.append(events)
+        delivered.set()
+
+    sender = LocalBroker(str(tmp_path), lambda events: None)
+    receiver = LocalBroker(str(tmp_path), deliver)
+    stale = tmp_path / "0-stale.sock"
+    stale.touch()
+    sender.start()
+    receiver.start()
+    try:
+        sender.send({metric_id: [(1, "1.5"), (2, "2.5")]})
+        assert delivered.wait(5)
+    finally:
+        sender.close()
+        receiver.close()
+    assert received == [{metric_id: [(1, "1.5"), (2, "2.5")]}]
+    assert sender.stats()["sent"] == 1
+    assert not stale.exists()
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,139 @@
+import argparse
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+import pytest
+from scripts.import_csv import import_csv, retry_after
+
+
+class FakeServer:
+    def __init__(self, responses=(), expire_after=None):
+        self.responses = list(responses)
+        self.expire_after = expire_after
+        self.posted = []
+        self.tokens = []
+        self.access_token = "access-1"
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/api/auth/login":
+            return httpx.Response(
+                200,
+                json={"access_token": self.access_token, "refresh_token": "refresh"},
+            )
+        if request.url.path == "/api/auth/refresh":
+            assert request.headers["Authorization"] == "Bearer refresh"
+            self.access_token = "access-2"
+            return httpx.Response(
+                200,
+                json={"access_token": self.access_token, "refresh_token": "refresh"},
+            )
+        if request.url.path == "/api/metrics":
+            return httpx.Response(200, json=[{"id": "m-1", "name": "metric"}])
+        assert request.url.path == "/api/metrics/m-1/values"
+        self.tokens.append(request.headers["Authorization"])
+        if request.headers["Authorization"] != f"Bearer {self.access_token}":
+            return httpx.Response(401)
+        if self.responses:
+            return self.responses.pop(0)
+        self.posted.append(json.loads(request.content))
+        if len(self.posted) == self.expire_after:
+            self.access_token = None
+        return httpx.Response(200, json={"inserted": len(self.posted[-1])})
+
+
+def make_args(tmp_path, rows=6):
+    path = tmp_path / "values.csv"
+    path.write_text("".join(f"{ts},{ts}.5\n" for ts in range(1, rows + 1)))
+    return argparse.Namespace(
+        csv=str(path),
+        url="http://import.test",
+        email="user@example.com",
+        password="secret",
+        metric="metric",
+        batch_size=2,
+        concurrency=1,
+        retries=2,
+        backoff=0,
+        timeout=5,
+        checkpoint=None,
+        on_conflict="ignore",
+    )
+
+
+def run_import(args, server):
+    asyncio.run(import_csv(args, transport=httpx.MockTransport(server.handle)))
+
+
+def test_import_resumes_from_checkpoint(tmp_path):
+    args = make_args(tmp_path)
+    server = FakeServer([httpx.Response(200), httpx.Response(400)])
+    with pytest.raises(SystemExit, match="1"):
+        run_import(args, server)
+    checkpoint = json.loads((tmp_path / "values.csv.checkpoint").read_text())
+    assert (checkpoint["next"], checkpoint["done"]) == (1, [])
+
+    run_import(args, server)
+    assert [[entry["timestamp"] for entry in batch] for batch in server.posted] == [
+        [3, 4],
+        [5, 6],
+    ]
+    assert server.posted[0][0]["value"] == 3.5
+    assert not (tmp_path / "values.csv.checkpoint").exists()
+
+
+def test_import_retries_throttled_and_failed_batches(tmp_path):
+    args = make_args(tmp_path, rows=2)
+    server = FakeServer(
+        [httpx.Response(503), httpx.Response(429, headers={"Retry-After": "0"})]
+    )
+    run_import(args, server)
+    assert len(server.tokens) == 3
+    assert server.posted == [
+        [{"timestamp": 1, "value": 1.5}, {"timestamp": 2, "value": 2.5}]
+    ]
+
+
+def test_retry_after_accepts_http_dates():
+    assert retry_after(None, 1.5) == 1.5
+    assert retry_after("2", 1.5) == 2
+    past = datetime.now(timezone.utc) - timedelta(minutes=1)
+    assert retry_after(format_datetime(past, usegmt=True), 1.5) == 0
+    future = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 < retry_after(format_datetime(future, usegmt=True), 1.5) <= 30
+    assert retry_after("soon", 1.5) == 1.5
+
+
+def test_import_retries_with_an_http_date_retry_after(tmp_path):
+    args = make_args(tmp_path, rows=2)
+    when = format_datetime(datetime(2000, 1, 1, tzinfo=timezone.utc), usegmt=True)
+    server = FakeServer([httpx.Response(503, headers={"Retry-After": when})])
+    run_import(args, server)
+    assert len(server.tokens) == 2
+    assert len(server.posted) == 1
+
+
+def test_import_gives_up_after_retries(tmp_path):
+    args = make_args(tmp_path, rows=2)
+    server = FakeServer([httpx.Response(502)] * 3)
+    with pytest.raises(SystemExit, match="1"):
+        run_import(args, server)
+    assert len(server.tokens) == 3
+    assert server.posted == []
+
+
+def test_import_refreshes_an_expired_token(tmp_path):
+    args = make_args(tmp_path, rows=4)
+    server = FakeServer(expire_after=1)
+    run_import(args, server)
+    assert server.tokens == [
+        "Bearer access-1",
+        "Bearer access-1",
+        "Bearer access-2",
+    ]
+    assert [[entry["timestamp"] for entry in batch] for batch in server.posted] == [
+        [1, 2],
+        [3, 4],
+    ]
@@ -0,0 +1,60 @@
+import pytest
+from app import config, instrumentation
+from tests.test_metrics_api import get_access_auth_headers
+
+
+def test_prometheus_metrics(client, internal_headers):
+    headers = get_access_auth_headers(client)
+    client.get(f"{config.API_PREFIX}{config.METRICS_URI}", headers=headers)
+    response = client.get(
+        f"{config.INTERNAL_PREFIX}{config.PROMETHEUS_URI}", headers=internal_headers
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    route = f"{config.API_PREFIX}{config.METRICS_URI}"
+    labels = f'{{method="GET",route="{route}",status="200"}}'
+    assert any(
+        line.startswith(f"http_request_duration_seconds_count{labels}")
+        for line in lines
+    )
+    assert any(
+        line.startswith(f'db_queries_per_request_count{{route="{route}"}}')
+        for line in lines
+    )
+    assert any(line.startswith("app_password_pool_submitted ") for line in lines)
+    assert "http_requests_in_flight 1" in lines
+
+
+def test_slow_query_log(client, monkeypatch, internal_headers):
+    monkeypatch.setattr(config, "SLOW_QUERY_MS", 0)
+    instrumentation.slow_queries.clear()
+    headers = get_access_auth_headers(client)
+    client.get(f"{config.API_PREFIX}{config.METRICS_URI}", headers=headers)
+    response = client.get(
+        f"{config.INTERNAL_PREFIX}{config.SLOW_QUERIES_URI}", headers=internal_headers
+    )
+    assert response.status_code == 200
+    routes = {entry["route"] for entry in response.json()}
+    assert f"{config.API_PREFIX}{config.METRICS_URI}" in routes
+    assert any("FROM metrics" in entry["statement"] for entry in response.json())
+
+
+@pytest.mark.parametrize(
+    "uri",
+    [
+        config.STATS_URI,
+        config.PROMETHEUS_URI,
+        config.SLOW_QUERIES_URI,
+        config.COMPACTION_URI,
+    ],
+)
+def test_internal_endpoints_require_a_token(client, monkeypatch, uri):
+    monkeypatch.setattr(config, "INTERNAL_TOKEN", None)
+    headers = {"Authorization": "Bearer anything"}
+    response = client.get(f"{config.INTERNAL_PREFIX}{uri}", headers=headers)
+    assert response.status_code == 404
+    monkeypatch.setattr(config, "INTERNAL_TOKEN", "internal-token")
+    response = client.get(f"{config.INTERNAL_PREFIX}{uri}", headers=headers)
+    assert response.status_code == 401
+    assert client.get(f"{config.INTERNAL_PREFIX}{uri}").status_code == 401
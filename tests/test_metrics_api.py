@@ -1,8 +1,24 @@
+import asyncio
+import json
+import threading
+import time
 from uuid import UUID, uuid4
+
+import pytest
 from dateutil import parser
 from jose import jwt
-from app import config
-from app.model import MetricEntity, UserEntity, ValueEntity
+from app import config, exceptions, service
+from app.buffer import IngestBuffer
+from app.main import app
+from app.model import (
+    BlockEntity,
+    MetricEntity,
+    RollupEntity,
+    SketchEntity,
+    UserEntity,
+    ValueEntity,
+    ValueRequest,
+)
 from sqlmodel import delete, select
 from tests.conftest import (
     TEST_USER_EMAIL,
@@ -84,6 +100,41 @@ def test_get_metrics(client, user, session):
     assert len(response.json()) == len(metrics)
 
 
+def test_get_metrics_overview(client, user, session):
+    one = create_metric(session, user, "one")
+    two = create_metric(session, user, "two", clear=False)
+    headers = get_access_auth_headers(client)
+    uri = f"{config.API_PREFIX}" + config.VALUES_URI.replace("{metric_id}", str(one.id))
+    payload = [{"timestamp": ts, "value": ts / 2} for ts in (30, 10, 20)]
+    client.post(uri, headers=headers, json=payload)
+    payload = [{"timestamp": 30, "value": 4}]
+    client.post(uri, headers=headers, json=payload, params={"on_conflict": "overwrite"})
+
+    response = client.get(
+        f"{config.API_PREFIX}{config.METRICS_URI}",
+        headers=headers,
+        params={"overview": True},
+    )
+    assert response.status_code == 200
+    overview = {metric["name"]: metric for metric in response.json()}
+    assert overview == {
+        "one": {
+            "id": str(one.id),
+            "name": "one",
+            "count": 3,
+            "last_timestamp": 30,
+            "last_value": "4.0",
+        },
+        "two": {
+            "id": str(two.id),
+            "name": "two",
+            "count": 0,
+            "last_timestamp": None,
+            "last_value": None,
+        },
+    }
+
+
 def test_add_values_without_timestamp(client, session, user):
     metric = create_metric(session, user, "three")
     values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
@@ -113,6 +164,7 @@ def test_add_values_with_int_timestamp(client, session, user):
         f"{config.API_PREFIX}{values_uri}", headers=headers, json=payload
     )
     assert response.status_code == 200
+    assert response.json() == {"inserted": len(payload)}
     values_in_db = session.exec(
         select(ValueEntity).join(MetricEntity).where(MetricEntity.id == metric.id)
     ).all()
@@ -149,6 +201,24 @@ def test_add_values_with_str_timestamp(client, session, user):
         assert entry["value"] == float(values_in_db[index].value)
 
 
+def test_add_values_in_chunks(client, session, user, monkeypatch):
+    monkeypatch.setattr(config, "VALUES_INSERT_CHUNK_SIZE", 2)
+    metric = create_metric(session, user, "five")
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    payload = [{"timestamp": ts, "value": ts} for ts in range(5)]
+    response = client.post(
+        f"{config.API_PREFIX}{values_uri}", headers=headers, json=payload
+    )
+    assert response.status_code == 200
+    assert response.json() == {"inserted": 5}
+    values_in_db = session.exec(
+        select(ValueEntity).where(ValueEntity.metric_id == metric.id)
+    ).all()
+    assert sorted(value.timestamp for value in values_in_db) == list(range(5))
+    assert len({value.id for value in values_in_db}) == 5
+
+
 def test_get_metric_values(client, session, user):
     metric = create_metric(
         session,
@@ -189,3 +259,1097 @@ def test_access_resource_after_user_deleted(client, session):
     )
     response = client.get(f"{config.API_PREFIX}{config.METRICS_URI}", headers=headers)
     assert response.status_code == 401
+
+
+def test_get_metric_values_in_time_range(client, session, user):
+    metric = create_metric(
+        session,
+        user,
+        "one",
+        [{"timestamp": ts, "value": ts} for ts in range(1, 11)],
+    )
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    response = client.get(
+        f"{config.API_PREFIX}{values_uri}",
+        headers=headers,
+        params={"from": 3, "to": 7},
+    )
+    assert response.status_code == 200
+    assert [row["timestamp"] for row in response.json()] == [3, 4, 5, 6]
+
+
+def test_get_metric_values_paginated(client, session, user):
+    metric = create_metric(
+        session,
+        user,
+        "one",
+        [{"timestamp": ts, "value": ts} for ts in range(10)],
+    )
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    params = {"limit": 3, "order": "desc"}
+    pages = []
+    while True:
+        response = client.get(
+            f"{config.API_PREFIX}{values_uri}", headers=headers, params=params
+        )
+        assert response.status_code == 200
+        pages.append(response.json())
+        if config.NEXT_CURSOR_HEADER not in response.headers:
+            break
+        params["cursor"] = response.headers[config.NEXT_CURSOR_HEADER]
+    assert [len(page) for page in pages] == [3, 3, 3, 1]
+    rows = [row for page in pages for row in page]
+    assert len({row["id"] for row in rows}) == 10
+    assert [row["timestamp"] for row in rows] == list(range(9, -1, -1))
+
+
+def test_get_metric_values_with_invalid_cursor(client, session, user):
+    metric = create_metric(session, user, "one")
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    response = client.get(
+        f"{config.API_PREFIX}{values_uri}",
+        headers=headers,
+        params={"limit": 3, "cursor": "garbage"},
+    )
+    assert response.status_code == 400
+
+
+def test_get_metric_values_aggregated(client, session, user):
+    metric = create_metric(session, user, "one")
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    payload = [
+        {"timestamp": 3600 + 60, "value": 3},
+        {"timestamp": 3600 + 10, "value": 1},
+        {"timestamp": 3600 + 30, "value": 5},
+        {"timestamp": 7200 + 1800, "value": 10},
+    ]
+    response = client.post(
+        f"{config.API_PREFIX}{values_uri}", headers=headers, json=payload
+    )
+    assert response.status_code == 200
+    response = client.get(
+        f"{config.API_PREFIX}{values_uri}",
+        headers=headers,
+        params={"bucket": "1h", "agg": "avg,min,max,count,first,last,sum"},
+    )
+    assert response.status_code == 200
+    assert response.json() == [
+        {
+            "bucket": 3600,
+            "avg": 3.0,
+            "min": 1,
+            "max": 5,
+            "count": 3,
+            "first": 1,
+            "last": 3,
+            "sum": 9,
+        },
+        {
+            "bucket": 7200,
+            "avg": 10.0,
+            "min": 10,
+            "max": 10,
+            "count": 1,
+            "first": 10,
+            "last": 10,
+            "sum": 10,
+        },
+    ]
+
+
+def test_get_metric_values_aggregated_in_time_range(client, session, user):
+    metric = create_metric(session, user, "one")
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    payload = [{"timestamp": ts * 60, "value": ts} for ts in range(10)]
+    client.post(f"{config.API_PREFIX}{values_uri}", headers=headers, json=payload)
+    response = client.get(
+        f"{config.API_PREFIX}{values_uri}",
+        headers=headers,
+        params={"bucket": "300", "agg": "count,last", "from": 60, "order": "desc"},
+    )
+    assert response.status_code == 200
+    assert response.json() == [
+        {"bucket": 300, "count": 5, "last": 9},
+        {"bucket": 0, "count": 4, "last": 4},
+    ]
+
+
+def test_rollups_handle_out_of_order_values(client, session, user):
+    metric = create_metric(session, user, "one")
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    batches = [
+        [{"timestamp": 3600 + 600, "value": 2}, {"timestamp": 3600 + 1200, "value": 4}],
+        [{"timestamp": 3600 + 60, "value": 7}, {"timestamp": 7200 - 1, "value": 1}],
+        [{"timestamp": 3600 + 900, "value": 9}],
+    ]
+    for payload in batches:
+        response = client.post(
+            f"{config.API_PREFIX}{values_uri}", headers=headers, json=payload
+        )
+        assert response.status_code == 200
+    rollup = session.exec(
+        select(RollupEntity)
+        .where(RollupEntity.metric_id == metric.id)
+        .where(RollupEntity.resolution == 3600)
+    ).one()
+    assert (rollup.bucket, rollup.count, rollup.sum) == (3600, 5, 23)
+    assert (rollup.min, rollup.max) == (1, 9)
+    assert (rollup.first_timestamp, rollup.first_value) == (3660, 7)
+    assert (rollup.last_timestamp, rollup.last_value) == (7199, 1)
+
+    response = client.get(
+        f"{config.API_PREFIX}{values_uri}",
+        headers=headers,
+        params={"bucket": "1d", "agg": "count,avg,first,last"},
+    )
+    assert response.json() == [
+        {"bucket": 0, "count": 5, "avg": 4.6, "first": 7, "last": 1}
+    ]
+
+
+def test_add_values_conflict_policies(client, session, user):
+    metric = create_metric(session, user, "one")
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    uri = f"{config.API_PREFIX}{values_uri}"
+    headers = get_access_auth_headers(client)
+    payload = [{"timestamp": 3600, "value": 9}, {"timestamp": 3660, "value": 1}]
+    assert client.post(uri, headers=headers, json=payload).status_code == 200
+
+    duplicate = [{"timestamp": 3660, "value": 5}, {"timestamp": 3720, "value": 3}]
+    response = client.post(uri, headers=headers, json=duplicate)
+    assert response.status_code == 409
+    assert len(session.exec(select(ValueEntity)).all()) == 2
+
+    params = {"on_conflict": "ignore"}
+    response = client.post(uri, headers=headers, json=duplicate, params=params)
+    assert response.status_code == 200
+    assert response.json() == {"inserted": 1}
+    rollup = session.exec(
+        select(RollupEntity).where(RollupEntity.resolution == 3600)
+    ).one()
+    assert (rollup.count, rollup.sum, rollup.min, rollup.max) == (3, 13, 1, 9)
+
+    overwrite = [{"timestamp": 3600, "value": 4}, {"timestamp": 3600, "value": 2}]
+    params = {"on_conflict": "overwrite"}
+    response = client.post(uri, headers=headers, json=overwrite, params=params)
+    assert response.status_code == 200
+    values = session.exec(select(ValueEntity).order_by(ValueEntity.timestamp)).all()
+    assert [(v.timestamp, v.value) for v in values] == [(3600, 2), (3660, 1), (3720, 3)]
+    session.expire_all()
+    rollup = session.exec(
+        select(RollupEntity).where(RollupEntity.resolution == 3600)
+    ).one()
+    assert (rollup.count, rollup.sum, rollup.min, rollup.max) == (3, 6, 1, 3)
+    assert (rollup.first_timestamp, rollup.first_value) == (3600, 2)
+
+
+def test_aggregation_reads_rollups_for_aligned_ranges(client, session, user):
+    metric = create_metric(
+        session,
+        user,
+        "one",
+        [{"timestamp": 3600 * h + 30, "value": h} for h in range(4)],
+    )
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+
+    def aggregate(**params):
+        response = client.get(
+            f"{config.API_PREFIX}{values_uri}",
+            headers=headers,
+            params={"agg": "count,sum,min,max,first,last", **params},
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    assert aggregate(bucket="2h", **{"from": 3600}) == []
+    assert aggregate(bucket="2h", **{"from": 1800}) == [
+        {"bucket": 0, "count": 1, "sum": 1, "min": 1, "max": 1, "first": 1, "last": 1},
+        {
+            "bucket": 7200,
+            "count": 2,
+            "sum": 5,
+            "min": 2,
+            "max": 3,
+            "first": 2,
+            "last": 3,
+        },
+    ]
+    service.rebuild_rollups(session, metric.id)
+    session.commit()
+    assert aggregate(bucket="2h", **{"from": 3600}) == aggregate(
+        bucket="2h", **{"from": 1800}
+    )
+    assert aggregate(bucket="1d") == [
+        {"bucket": 0, "count": 4, "sum": 6, "min": 0, "max": 3, "first": 0, "last": 3}
+    ]
+
+
+def test_backfill_rollups_for_existing_values(client, session, user):
+    # values inserted directly stand in for a database from before rollups
+    metric = create_metric(
+        session,
+        user,
+        "one",
+        [{"timestamp": 3600 * h + 30, "value": h} for h in range(4)],
+    )
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    stats_uri = config.METRIC_STATS_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    params = {"bucket": "1d", "agg": "count,sum"}
+    response = client.get(
+        f"{config.API_PREFIX}{values_uri}", headers=headers, params=params
+    )
+    assert response.json() == []
+
+    assert service.backfill_rollups(session) == 1
+    response = client.get(
+        f"{config.API_PREFIX}{values_uri}", headers=headers, params=params
+    )
+    assert response.json() == [{"bucket": 0, "count": 4, "sum": 6}]
+    response = client.get(f"{config.API_PREFIX}{stats_uri}", headers=headers)
+    assert response.json()["count"] == 4
+    assert service.backfill_rollups(session) == 0
+
+
+def test_get_metric_values_with_invalid_aggregation(client, session, user):
+    metric = create_metric(session, user, "one")
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    for params in ({"bucket": "1y"}, {"bucket": "0"}, {"bucket": "1h", "agg": "p99"}):
+        response = client.get(
+            f"{config.API_PREFIX}{values_uri}", headers=headers, params=params
+        )
+        assert response.status_code == 400
+
+
+def test_stream_metric_values_as_ndjson(client, session, user):
+    metric = create_metric(
+        session,
+        user,
+        "one",
+        [{"timestamp": ts, "value": ts + 0.5} for ts in range(5)],
+    )
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    headers["Accept"] = "application/x-ndjson"
+    response = client.get(
+        f"{config.API_PREFIX}{values_uri}", headers=headers, params={"from": 1}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [{k: v for k, v in row.items() if k != "id"} for row in rows] == [
+        {"metric_id": str(metric.id), "timestamp": ts, "value": f"{ts}.5"}
+        for ts in range(1, 5)
+    ]
+
+
+def test_stream_metric_values_as_csv(client, session, user):
+    metric = create_metric(
+        session,
+        user,
+        "one",
+        [{"timestamp": ts, "value": ts} for ts in range(3)],
+    )
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    headers["Accept"] = "text/csv, application/json;q=0.5"
+    response = client.get(
+        f"{config.API_PREFIX}{values_uri}",
+        headers=headers,
+        params={"order": "desc"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.text.splitlines() == [
+        "timestamp,value",
+        "2,2.0",
+        "1,1.0",
+        "0,0.0",
+    ]
+
+
+def test_ingest_values_as_ndjson(client, session, user, monkeypatch):
+    monkeypatch.setattr(config, "VALUES_INGEST_BATCH_SIZE", 2)
+    metric = create_metric(session, user, "one")
+    ingest_uri = config.VALUES_INGEST_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    headers["Content-Type"] = "application/x-ndjson"
+    body = (
+        b'{"timestamp": 1, "value": 1.5}\n'
+        b'{"timestamp": "02/11/2025 09:19:28", "value": 2}\n'
+        b"not json\n"
+        b"\n"
+        b'{"timestamp": 3, "value": "x"}\n'
+        b'{"timestamp": 4, "value": 4}'
+    )
+    response = client.post(
+        f"{config.API_PREFIX}{ingest_uri}",
+        headers=headers,
+        content=iter([body[:20], body[20:50], body[50:]]),
+    )
+    assert response.status_code == 200
+    assert response.json() == {"accepted": 3, "rejected": 2}
+    values_in_db = session.exec(
+        select(ValueEntity).where(ValueEntity.metric_id == metric.id)
+    ).all()
+    assert len(values_in_db) == 3
+
+
+def test_ingest_values_as_csv(client, session, user):
+    metric = create_metric(session, user, "one")
+    ingest_uri = config.VALUES_INGEST_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    headers["Content-Type"] = "text/csv; charset=utf-8"
+    body = b"timestamp,value\r\n1,1.5\r\n2,2.5\r\n3\r\n"
+    response = client.post(
+        f"{config.API_PREFIX}{ingest_uri}", headers=headers, content=body
+    )
+    assert response.status_code == 200
+    assert response.json() == {"accepted": 2, "rejected": 1}
+    values_in_db = session.exec(
+        select(ValueEntity).where(ValueEntity.metric_id == metric.id)
+    ).all()
+    assert sorted((v.timestamp, float(v.value)) for v in values_in_db) == [
+        (1, 1.5),
+        (2, 2.5),
+    ]
+
+
+def test_ingest_values_rejects_conflicting_lines(client, session, user, monkeypatch):
+    monkeypatch.setattr(config, "VALUES_INGEST_BATCH_SIZE", 2)
+    metric = create_metric(session, user, "one", [{"timestamp": 3, "value": 9}])
+    ingest_uri = config.VALUES_INGEST_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    headers["Content-Type"] = "text/csv"
+    body = b"1,1\n2,2\n3,3\n4,4\n4,5\n5,5\n"
+    response = client.post(
+        f"{config.API_PREFIX}{ingest_uri}", headers=headers, content=body
+    )
+    assert response.status_code == 200
+    assert response.json() == {"accepted": 4, "rejected": 2}
+    values_in_db = session.exec(
+        select(ValueEntity).where(ValueEntity.metric_id == metric.id)
+    ).all()
+    assert sorted((v.timestamp, float(v.value)) for v in values_in_db) == [
+        (1, 1),
+        (2, 2),
+        (3, 9),
+        (4, 4),
+        (5, 5),
+    ]
+
+
+def test_ingest_values_with_unsupported_content_type(client, session, user):
+    metric = create_metric(session, user, "one")
+    ingest_uri = config.VALUES_INGEST_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    response = client.post(
+        f"{config.API_PREFIX}{ingest_uri}", headers=headers, json=[{"value": 1}]
+    )
+    assert response.status_code == 400
+
+
+def test_get_metric_values_uses_principal_cache(
+    client, session, user, internal_headers
+):
+    metric = create_metric(session, user, "one")
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    before = service.metric_cache.stats()
+    for _ in range(3):
+        response = client.get(f"{config.API_PREFIX}{values_uri}", headers=headers)
+        assert response.status_code == 200
+    stats = client.get(
+        f"{config.INTERNAL_PREFIX}{config.STATS_URI}", headers=internal_headers
+    ).json()
+    assert stats["caches"]["metrics"]["entries"] == 1
+    assert stats["caches"]["metrics"]["hits"] - before["hits"] == 2
+    assert stats["caches"]["metrics"]["misses"] - before["misses"] == 1
+
+
+def test_deleted_metric_is_evicted_from_principal_cache(client, session, user):
+    metric = create_metric(session, user, "one")
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    response = client.get(f"{config.API_PREFIX}{values_uri}", headers=headers)
+    assert response.status_code == 200
+    session.delete(metric)
+    session.commit()
+    response = client.get(f"{config.API_PREFIX}{values_uri}", headers=headers)
+    assert response.status_code == 404
+
+
+def test_add_values_with_invalid_timestamp(client, session, user):
+    metric = create_metric(session, user, "one")
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    payload = [{"timestamp": "yesterday-ish", "value": 1}]
+    response = client.post(
+        f"{config.API_PREFIX}{values_uri}", headers=headers, json=payload
+    )
+    assert response.status_code == 400
+
+
+def test_get_metric_values_revalidates_with_etag(client, session, user):
+    metric = create_metric(session, user, "one")
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    uri = f"{config.API_PREFIX}{values_uri}"
+    headers = get_access_auth_headers(client)
+    client.post(uri, headers=headers, json=[{"timestamp": 1, "value": 1}])
+
+    response = client.get(uri, headers=headers)
+    etag = response.headers["ETag"]
+    assert response.status_code == 200
+    cached = service.response_cache.stats()["hits"]
+    response = client.get(uri, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    response = client.get(uri, headers=headers)
+    assert response.json()[0]["timestamp"] == 1
+    assert service.response_cache.stats()["hits"] == cached + 1
+
+    other = client.get(uri, headers=headers, params={"order": "desc"})
+    assert other.headers["ETag"] != etag
+    client.post(uri, headers=headers, json=[{"timestamp": 2, "value": 2}])
+    response = client.get(uri, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(response.json()) == 2
+
+
+def test_get_metrics_etag_changes_when_metric_is_created(client, session, user):
+    create_metric(session, user, "one")
+    uri = f"{config.API_PREFIX}{config.METRICS_URI}"
+    headers = get_access_auth_headers(client)
+    etag = client.get(uri, headers=headers).headers["ETag"]
+    response = client.get(uri, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    client.post(uri, headers=headers, json={"name": "two"})
+    response = client.get(uri, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert sorted(metric["name"] for metric in response.json()) == ["one", "two"]
+
+
+def test_query_multiple_metrics(client, session, user):
+    one = create_metric(
+        session, user, "one", [{"timestamp": ts, "value": ts} for ts in range(4)]
+    )
+    two = create_metric(
+        session,
+        user,
+        "two",
+        [{"timestamp": ts, "value": ts * 10} for ts in range(3)],
+        clear=False,
+    )
+    uri = f"{config.API_PREFIX}{config.METRICS_QUERY_URI}"
+    headers = get_access_auth_headers(client)
+    payload = {
+        "metric_ids": [str(two.id), str(one.id)],
+        "from": 1,
+        "limit": 2,
+        "order": "desc",
+    }
+    response = client.post(uri, headers=headers, json=payload)
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["name"] for result in results] == ["two", "one"]
+    assert [v["value"] for v in results[0]["values"]] == ["20.0", "10.0"]
+    assert [v["timestamp"] for v in results[1]["values"]] == [3, 2]
+
+    payload = {"metric_ids": [str(one.id), str(two.id)], "bucket": "2s", "agg": "sum"}
+    response = client.post(uri, headers=headers, json=payload)
+    assert [result["values"] for result in response.json()] == [
+        [{"bucket": 0, "sum": 1}, {"bucket": 2, "sum": 5}],
+        [{"bucket": 0, "sum": 10}, {"bucket": 2, "sum": 20}],
+    ]
+
+
+def test_query_metrics_requires_ownership_of_all_ids(client, session, user):
+    metric = create_metric(session, user, "one")
+    uri = f"{config.API_PREFIX}{config.METRICS_QUERY_URI}"
+    headers = get_access_auth_headers(client)
+    payload = {"metric_ids": [str(metric.id), str(uuid4())]}
+    response = client.post(uri, headers=headers, json=payload)
+    assert response.status_code == 404
+    response = client.post(uri, headers=headers, json={"metric_ids": []})
+    assert response.status_code == 422
+
+
+def test_add_values_for_multiple_metrics(client, session, user):
+    one = create_metric(session, user, "one")
+    create_metric(session, user, "two", clear=False)
+    uri = f"{config.API_PREFIX}{config.METRICS_VALUES_URI}"
+    headers = get_access_auth_headers(client)
+    payload = {
+        "metrics": [
+            {"id": str(one.id), "values": [{"timestamp": 1, "value": 1}]},
+            {
+                "name": "two",
+                "values": [{"timestamp": 1, "value": 2}, {"timestamp": 2, "value": 2}],
+            },
+            {"id": str(one.id), "values": [{"timestamp": 2, "value": 3}]},
+        ]
+    }
+    response = client.post(uri, headers=headers, json=payload)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["inserted"] == 4
+    assert body["rejected"] == []
+    assert {m["name"]: m["inserted"] for m in body["metrics"]} == {"one": 2, "two": 2}
+    values = session.exec(select(ValueEntity).where(ValueEntity.metric_id == one.id))
+    assert sorted(value.timestamp for value in values) == [1, 2]
+
+    params = {"on_conflict": "ignore"}
+    response = client.post(uri, headers=headers, json=payload, params=params)
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 0
+
+
+def test_add_values_for_multiple_metrics_with_unknown_metric(client, session, user):
+    metric = create_metric(session, user, "one")
+    uri = f"{config.API_PREFIX}{config.METRICS_VALUES_URI}"
+    headers = get_access_auth_headers(client)
+    entries = [
+        {"id": str(metric.id), "values": [{"timestamp": 1, "value": 1}]},
+        {"id": str(uuid4()), "values": [{"timestamp": 1, "value": 1}]},
+        {"name": "missing", "values": [{"timestamp": 1, "value": 1}]},
+    ]
+    response = client.post(uri, headers=headers, json={"metrics": entries})
+    assert response.status_code == 404
+    assert session.exec(select(ValueEntity)).all() == []
+
+    payload = {"metrics": entries, "partial": True}
+    response = client.post(uri, headers=headers, json=payload)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["inserted"] == 1
+    assert [m["id"] for m in body["metrics"]] == [str(metric.id)]
+    assert [r["detail"] for r in body["rejected"]] == ["metric not found"] * 2
+    response = client.post(uri, headers=headers, json={"metrics": [{"values": []}]})
+    assert response.status_code == 422
+
+
+def make_buffer(session, max_rows=100, flush_ms=10.0):
+    write = service.insert_values
+    return IngestBuffer("test", session.get_bind(), write, max_rows, 10, flush_ms)
+
+
+def test_add_values_through_ingest_buffer(client, session, user):
+    metric = create_metric(session, user, "one")
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    buffer = make_buffer(session)
+    app.dependency_overrides[service.get_ingest_buffer] = lambda: buffer
+    try:
+        payload = [{"timestamp": ts, "value": ts} for ts in range(15)]
+        response = client.post(
+            f"{config.API_PREFIX}{values_uri}", headers=headers, json=payload
+        )
+        assert response.status_code == 200
+        assert response.json() == {"inserted": 15}
+        response = client.post(
+            f"{config.API_PREFIX}{values_uri}",
+            headers=headers,
+            json=[{"timestamp": 20, "value": 1}],
+            params={"wait": False},
+        )
+        assert response.status_code == 202
+        buffer.close()
+    finally:
+        del app.dependency_overrides[service.get_ingest_buffer]
+    values = session.exec(select(ValueEntity).where(ValueEntity.metric_id == metric.id))
+    assert len(values.all()) == 16
+    stats = buffer.stats()
+    assert stats["depth"] == 0
+    assert stats["flushed_rows"] == 16
+    assert stats["flushes"] >= 2
+
+
+def test_ingest_buffer_applies_backpressure(client, session, user):
+    metric = create_metric(session, user, "one")
+    values_uri = f"{config.API_PREFIX}" + config.VALUES_URI.replace(
+        "{metric_id}", str(metric.id)
+    )
+    headers = get_access_auth_headers(client)
+    buffer = make_buffer(session, max_rows=2, flush_ms=60_000)
+    app.dependency_overrides[service.get_ingest_buffer] = lambda: buffer
+    try:
+        payload = [{"timestamp": 1, "value": 1}, {"timestamp": 2, "value": 2}]
+        params = {"wait": False}
+        response = client.post(values_uri, headers=headers, json=payload, params=params)
+        assert response.status_code == 202
+        response = client.post(
+            values_uri, headers=headers, json=payload[:1], params=params
+        )
+        assert response.status_code == 503
+        assert buffer.stats()["depth"] == 2
+        buffer.close()
+    finally:
+        del app.dependency_overrides[service.get_ingest_buffer]
+    assert buffer.stats()["rejected"] == 1
+    assert buffer.stats()["flushed_rows"] == 2
+
+
+def test_ingest_buffer_isolates_conflicting_submissions(client, session, user):
+    metric = create_metric(session, user, "one")
+    buffer = make_buffer(session, flush_ms=60_000)
+    rows = [{"metric_id": metric.id, "timestamp": 1, "value": 1}]
+    first = buffer.submit(rows)
+    duplicate = buffer.submit(rows)
+    ignored = buffer.submit(rows, "ignore")
+    buffer.close()
+    assert first.result() == 1
+    assert isinstance(duplicate.exception(), exceptions.Conflict)
+    assert ignored.result() == 0
+    assert buffer.stats()["flushed_rows"] == 1
+
+
+def test_metric_retention_settings(client, session, user):
+    metric = create_metric(session, user, "one")
+    uri = f"{config.API_PREFIX}" + config.RETENTION_URI.replace(
+        "{metric_id}", str(metric.id)
+    )
+    headers = get_access_auth_headers(client)
+    response = client.get(uri, headers=headers)
+    assert response.json() == {
+        "raw_days": None,
+        "hourly_days": None,
+        "compacted_until": 0,
+    }
+    payload = {"raw_days": 90, "hourly_days": 365}
+    response = client.put(uri, headers=headers, json=payload)
+    assert response.status_code == 200
+    assert response.json() == {**payload, "compacted_until": 0}
+    payload = {"raw_days": 30, "hourly_days": None}
+    response = client.put(uri, headers=headers, json=payload)
+    assert response.json() == {**payload, "compacted_until": 0}
+    payload = {"raw_days": 30, "hourly_days": 7}
+    assert client.put(uri, headers=headers, json=payload).status_code == 422
+
+
+def test_compaction_downsamples_old_values(client, session, user, internal_headers):
+    metric = create_metric(session, user, "one")
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    retention_uri = config.RETENTION_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    day = 86400
+    payload = [
+        {"timestamp": d * day + h * 3600, "value": d} for d in range(10) for h in (1, 2)
+    ]
+    client.post(f"{config.API_PREFIX}{values_uri}", headers=headers, json=payload)
+    payload = {"raw_days": 3, "hourly_days": 5}
+    client.put(f"{config.API_PREFIX}{retention_uri}", headers=headers, json=payload)
+    now = 10 * day + 600
+
+    report = service.compaction_report(session, now=now)
+    assert (report["values"], report["rollups"]) == (14, 10)
+    assert report["estimated_bytes"] > 0
+    assert len(session.exec(select(ValueEntity)).all()) == 20
+
+    result = service.compact(session, now=now, chunk_rows=3)
+    assert result == {"metrics": 1, "values": 14, "rollups": 10}
+    remaining = session.exec(select(ValueEntity.timestamp)).all()
+    assert min(remaining) == 7 * day + 3600
+    assert service.compaction_report(session, now=now)["values"] == 0
+
+    service.rebuild_rollups(session, metric.id)
+    session.commit()
+    response = client.get(
+        f"{config.API_PREFIX}{values_uri}",
+        headers=headers,
+        params={"bucket": "1d", "agg": "count,sum", "from": 0, "to": 10 * day},
+    )
+    assert response.json() == [
+        {"bucket": d * day, "count": 2, "sum": 2 * d} for d in range(10)
+    ]
+    response = client.get(
+        f"{config.API_PREFIX}{values_uri}",
+        headers=headers,
+        params={"bucket": "1h", "agg": "count", "from": 0, "to": 10 * day},
+    )
+    assert [row["bucket"] // day for row in response.json()] == [
+        d for d in range(5, 10) for _ in range(2)
+    ]
+    uri = f"{config.INTERNAL_PREFIX}{config.COMPACTION_URI}"
+    response = client.get(uri, headers=internal_headers)
+    assert response.json()["values"] == len(remaining)
+    response = client.get(uri, headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 401
+    assert client.get(uri).status_code == 401
+
+
+def test_compaction_resumes_after_a_crash(client, session, user, monkeypatch):
+    metric = create_metric(session, user, "one")
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    retention_uri = config.RETENTION_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    day = 86400
+    payload = [
+        {"timestamp": d * day + h * 3600, "value": d} for d in range(4) for h in (1, 2)
+    ]
+    client.post(f"{config.API_PREFIX}{values_uri}", headers=headers, json=payload)
+    payload = {"raw_days": 1}
+    client.put(f"{config.API_PREFIX}{retention_uri}", headers=headers, json=payload)
+    now = 4 * day + 600
+    delete_in_chunks = service._delete_in_chunks
+
+    def crash(db, metric_id, key, conditions, chunk_rows):
+        # one chunk of the first day goes before the process dies
+        chunk = select(key).where(*conditions).limit(1)
+        db.exec(delete(key.class_).where(*conditions, key.in_(chunk)))
+        db.commit()
+        raise RuntimeError("killed")
+
+    monkeypatch.setattr(service, "_delete_in_chunks", crash)
+    with pytest.raises(RuntimeError):
+        service.compact(session, now=now, chunk_rows=1)
+    monkeypatch.setattr(service, "_delete_in_chunks", delete_in_chunks)
+    assert service.get_retention(session, metric).compacted_until == day
+
+    service.compact(session, now=now, chunk_rows=1)
+    service.rebuild_rollups(session, metric.id)
+    session.commit()
+    response = client.get(
+        f"{config.API_PREFIX}{values_uri}",
+        headers=headers,
+        params={"bucket": "1d", "agg": "count,sum", "from": 0, "to": 4 * day},
+    )
+    assert response.json() == [
+        {"bucket": d * day, "count": 2, "sum": 2 * d} for d in range(4)
+    ]
+
+
+def test_get_metric_stats(client, session, user):
+    metric = create_metric(session, user, "one")
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    stats_uri = config.METRIC_STATS_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    response = client.get(f"{config.API_PREFIX}{stats_uri}", headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {
+        "count": 0,
+        "mean": None,
+        "stddev": None,
+        "min": None,
+        "max": None,
+        "p50": None,
+        "p95": None,
+        "p99": None,
+    }
+
+    day = 86400
+    payload = [{"timestamp": ts * 900, "value": ts % 100} for ts in range(3 * 96)]
+    client.post(f"{config.API_PREFIX}{values_uri}", headers=headers, json=payload)
+    response = client.get(f"{config.API_PREFIX}{stats_uri}", headers=headers)
+    stats = response.json()
+    assert stats["count"] == 288
+    assert stats["mean"] == pytest.approx(sum(ts % 100 for ts in range(288)) / 288)
+    assert (stats["min"], stats["max"]) == (0, 99)
+    ordered = sorted(ts % 100 for ts in range(288))
+    assert stats["p50"] == pytest.approx(ordered[144], abs=1)
+    assert stats["p99"] == pytest.approx(ordered[285], abs=1)
+
+    # the range mixes a whole day, whole hours and raw values at both edges
+    start, end = 3600 + 1800, 2 * day + 7200 + 900
+    response = client.get(
+        f"{config.API_PREFIX}{stats_uri}",
+        headers=headers,
+        params={"from": start, "to": end},
+    )
+    values = [ts % 100 for ts in range(288) if start <= ts * 900 < end]
+    stats = response.json()
+    assert stats["count"] == len(values)
+    assert stats["mean"] == pytest.approx(sum(values) / len(values))
+    assert (stats["min"], stats["max"]) == (min(values), max(values))
+
+    payload = [{"timestamp": 0, "value": 1000}]
+    client.post(
+        f"{config.API_PREFIX}{values_uri}",
+        headers=headers,
+        json=payload,
+        params={"on_conflict": "overwrite"},
+    )
+    stats = client.get(f"{config.API_PREFIX}{stats_uri}", headers=headers).json()
+    assert (stats["count"], stats["max"]) == (288, 1000)
+
+    uri = config.METRIC_STATS_URI.replace("{metric_id}", str(uuid4()))
+    response = client.get(f"{config.API_PREFIX}{uri}", headers=headers)
+    assert response.status_code == 404
+
+
+def test_sketches_are_refreshed_off_the_write_path(client, session, user):
+    metric = create_metric(session, user, "one")
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    stats_uri = config.METRIC_STATS_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    day = 86400
+    payload = [{"timestamp": ts * 900, "value": ts % 100} for ts in range(3 * 96)]
+    client.post(f"{config.API_PREFIX}{values_uri}", headers=headers, json=payload)
+    assert session.exec(select(SketchEntity)).all() == []
+    before = client.get(f"{config.API_PREFIX}{stats_uri}", headers=headers).json()
+    assert before["count"] == 288
+
+    assert service.refresh_sketches(session) == {"metrics": 1, "days": 3}
+    assert service.refresh_sketches(session) == {"metrics": 0, "days": 0}
+    after = client.get(f"{config.API_PREFIX}{stats_uri}", headers=headers).json()
+    assert after == before
+
+    # a later write makes only its own day stale until the next refresh
+    payload = [{"timestamp": day + 1, "value": 500}]
+    client.post(f"{config.API_PREFIX}{values_uri}", headers=headers, json=payload)
+    stats = client.get(f"{config.API_PREFIX}{stats_uri}", headers=headers).json()
+    assert (stats["count"], stats["max"]) == (289, 500)
+    response = client.get(
+        f"{config.API_PREFIX}{stats_uri}",
+        headers=headers,
+        params={"from": day, "to": 2 * day},
+    )
+    assert (response.json()["count"], response.json()["max"]) == (97, 500)
+    assert service.refresh_sketches(session) == {"metrics": 1, "days": 1}
+    stats = client.get(f"{config.API_PREFIX}{stats_uri}", headers=headers).json()
+    assert (stats["count"], stats["max"]) == (289, 500)
+
+
+def test_stats_follow_compaction_and_rebuild(client, session, user):
+    metric = create_metric(session, user, "one")
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    retention_uri = config.RETENTION_URI.replace("{metric_id}", str(metric.id))
+    stats_uri = config.METRIC_STATS_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    day = 86400
+    payload = [
+        {"timestamp": d * day + h * 3600, "value": d} for d in range(10) for h in (1, 2)
+    ]
+    client.post(f"{config.API_PREFIX}{values_uri}", headers=headers, json=payload)
+    payload = {"raw_days": 3, "hourly_days": 5}
+    client.put(f"{config.API_PREFIX}{retention_uri}", headers=headers, json=payload)
+    before = client.get(f"{config.API_PREFIX}{stats_uri}", headers=headers).json()
+
+    service.compact(session, now=10 * day + 600, chunk_rows=3)
+    # rebuilding recomputes the days still held raw and keeps compacted ones
+    sketches = select(SketchEntity).where(SketchEntity.resolution == day)
+    session.exec(delete(SketchEntity).where(SketchEntity.bucket >= 7 * day))
+    service.rebuild_rollups(session, metric.id)
+    assert len(session.exec(sketches).all()) == 10
+    session.commit()
+    after = client.get(f"{config.API_PREFIX}{stats_uri}", headers=headers).json()
+    assert after["count"] == before["count"] == 20
+    assert after["mean"] == pytest.approx(before["mean"])
+    assert after["stddev"] == pytest.approx(before["stddev"])
+    assert (after["min"], after["max"]) == (0, 9)
+    response = client.get(
+        f"{config.API_PREFIX}{stats_uri}",
+        headers=headers,
+        params={"from": 0, "to": 5 * day},
+    )
+    assert response.json()["count"] == 10
+    assert response.json()["mean"] == pytest.approx(2)
+
+
+def test_writes_behind_the_compaction_horizon_change_nothing(client, session, user):
+    metric = create_metric(session, user, "one")
+    values_uri = config.VALUES_URI.replace("{metric_id}", str(metric.id))
+    retention_uri = config.RETENTION_URI.replace("{metric_id}", str(metric.id))
+    stats_uri = config.METRIC_STATS_URI.replace("{metric_id}", str(metric.id))
+    headers = get_access_auth_headers(client)
+    day = 86400
+    payload = [
+        {"timestamp": d * day + h * 3600, "value": d} for d in range(10) for h in (1, 2)
+    ]
+    client.post(f"{config.API_PREFIX}{values_uri}", headers=headers, json=payload)
+    payload = {"raw_days": 3, "hourly_days": 5}
+    client.put(f"{config.API_PREFIX}{retention_uri}", headers=headers, json=payload)
+    service.compact(session, now=10 * day + 600)
+    service.refresh_sketches(session)
+
+    def snapshot():
+        session.expire_all()
+        rollups = session.exec(
+            select(RollupEntity).order_by(
+                RollupEntity.resolution,  # type: ignore
+                RollupEntity.bucket,  # type: ignore
+            )
+        ).all()
+        stats = client.get(f"{config.API_PREFIX}{stats_uri}", headers=headers)
+        overview = client.get(
+            f"{config.API_PREFIX}{config.METRICS_URI}",
+            headers=headers,
+            params={"overview": True},
+        )
+        return [r.model_dump() for r in rollups], stats.json(), overview.json()
+
+    before = snapshot()
+    assert before[2][0]["count"] == 20
+    late = [{"timestamp": day + 3600, "value": 0}, {"timestamp": 9 * day, "value": 9}]
+    for on_conflict in ("reject", "overwrite"):
+        response = client.post(
+            f"{config.API_PREFIX}{values_uri}",
+            headers=headers,
+            json=late,
+            params={"on_conflict": on_conflict},
+        )
+        assert response.status_code == 409
+    response = client.post(
+        f"{config.API_PREFIX}{values_uri}",
+        headers=headers,
+        json=late[:1],
+        params={"on_conflict": "ignore"},
+    )
+    assert response.json() == {"inserted": 0}
+    service.refresh_sketches(session)
+    assert snapshot() == before
+
+    # the live part of a mixed batch is still written under ignore
+    response = client.post(
+        f"{config.API_PREFIX}{values_uri}",
+        headers=headers,
+        json=late,
+        params={"on_conflict": "ignore"},
+    )
+    assert response.json() == {"inserted": 1}
+
+
+def test_block_storage_matches_row_storage(client, session, user, monkeypatch):
+    metric = create_metric(session, user, "one")
+    uri = f"{config.API_PREFIX}" + config.VALUES_URI.replace(
+        "{metric_id}", str(metric.id)
+    )
+    headers = get_access_auth_headers(client)
+    day = 86400
+    payload = [{"timestamp": ts, "value": ts % 97} for ts in range(0, 3 * day, 1800)]
+    client.post(uri, headers=headers, json=payload)
+    queries = [
+        {},
+        {"from": day - 1, "to": 2 * day + 1, "order": "desc"},
+        {"bucket": "5h", "agg": "count,sum,avg,min,max,first,last", "from": 7},
+        {"bucket": "1d", "agg": "count,sum,first,last"},
+        {"bucket": "2h", "agg": "max", "limit": 3, "order": "desc"},
+    ]
+
+    def read(params):
+        body = client.get(uri, headers=headers, params=params).json()
+        return [{k: v for k, v in row.items() if k != "id"} for row in body]
+
+    expected = [read(params) for params in queries]
+    monkeypatch.setattr(config, "VALUES_STORAGE", "blocks")
+    result = service.seal_blocks(session, now=2 * day + config.BLOCK_SEAL_GRACE_SECONDS)
+    assert result == {"metrics": 1, "blocks": 2, "values": 96}
+    assert len(session.exec(select(ValueEntity)).all()) == 48
+    assert [read(params) for params in queries] == expected
+
+    # conflict policies apply to sealed points as well as staged ones
+    overwrite = [{"timestamp": 1800, "value": 50}, {"timestamp": 3 * day, "value": 1}]
+    response = client.post(uri, headers=headers, json=overwrite)
+    assert response.status_code == 409
+    params = {"on_conflict": "ignore"}
+    response = client.post(uri, headers=headers, json=overwrite, params=params)
+    assert response.json() == {"inserted": 1}
+    assert read({"bucket": "1d", "agg": "count,sum"}) == [
+        {"bucket": row["bucket"], "count": row["count"], "sum": row["sum"]}
+        for row in expected[3]
+    ] + [{"bucket": 3 * day, "count": 1, "sum": 1}]
+
+    # a re-sent sealed point is staged, replaces the sealed one and fixes rollups
+    params = {"on_conflict": "overwrite"}
+    response = client.post(uri, headers=headers, json=overwrite[:1], params=params)
+    assert response.json() == {"inserted": 1}
+    service.seal_blocks(session, now=3 * day + config.BLOCK_SEAL_GRACE_SECONDS)
+    assert session.exec(select(ValueEntity.timestamp)).all() == [3 * day]
+    daily = read({"bucket": "1d", "agg": "count,sum"})
+    total = sum(ts % 97 for ts in range(0, day, 1800)) - 1800 % 97 + 50
+    assert daily[0] == {"bucket": 0, "count": 48, "sum": total}
+
+    response = client.get(uri, headers=headers, params={"limit": 40})
+    page = response.json()
+    response = client.get(
+        uri,
+        headers=headers,
+        params={"limit": 200, "cursor": response.headers[config.NEXT_CURSOR_HEADER]},
+    )
+    timestamps = [row["timestamp"] for row in page + response.json()]
+    assert timestamps == list(range(0, 3 * day, 1800)) + [3 * day]
+    assert page[1]["value"] == "50.0"
+    response = client.get(uri, headers=headers, params={"from": 0, "to": 3600})
+    assert [row["value"] for row in response.json()] == ["0.0", "50.0"]
+
+    service.rebuild_rollups(session, metric.id)
+    session.commit()
+    assert read({"bucket": "1d", "agg": "count,sum"}) == daily
+    session.exec(delete(BlockEntity))
+    session.commit()
+
+
+def test_subscribe_values_streams_committed_points(client, session, user):
+    metric = create_metric(session, user, "one")
+    values_uri = f"{config.API_PREFIX}" + config.VALUES_URI.replace(
+        "{metric_id}", str(metric.id)
+    )
+    events_uri = f"{config.API_PREFIX}" + config.VALUES_EVENTS_URI.replace(
+        "{metric_id}", str(metric.id)
+    )
+    headers = get_access_auth_headers(client)
+
+    def publish():
+        deadline = time.monotonic() + 5
+        while not service.hub.stats()["subscribers"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        payload = [{"timestamp": 2, "value": 2}, {"timestamp": 1, "value": 1}]
+        client.post(values_uri, headers=headers, json=payload)
+
+    publisher = threading.Thread(target=publish)
+    publisher.start()
+    response = client.get(events_uri, headers=headers, params={"limit": 1})
+    publisher.join()
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    event = response.text.split("\n\n")[1].split("\n")
+    assert event[0] == "event: values"
+    assert json.loads(event[1].removeprefix("data: ")) == {
+        "metric_id": str(metric.id),
+        "values": [
+            {"timestamp": 1, "value": "1.0"},
+            {"timestamp": 2, "value": "2.0"},
+        ],
+    }
+    assert service.hub.stats()["subscribers"] == 0
+
+
+def test_only_committed_values_are_published(session, user):
+    metric = create_metric(session, user, "one")
+    payload = [ValueRequest(timestamp=1, value=1)]
+
+    async def scenario():
+        subscription = service.hub.subscribe([metric.id])
+        try:
+            service.add_values(session, metric, payload)
+            with pytest.raises(exceptions.Conflict):
+                service.add_values(session, metric, payload)
+            service.add_values(session, metric, payload, "ignore")
+            await asyncio.sleep(0)
+            return [
+                subscription.queue.get_nowait()
+                for _ in range(subscription.queue.qsize())
+            ]
+        finally:
+            service.hub.unsubscribe(subscription)
+
+    assert asyncio.run(scenario()) == [(metric.id, [(1, "1.0")])]
+
+
+def test_subscribe_metrics_values_checks_ownership(client, session, user):
+    metric = create_metric(session, user, "one")
+    events_uri = f"{config.API_PREFIX}{config.METRICS_EVENTS_URI}"
+    headers = get_access_auth_headers(client)
+    params = {"metric_id": [str(metric.id), str(uuid4())]}
+    response = client.get(events_uri, headers=headers, params=params)
+    assert response.status_code == 404
+    response = client.get(events_uri, headers=headers)
+    assert response.status_code == 422
@@ -0,0 +1,58 @@
+import random
+import statistics
+
+import pytest
+from app.sketch import Summary, TDigest
+
+
+def test_empty_summary():
+    summary = Summary.of([], 100)
+    assert summary.count == 0
+    assert summary.stddev is None
+    assert summary.quantile(0.5) is None
+    assert summary.digest.to_bytes() == b""
+    assert TDigest.from_bytes(b"", 100).count == 0
+    summary.merge(Summary.of([], 100))
+    assert summary.count == 0
+
+
+def test_small_inputs_are_exact():
+    summary = Summary.of([float(i) for i in range(1, 101)], 100)
+    assert summary.quantile(0.5) == 50.5
+    assert summary.quantile(0) == 1
+    assert summary.quantile(1) == 100
+    assert summary.stddev == pytest.approx(statistics.stdev(range(1, 101)))
+    assert Summary.of([7.5], 100).quantile(0.99) == 7.5
+    assert Summary.of([7.5], 100).stddev == 0.0
+
+
+def test_merged_summaries_match_the_whole():
+    rng = random.Random(1)
+    values = [round(rng.gauss(100, 20), 1) for _ in range(50_000)]
+    merged = Summary.of([], 100)
+    for offset in range(0, len(values), 1000):
+        merged.merge(Summary.of(values[offset : offset + 1000], 100))
+    assert merged.count == len(values)
+    assert merged.mean == pytest.approx(statistics.fmean(values))
+    assert merged.stddev == pytest.approx(statistics.stdev(values))
+    assert merged.digest.min == min(values)
+    assert merged.digest.max == max(values)
+    ordered = sorted(values)
+    for q in (0.01, 0.5, 0.95, 0.99):
+        exact = ordered[int(q * len(ordered))]
+        assert merged.quantile(q) == pytest.approx(exact, abs=0.5)
+    assert len(merged.digest.means) <= 100
+
+
+def test_digest_round_trips_compactly():
+    rng = random.Random(2)
+    digest = TDigest(100)
+    digest.update(rng.uniform(0, 999) for _ in range(10_000))
+    data = digest.to_bytes()
+    assert len(data) < 1024
+    restored = TDigest.from_bytes(data, 100)
+    assert restored.count == digest.count
+    assert (restored.min, restored.max) == (digest.min, digest.max)
+    assert restored.quantile(0.9) == pytest.approx(digest.quantile(0.9), rel=1e-6)
+    with pytest.raises(ValueError):
+        TDigest.from_bytes(b"\x09" + data[1:], 100)
@@ -0,0 +1,89 @@
+from datetime import datetime, timezone
+
+import pytest
+from dateutil import parser
+
+from app import timestamps
+from app.timestamps import TimestampParser, parse_timestamp
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "01/11/2025 08:01:55",
+        "1/2/2025 8:01:55",
+        "01/11/2025 08:01",
+        "01/11/2025",
+        "01-11-2025 08:01:55",
+        "01.11.2025 08:01:55",
+        "31.12.1999T23:59:59",
+    ],
+)
+def test_dayfirst_matches_dateutil(value):
+    expected = int(parser.parse(value, dayfirst=True).timestamp())
+    assert parse_timestamp(value) == expected
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        (1700000000, 1700000000),
+        (1700000000.9, 1700000000),
+        ("1700000000", 1700000000),
+        ("1700000000.5", 1700000000),
+        ("2025-11-01T08:01:55Z", 1761984115),
+        ("2025-11-01T08:01:55+02:00", 1761976915),
+    ],
+)
+def test_epoch_and_iso(value, expected):
+    assert parse_timestamp(value) == expected
+
+
+def test_compact_dates_are_not_read_as_epoch():
+    expected = datetime(2025, 11, 1).timestamp()
+    assert parse_timestamp("20251101") == int(expected)
+    assert parse_timestamp("12345678") == 12345678
+    assert parse_timestamp("3") == 3
+
+    parse = TimestampParser()
+    assert parse("1700000000") == 1700000000
+    assert parse("20251101") == int(expected)
+    assert parse("1700000001") == 1700000001
+
+
+@pytest.mark.parametrize(
+    "value", ["20240102", "2024-01-02", "2024/01/02", "2024.01.02"]
+)
+def test_year_first_dates_read_month_before_day(value):
+    # a deliberate change: the old dateutil call read all of these as Feb 1
+    baseline = parser.parse(value, dayfirst=True)
+    assert (baseline.month, baseline.day) == (2, 1)
+    assert parse_timestamp(value) == int(datetime(2024, 1, 2).timestamp())
+
+
+def test_year_first_dates_with_time():
+    expected = datetime(2024, 1, 2, 8, 1, 55).timestamp()
+    assert parse_timestamp("2024/01/02 08:01:55") == int(expected)
+    assert parse_timestamp("2024.1.2T08:01:55") == int(expected)
+
+
+def test_iso_is_not_read_day_first():
+    expected = datetime(2025, 11, 1, 8, 1, 55).timestamp()
+    assert parse_timestamp("2025-11-01 08:01:55") == int(expected)
+
+
+def test_fallback_to_dateutil():
+    expected = datetime(2025, 11, 1, tzinfo=timezone.utc).timestamp()
+    assert parse_timestamp("Nov 1 2025 00:00 UTC") == int(expected)
+    with pytest.raises(ValueError):
+        parse_timestamp("not a date")
+
+
+def test_detected_format_is_reused(monkeypatch):
+    parse = TimestampParser()
+    parse("01/11/2025 08:01:55")
+    assert parse.parse is timestamps.parse_dayfirst
+    assert parse("2025-11-01T08:01:55Z") == 1761984115
+    assert parse.parse is timestamps.parse_iso
+    monkeypatch.setattr(timestamps, "FAST_PARSERS", ())
+    assert parse("2025-11-02T08:01:55Z") == 1761984115 + 86400